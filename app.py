@@ -4,22 +4,24 @@ from flask_cors import CORS
 from zk import ZK, const
 from datetime import datetime, timedelta
 from collections import defaultdict
-import requests
 import logging
 import os
-import json
 import sys
 import time
 import re
 import threading
 from functools import wraps
-
-# Disable SSL warnings to clean up console output
-import urllib3
-urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+from contextlib import contextmanager
+from config_service import config_service, get_config_dir
+from app_logging import queue_logging, LazyPreview
+import request_timing
+from request_timing import span
+from jobs import report_progress
+from conditional import validators
+from metrics import (timed, http_outcome, DEVICE_READ_SECONDS, DEVICE_RECORDS_READ,
+                     RECORD_FORMAT_SECONDS, UPSTREAM_POST_SECONDS, UPSTREAM_RECORDS_SENT)
 
 app = Flask(__name__)
-app.secret_key = os.urandom(24)
 CORS(app)
 
 # Add context processor to provide 'now' variable to all templates
@@ -39,12 +41,17 @@ console_handler = logging.StreamHandler(sys.stdout)
 console_handler.setLevel(logging.WARNING)
 console_handler.setFormatter(logging.Formatter(LOG_FORMAT))
 
-# Configure root logger
-logging.basicConfig(level=logging.INFO, handlers=[file_handler, console_handler])
+# Configure root logger; handlers run on a background thread so request
+# threads never block on app.log or the console
+queue_logging.start([file_handler, console_handler], level=logging.INFO)
 
 # Get application logger
 logger = logging.getLogger('zk-app')
 
+# Log categories sampled by app_logging (see DEFAULT_SAMPLING / ZK_LOG_SAMPLING)
+SEND_RECORD_LOG = {'category': 'send.record'}
+API_RESPONSE_LOG = {'category': 'api.response'}
+
 # Set other loggers to WARNING level
 logging.getLogger('zk').setLevel(logging.WARNING)
 logging.getLogger('urllib3').setLevel(logging.WARNING)
@@ -53,127 +60,86 @@ logging.getLogger('werkzeug').setLevel(logging.WARNING)
 DEFAULT_PORT = 4370
 DEFAULT_TIMEOUT = 5
 
-# Define the path to the SAS_attendance folder on D: drive for executable mode
-# or use the current directory for development mode
-def get_config_dir():
-    # Check if running as executable (PyInstaller sets this attribute)
-    if getattr(sys, 'frozen', False):
-        # Disable logging when running as executable
-        for handler in logger.handlers[:]:  # Make a copy of the list to avoid modification during iteration
-            logger.removeHandler(handler)
-        
-        # Running as executable - use D:\SAS_attendance\
-        config_dir = os.path.join('D:\\', 'SAS_attendance')
-        # Create the directory if it doesn't exist
-        if not os.path.exists(config_dir):
-            try:
-                os.makedirs(config_dir)
-            except Exception:
-                pass  # Silently handle errors when running as executable
-        return config_dir
-    else:
-        # Running in development mode - use current directory
-        return os.path.dirname(os.path.abspath(__file__))
-
-# Get the appropriate config directory
+def import_requests():
+    """The requests module, imported on first use
+    
+    Only calls to the attendance API need it, and requests with urllib3 is
+    one of the slowest imports at startup.
+    """
+    import requests
+    import urllib3
+    # Disable SSL warnings to clean up console output
+    urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+    return requests
+
+# Get the appropriate config directory (D:\SAS_attendance for the executable)
 APP_CONFIG_DIR = get_config_dir()
 
-# Define the exact path to config.json and devices.json
-CONFIG_PATH = os.path.join(APP_CONFIG_DIR, 'config.json')
+# Disable logging when running as executable
+if getattr(sys, 'frozen', False):
+    for handler in logger.handlers[:]:  # Make a copy of the list to avoid modification during iteration
+        logger.removeHandler(handler)
+
+def get_secret_key():
+    """Session signing key shared by every server process
+    
+    Taken from ZK_SECRET_KEY, otherwise generated once and kept in the
+    secret_key file next to config.json, so sessions survive restarts and
+    work across several server processes.
+    """
+    if os.environ.get('ZK_SECRET_KEY'):
+        return os.environ['ZK_SECRET_KEY']
+    path = os.path.join(APP_CONFIG_DIR, 'secret_key')
+    try:
+        with open(path) as f:
+            key = f.read().strip()
+        if key:
+            return key
+    except FileNotFoundError:
+        pass
+    key = os.urandom(32).hex()
+    try:
+        # O_EXCL: if another process created the file first, use its key
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            f.write(key)
+    except FileExistsError:
+        with open(path) as f:
+            key = f.read().strip()
+    except OSError as e:
+        logger.warning(f"Could not save secret key to {path}, sessions will not survive a restart: {str(e)}")
+    return key
+
+app.secret_key = get_secret_key()
+
+# config.json is owned by the config service; devices.json is legacy, read-only
+CONFIG_PATH = config_service.config_path
 DEVICES_PATH = os.path.join(APP_CONFIG_DIR, 'devices.json')
 
-# No need to create additional config directory since we handle it in get_config_dir()
+# No need to create additional config directory since config_service.get_config_dir() handles it
+
+# Per-request Server-Timing spans; profiles of opted-in requests go to profiles/
+request_timing.init_app(app, os.path.join(APP_CONFIG_DIR, 'profiles'))
 
 def get_config():
     """Get configuration from config.json file
     
-    If the config file doesn't exist, creates it with default values
-    When running as executable, only stores essential information
+    Returns a read-only snapshot served from memory; the file is only re-read
+    when its mtime or size changes. If the config file doesn't exist, creates it
+    with default values. Use update_config() or save_config() to change settings.
     """
-    # Use the global CONFIG_PATH
-    config_file = CONFIG_PATH
-    
-    # Only log in development mode
-    if not getattr(sys, 'frozen', False):
-        logger.info(f"Loading config from: {config_file}")
-    
-    # Define all expected fields and their defaults
-    default_config = {
-        'registered_devices': {},
-        'active_device': '',
-        'attendance_api_url': '',
-        'employees_api_url': '',
-        'last_successful_send': {
-            'last_send_time': '',
-            'last_send_data': {
-                'count': 0,
-                'summary': ''
-            }
-        },
-        'base_api_url': '',
-        'api_token': ''
-    }
-
-    config = default_config.copy()
-    if os.path.exists(config_file):
-        try:
-            with open(config_file, 'r') as f:
-                loaded = json.load(f)
-                # Merge loaded config with defaults
-                for k, v in default_config.items():
-                    if k in loaded:
-                        config[k] = loaded[k]
-        except Exception as e:
-            logger.error(f"Error loading config: {str(e)}")
-    # Save config if missing any keys (migration)
-    if not os.path.exists(config_file) or any(k not in loaded for k in default_config):
-        save_config(config)
-    return config
+    return config_service.snapshot()
 
 def save_config(config):
     """Save configuration to config.json file
     
     When running as executable, always save all expected fields, including new ones.
     """
-    # Use the global CONFIG_PATH
-    config_file = CONFIG_PATH
-    
-    # Only log in development mode
-    if not getattr(sys, 'frozen', False):
-        logger.info(f"Saving config to: {config_file}")
-    # Always include all fields
-    default_config = {
-        'registered_devices': {},
-        'active_device': '',
-        'attendance_api_url': '',
-        'employees_api_url': '',
-        'last_successful_send': {
-            'last_send_time': '',
-            'last_send_data': {
-                'count': 0,
-                'summary': ''
-            }
-        },
-        'base_api_url': '',
-        'api_token': ''
-    }
-    config_to_save = default_config.copy()
-    for k in default_config:
-        if k in config:
-            config_to_save[k] = config[k]
-    try:
-        with open(config_file, 'w') as f:
-            json.dump(config_to_save, f, indent=4)
-            f.flush()
-            os.fsync(f.fileno())  # Force write to disk
-        if not getattr(sys, 'frozen', False):
-            logger.info(f"Config saved successfully to {config_file}")
-    except Exception as e:
-        if not getattr(sys, 'frozen', False):
-            logger.error(f"Error saving config file: {str(e)}")
-        # Don't raise exception in executable mode
-        if not getattr(sys, 'frozen', False):
-            raise
+    config_service.save(config)
+
+def update_config(changes):
+    """Apply top-level setting changes to config.json and return the new snapshot"""
+    return config_service.update(changes)
 
 def connect_to_device(device_id=None):
     """Connect to ZK device using the device manager
@@ -194,10 +160,147 @@ def connect_to_device(device_id=None):
         logger.error(f"Error connecting to device: {str(e)}")
         raise ConnectionError(f"Failed to connect to device: {str(e)}")
 
+@contextmanager
+def device_session(device_id=None):
+    """Open a serialized session with a ZK device using the device manager
+    
+    Commands for the same device run one session at a time; the connection
+    is always disconnected when the block exits.
+    """
+    # Import here to avoid circular imports
+    from device_manager import device_manager
+    
+    # If no devices are registered, raise an error
+    if not device_manager.get_all_devices():
+        raise ValueError("No devices registered. Please add a device in the settings.")
+    
+    with device_manager.device_session(device_id) as conn:
+        yield conn
+
+def _read_attendance(conn, device_id):
+    """Download attendance records from an open session, recording metrics"""
+    with timed(DEVICE_READ_SECONDS, device=device_id, operation='get_attendance'):
+        records = conn.get_attendance()
+    DEVICE_RECORDS_READ.inc(len(records), device=device_id, kind='attendance')
+    return records
+
+def _read_users(conn, device_id):
+    """Download users from an open session, recording metrics"""
+    with timed(DEVICE_READ_SECONDS, device=device_id, operation='get_users'):
+        users = conn.get_users()
+    DEVICE_RECORDS_READ.inc(len(users), device=device_id, kind='users')
+    return users
+
+def _store_download(device_id, records=None, users=None):
+    """Feed a device download into the attendance store without failing the caller"""
+    try:
+        if records is not None:
+            attendance_store.ingest(device_id, records)
+        if users is not None:
+            attendance_store.ingest_users(device_id, users)
+    except Exception as e:
+        logger.error(f"Error storing download from device {device_id}: {str(e)}")
+
+def _with_archived(device_id, records, start_date=None, end_date=None):
+    """Add punches cleared from the device by retention back from the store
+    
+    Only reads archived punches on or between two YYYY-MM-DD dates (either
+    may be empty), so the cost follows the requested range. They are loaded
+    as PunchColumns (about 20 bytes per punch) and only those not also on
+    the device become Attendance records.
+    """
+    try:
+        through = attendance_store.trimmed_through(device_id)
+        if through is None:
+            return records
+        columns = attendance_store.load_columns(start_date, end_date, [device_id], through=through)
+        if not len(columns):
+            return records
+        from zk.attendance import Attendance
+        on_device = {(str(r.user_id), r.timestamp) for r in records}
+        archived = [Attendance(user_id, timestamp, status, punch)
+                    for _, user_id, timestamp, punch, status, _ in columns.rows()
+                    if (user_id, timestamp) not in on_device]
+        return archived + list(records)
+    except Exception as e:
+        logger.error(f"Error reading archived punches of device {device_id}: {str(e)}")
+        return records
+
+def _acknowledge_sent(device_id, records):
+    """Mark punches as acknowledged upstream without failing the caller"""
+    try:
+        attendance_store.mark_sent(device_id, [
+            (str(r.user_id), r.timestamp.strftime('%Y-%m-%d %H:%M:%S')) for r in records])
+    except Exception as e:
+        logger.error(f"Error recording sent punches of device {device_id}: {str(e)}")
+
+def fetch_attendance(device_id=None, set_active=True, history=False, start_date=None, end_date=None):
+    """Download attendance records, sharing concurrent identical downloads
+
+    Background callers pass set_active=False so the download does not make
+    the device the active one (see DeviceManager.connect_to_device).
+    Callers that show or send punches pass history=True to get back the
+    punches retention cleared from the device, within start_date..end_date.
+    """
+    from device_manager import device_manager
+    device_id = device_manager.resolve_device_id(device_id)
+    # Stored once per device read, not once per coalesced caller
+    records = device_manager.read_shared(
+        'attendance', lambda conn: _read_attendance(conn, device_id), device_id, set_active=set_active,
+        after=lambda records: _store_download(device_id, records=records))
+    if history:
+        return _with_archived(device_id, records, start_date, end_date)
+    return records
+
+def fetch_users(device_id=None):
+    """Download users, sharing concurrent identical downloads"""
+    from device_manager import device_manager
+    device_id = device_manager.resolve_device_id(device_id)
+    users = device_manager.read_shared(
+        'users', lambda conn: _read_users(conn, device_id), device_id,
+        after=lambda users: _store_download(device_id, users=users))
+    return users
+
+def fetch_attendance_and_users(device_id=None, history=False, start_date=None, end_date=None):
+    """Download attendance records and users in one shared device session
+    
+    history, start_date and end_date work as for fetch_attendance.
+    """
+    from device_manager import device_manager
+    device_id = device_manager.resolve_device_id(device_id)
+    records, users = device_manager.read_shared(
+        'attendance_users',
+        lambda conn: (_read_attendance(conn, device_id), _read_users(conn, device_id)),
+        device_id, after=lambda result: _store_download(device_id, records=result[0], users=result[1]))
+    if history:
+        return _with_archived(device_id, records, start_date, end_date), users
+    return records, users
+
+def active_device_label():
+    """Active device ID for metric labels, empty when none is set"""
+    from device_manager import device_manager
+    try:
+        return device_manager.get_active_device_id() or ''
+    except Exception:
+        return ''
+
 def get_punch_type_text(punch_type):
     punch_dict = {0: "1", 1: "2", 2: "3", 3: "4", 4: "5", 5: "6"}
     return punch_dict.get(punch_type, "Unknown")
 
+def filter_attendance_by_date(attendance_records, start_date=None, end_date=None):
+    """Keep records stamped on or between two YYYY-MM-DD dates (either may be empty)"""
+    if not start_date and not end_date:
+        return attendance_records
+    
+    start_dt = datetime.strptime(start_date, '%Y-%m-%d') if start_date else datetime.min
+    end_dt = datetime.strptime(end_date, '%Y-%m-%d') if end_date else datetime.max
+    if end_date:
+        end_dt = end_dt.replace(hour=23, minute=59, second=59)
+    
+    # Compare datetimes directly rather than formatting every timestamp
+    return [record for record in attendance_records if start_dt <= record.timestamp <= end_dt]
+
 def organize_attendance(attendance_records):
     user_records = defaultdict(list)
     for record in attendance_records:
@@ -242,24 +345,55 @@ def require_device_connection(f):
         return f(*args, **kwargs)
     return decorated_function
 
+def device_info_response():
+    """Active device details answered from the health monitor cache"""
+    return jsonify(device_info_payload())
+
+def device_info_payload():
+    """Active device details from the health monitor cache, as a response dict
+    
+    Never connects to the device: reachability and metadata come from the
+    background probes. Only the very first request for a device waits for a
+    quick TCP probe; its metadata is then filled in by the monitor.
+    """
+    from device_manager import device_manager
+    
+    device_id = device_manager.get_active_device_id()
+    device = device_manager.get_device(device_id)
+    
+    health_monitor.ensure_started()
+    health = health_monitor.get(device_id)
+    if health is None:
+        health = health_monitor.probe(device_id, metadata=False) or {}
+        health_monitor.wake()
+    
+    device_info = {
+        "id": device_id,
+        "name": device.get('name', 'Unknown'),
+        "ip": device.get('ip', 'Unknown'),
+        "port": device.get('port', 4370),
+        "last_connected": device.get('last_connected', None),
+        "reachable": health.get('reachable', False),
+        "latency_ms": health.get('latency_ms'),
+        "checked_at": health.get('checked_at'),
+        "last_seen": health.get('last_seen')
+    }
+    for field in ('serial_number', 'firmware_version', 'platform', 'device_name', 'mac', 'workcode'):
+        device_info[field] = health.get(field)
+    
+    if health.get('reachable'):
+        return {"status": "success", "device_info": device_info}
+    return {
+        "status": "warning",
+        "device_info": device_info,
+        "message": f"Device configured but not reachable: {health.get('error') or 'not checked yet'}"
+    }
+
 @app.route('/api/device-info', methods=['GET'])
 @require_device_connection
 def get_device_info():
     try:
-        conn = connect_to_device()
-        info = conn.get_device_info()
-        
-        device_info = {
-            "status": "success",
-            "serial_number": info.serial_number,
-            "oem_vendor": info.oem_vendor,
-            "platform": info.platform,
-            "firmware_version": info.firmware_version,
-            "mac": info.mac
-        }
-        
-        conn.disconnect()
-        return jsonify(device_info)
+        return device_info_response()
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
 
@@ -267,34 +401,37 @@ def get_device_info():
 @require_device_connection
 def get_users():
     try:
-        conn = connect_to_device()
-        try:
-            logger.info("Connected to device, fetching users...")
-            users = conn.get_users()
-            
-            if not users:
-                logger.warning("No users found on device")
-                return jsonify({"status": "success", "users": []})
-            
-            logger.info(f"Found {len(users)} users")
-            
-            formatted_users = []
-            for user in users:
-                formatted_users.append({
-                    "id": user.user_id,
-                    "name": user.name,
-                    "uid": user.uid,
-                    "privilege": user.privilege,
-                    "password": user.password if hasattr(user, 'password') else "",
-                    "group_id": user.group_id if hasattr(user, 'group_id') else "",
-                    "card": user.card if hasattr(user, 'card') else ""
-                })
-            
-            logger.info(f"Successfully processed {len(formatted_users)} users")
-            return jsonify({"status": "success", "users": formatted_users})
-        finally:
-            conn.disconnect()
-            logger.info("Device disconnected")
+        from device_manager import device_manager
+        device_id = device_manager.get_active_device_id()
+        # Always read the device: the stored data version only follows
+        # attendance, so user changes made on the terminal would go unnoticed.
+        # The body ETag still answers unchanged user lists with a 304.
+        key = validators.request_key(device_id)
+        
+        logger.info("Fetching users from device...")
+        users = fetch_users(device_id)
+        
+        if not users:
+            logger.warning("No users found on device")
+            return validators.conditional(jsonify({"status": "success", "users": []}), key)
+        
+        logger.info(f"Found {len(users)} users")
+        
+        formatted_users = []
+        for user in users:
+            formatted_users.append({
+                "id": user.user_id,
+                "name": user.name,
+                "uid": user.uid,
+                "privilege": user.privilege,
+                "password": user.password if hasattr(user, 'password') else "",
+                "group_id": user.group_id if hasattr(user, 'group_id') else "",
+                "card": user.card if hasattr(user, 'card') else ""
+            })
+        
+        logger.info(f"Successfully processed {len(formatted_users)} users")
+        with span('serialize'):
+            return validators.conditional(jsonify({"status": "success", "users": formatted_users}), key)
     except Exception as e:
         error_msg = f"Error fetching users: {str(e)}"
         logger.error(error_msg)
@@ -308,37 +445,33 @@ def get_attendance():
         end_date = request.args.get('end_date')
         emp_no = request.args.get('emp_no')
         
+        from device_manager import device_manager
+        device_id = device_manager.get_active_device_id()
+        key = validators.request_key(device_id)
+        not_modified = validators.not_modified(key, attendance_store.data_version(device_id))
+        if not_modified is not None:
+            return not_modified
+        
         logger.info(f"Getting attendance records: start_date={start_date}, end_date={end_date}, emp_no={emp_no}")
         
-        conn = connect_to_device()
-        try:
-            attendance_records = conn.get_attendance()
-            logger.info(f"Retrieved {len(attendance_records)} attendance records")
-            
-            if not attendance_records:
-                return jsonify({"status": "success", "records": []})
-            
-            filtered_records = attendance_records
-            if start_date or end_date:
-                filtered_records = []
-                start_dt = datetime.strptime(start_date, '%Y-%m-%d') if start_date else datetime.min
-                end_dt = datetime.strptime(end_date, '%Y-%m-%d') if end_date else datetime.max
-                
-                if end_date:
-                    end_dt = end_dt.replace(hour=23, minute=59, second=59)
-                
-                for record in attendance_records:
-                    if start_dt <= record.timestamp <= end_dt:
-                        filtered_records.append(record)
-            
-            if emp_no:
-                filtered_records = [r for r in filtered_records if str(r.user_id) == emp_no]
-            
-            formatted_records = []
-            # Fetch all users and build a user_id-to-name map
-            users = conn.get_users()
-            user_map = {user.user_id: user.name for user in users}
+        attendance_records, users = fetch_attendance_and_users(
+            device_id, history=True, start_date=start_date, end_date=end_date)
+        logger.info(f"Retrieved {len(attendance_records)} attendance records")
+        version = attendance_store.data_version(device_id)
+        
+        if not attendance_records:
+            return validators.conditional(jsonify({"status": "success", "records": []}), key, version)
+        
+        filtered_records = filter_attendance_by_date(attendance_records, start_date, end_date)
+        
+        if emp_no:
+            filtered_records = [r for r in filtered_records if str(r.user_id) == emp_no]
+        
+        formatted_records = []
+        # Build a user_id-to-name map from the users fetched with the records
+        user_map = {user.user_id: user.name for user in users}
 
+        with timed(RECORD_FORMAT_SECONDS, device=active_device_label(), stage='attendance_api'):
             for record in filtered_records:
                 formatted_records.append({
                     "user_id": record.user_id,
@@ -348,11 +481,10 @@ def get_attendance():
                     "status": record.status if hasattr(record, 'status') else 0,
                     "punch_type": record.punch if hasattr(record, 'punch') else 0
                 })
-            
-            return jsonify({"status": "success", "attendance": formatted_records})
-        finally:
-            conn.disconnect()
-            logger.info("Device disconnected")
+        
+        with span('serialize'):
+            return validators.conditional(
+                jsonify({"status": "success", "attendance": formatted_records}), key, version)
     except Exception as e:
         error_msg = f"Error fetching attendance: {str(e)}"
         logger.error(error_msg)
@@ -372,8 +504,7 @@ def add_user():
         if not user_id or not name:
             return jsonify({"status": "error", "message": "User ID and name are required"}), 400
         
-        conn = connect_to_device()
-        try:
+        with device_session() as conn:
             conn.set_user(
                 user_id=user_id,
                 name=name,
@@ -382,12 +513,10 @@ def add_user():
                 group_id=data.get('group_id', 0),
                 card=data.get('card', 0)
             )
-            
-            logger.info(f"User added successfully: ID={user_id}, Name={name}")
-            return jsonify({"status": "success", "message": f"User {name} added successfully"})
-        finally:
-            conn.disconnect()
-            logger.info("Device disconnected")
+        validators.invalidate(device_manager.get_active_device_id())
+
+        logger.info(f"User added successfully: ID={user_id}, Name={name}")
+        return jsonify({"status": "success", "message": f"User {name} added successfully"})
     except Exception as e:
         error_msg = f"Error adding user: {str(e)}"
         logger.error(error_msg)
@@ -434,6 +563,7 @@ def test_connection():
 @app.route('/api/send-attendance', methods=['POST'])
 @require_device_connection
 def send_attendance():
+    requests = import_requests()
     try:
         from datetime import datetime
         # Get request parameters
@@ -470,12 +600,15 @@ def send_attendance():
         
         # Connect to device and get attendance records
         logger.info(f"Fetching attendance records from {data.get('start_date')} to {data.get('end_date')}")
-        conn = connect_to_device()
-        
+        device_label = active_device_label()
         try:
-            # Get all attendance records
-            attendance_records = conn.get_attendance()
+            from device_manager import device_manager
+            device_id = device_manager.resolve_device_id()
+            # Get all attendance records (shared with concurrent identical downloads)
+            attendance_records = fetch_attendance(
+                device_id, history=True, start_date=data.get('start_date'), end_date=data.get('end_date'))
             logger.info(f"Retrieved {len(attendance_records) if attendance_records else 0} total attendance records")
+            report_progress(0.2, f"Downloaded {len(attendance_records) if attendance_records else 0} records")
             
             if not attendance_records:
                 return jsonify({
@@ -485,11 +618,7 @@ def send_attendance():
                 })
             
             # Filter records by date range
-            filtered_records = []
-            for record in attendance_records:
-                record_date = record.timestamp.strftime('%Y-%m-%d')
-                if data.get('start_date') <= record_date <= data.get('end_date'):
-                    filtered_records.append(record)
+            filtered_records = filter_attendance_by_date(attendance_records, data.get('start_date'), data.get('end_date'))
             
             logger.info(f"Filtered to {len(filtered_records)} records within date range {data.get('start_date')} to {data.get('end_date')}")
             
@@ -502,19 +631,20 @@ def send_attendance():
                 
             # Format records for API according to the required format
             formatted_records = []
-            for record in filtered_records:
-                formatted_record = {
-                    "emp_no": int(record.user_id),  # Convert to integer
-                    "device_id": "11",  # Use the specified device ID
-                    "punch_type": get_punch_type_text(record.punch if hasattr(record, 'punch') else 0),
-                    "punch_date": record.timestamp.strftime('%Y-%m-%d'),
-                    "punch_time": record.timestamp.strftime('%Y-%m-%d %H:%M:%S')
-                }
-                formatted_records.append(formatted_record)
+            with timed(RECORD_FORMAT_SECONDS, device=device_label, stage='send'):
+                for record in filtered_records:
+                    formatted_record = {
+                        "emp_no": int(record.user_id),  # Convert to integer
+                        "device_id": "11",  # Use the specified device ID
+                        "punch_type": get_punch_type_text(record.punch if hasattr(record, 'punch') else 0),
+                        "punch_date": record.timestamp.strftime('%Y-%m-%d'),
+                        "punch_time": record.timestamp.strftime('%Y-%m-%d %H:%M:%S')
+                    }
+                    formatted_records.append(formatted_record)
             
             # Log a sample record for debugging
             if formatted_records:
-                logger.info(f"Sample record format: {json.dumps(formatted_records[0])}")
+                logger.info("Sample record format: %s", LazyPreview(formatted_records[0]))
             
             # Prepare API request
             headers = {
@@ -527,32 +657,38 @@ def send_attendance():
                 "data": formatted_records
             }
             
-            logger.info(f"Sending {len(formatted_records)} records to API with specified format")
-            logger.info(f"Payload structure: {json.dumps(payload)[:200]}...")
+            logger.info("Sending %d records to API with specified format", len(formatted_records))
+            report_progress(0.3, f"Sending {len(formatted_records)} records")
+            # Preview only encodes the first few hundred characters of the payload
+            logger.info("Payload structure: %s", LazyPreview(payload))
             
             try:
                 # Make the API request
-                logger.info(f"Sending POST request to: {api_url}")
-                logger.info(f"Headers: {headers}")
+                logger.info("Sending POST request to: %s", api_url)
+                logger.info("Headers: %s", headers)
                 
-                response = requests.post(
-                    api_url,
-                    headers=headers,
-                    json=payload,
-                    verify=False,
-                    timeout=30
-                )
+                with timed(UPSTREAM_POST_SECONDS, device=device_label, mode='batch') as timing:
+                    response = requests.post(
+                        api_url,
+                        headers=headers,
+                        json=payload,
+                        verify=False,
+                        timeout=30
+                    )
+                    timing.outcome = http_outcome(response.status_code)
                 
-                logger.info(f"API response status: {response.status_code}")
-                logger.info(f"API response content: {response.text[:500]}")
+                logger.info("API response status: %s", response.status_code)
+                logger.info("API response content: %s", LazyPreview(response.content, 500), extra=API_RESPONSE_LOG)
                 
                 if response.status_code in (200, 201, 202):
+                    UPSTREAM_RECORDS_SENT.inc(len(formatted_records), device=device_label, mode='batch')
+                    _acknowledge_sent(device_id, filtered_records)
                     try:
                         response_data = response.json()
-                        logger.info(f"Response parsed as JSON: {json.dumps(response_data)[:500]}")
+                        logger.info("Response parsed as JSON: %s", LazyPreview(response_data, 500), extra=API_RESPONSE_LOG)
                     except:
                         response_data = response.text
-                        logger.info(f"Response is not JSON: {response_data[:500]}")
+                        logger.info("Response is not JSON: %s", LazyPreview(response_data, 500), extra=API_RESPONSE_LOG)
                     
                     # Save last_successful_send info to config.json
                     last_send_info = {
@@ -562,8 +698,7 @@ def send_attendance():
                             "summary": f"Sent {len(formatted_records)} records"
                         }
                     }
-                    config['last_successful_send'] = last_send_info
-                    save_config(config)
+                    update_config({'last_successful_send': last_send_info})
                     logger.info("last_successful_send updated in config.json after batch send")
                     
                     # Consider any 2xx response as success
@@ -579,34 +714,44 @@ def send_attendance():
                     
                     successful_records = 0
                     successful_records_list = []  # Store the actual successful records
+                    acknowledged = []  # Device records behind the successful ones
                     failed_records = []
                     
                     for index, record in enumerate(formatted_records):
+                        # Per-record lines are sampled; all lines of a sampled record are kept
+                        record_log = dict(SEND_RECORD_LOG, sample_key=index)
                         try:
                             # Try with single record wrapped in the data array
                             single_payload = {
                                 "data": [record]
                             }
                             
-                            logger.info(f"Sending record {index+1}/{len(formatted_records)}: {json.dumps(single_payload)}")
+                            logger.info("Sending record %d/%d: %s", index + 1, len(formatted_records),
+                                        LazyPreview(single_payload), extra=record_log)
                             
-                            single_response = requests.post(
-                                api_url,
-                                headers=headers,
-                                json=single_payload,
-                                verify=False,
-                                timeout=30
-                            )
+                            with timed(UPSTREAM_POST_SECONDS, device=device_label, mode='single') as timing:
+                                single_response = requests.post(
+                                    api_url,
+                                    headers=headers,
+                                    json=single_payload,
+                                    verify=False,
+                                    timeout=30
+                                )
+                                timing.outcome = http_outcome(single_response.status_code)
                             
-                            logger.info(f"Record {index+1} - API response status: {single_response.status_code}")
-                            logger.info(f"Record {index+1} - API response content: {single_response.text[:200]}")
+                            logger.info("Record %d - API response status: %s", index + 1, single_response.status_code,
+                                        extra=record_log)
+                            logger.info("Record %d - API response content: %s", index + 1,
+                                        LazyPreview(single_response.content), extra=record_log)
                             
                             if single_response.status_code in (200, 201, 202):
+                                UPSTREAM_RECORDS_SENT.inc(device=device_label, mode='single')
                                 successful_records += 1
                                 successful_records_list.append(record)  # Store the successful record
-                                logger.info(f"Successfully sent record for emp_no {record['emp_no']}")
+                                acknowledged.append(filtered_records[index])
+                                logger.info("Successfully sent record for emp_no %s", record['emp_no'], extra=record_log)
                             else:
-                                logger.warning(f"Failed to send record for emp_no {record['emp_no']}: {single_response.status_code}")
+                                logger.warning("Failed to send record for emp_no %s: %s", record['emp_no'], single_response.status_code)
                                 failed_records.append({
                                     "emp_no": record['emp_no'],
                                     "status_code": single_response.status_code,
@@ -620,10 +765,14 @@ def send_attendance():
                                 "error": error_msg
                             })
                         
+                        report_progress(0.3 + 0.7 * (index + 1) / len(formatted_records),
+                                        f"Sent {index + 1}/{len(formatted_records)} records individually")
+                        
                         # Don't overwhelm the API
                         time.sleep(0.5)
                     
                     if successful_records > 0:
+                        _acknowledge_sent(device_id, acknowledged)
                         # Save last_successful_send info to config.json for individual records
                         last_send_info = {
                             "last_send_time": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
@@ -632,8 +781,7 @@ def send_attendance():
                                 "summary": f"Sent {successful_records} out of {len(formatted_records)} records individually"
                             }
                         }
-                        config['last_successful_send'] = last_send_info
-                        save_config(config)
+                        update_config({'last_successful_send': last_send_info})
                         logger.info("last_successful_send updated in config.json after individual sends")
                         
                         return jsonify({
@@ -662,12 +810,6 @@ def send_attendance():
             error_msg = f"Error processing attendance records: {str(e)}"
             logger.error(error_msg)
             return jsonify({"status": "error", "message": error_msg}), 500
-        finally:
-            try:
-                conn.disconnect()
-                logger.info("Device disconnected")
-            except Exception as e:
-                logger.warning(f"Error disconnecting from device: {str(e)}")
     except Exception as e:
         error_msg = f"Error in send_attendance endpoint: {str(e)}"
         logger.error(error_msg)
@@ -685,6 +827,7 @@ def format_attendance_record(record):
 
 def send_records_to_api(api_url, records, record_ids=None, is_batch=True):
     """Send attendance records to API, either as batch or individual record."""
+    requests = import_requests()
     headers = {
         "Content-Type": "application/json",
         "Accept": "application/json"
@@ -695,22 +838,22 @@ def send_records_to_api(api_url, records, record_ids=None, is_batch=True):
     }
     
     try:
-        logger.info(f"Sending API request to: {api_url}")
-        logger.debug(f"API request payload: {json.dumps(payload)[:200]}...")
+        logger.info("Sending API request to: %s", api_url)
+        logger.debug("API request payload: %s", LazyPreview(payload))
         
-        response = requests.post(
-            api_url,
-            headers=headers,
-            json=payload,
-            verify=False,  # For development environments
-            timeout=30
-        )
+        mode = 'batch' if is_batch else 'single'
+        with timed(UPSTREAM_POST_SECONDS, device=active_device_label(), mode=mode) as timing:
+            response = requests.post(
+                api_url,
+                headers=headers,
+                json=payload,
+                verify=False,  # For development environments
+                timeout=30
+            )
+            timing.outcome = http_outcome(response.status_code)
         
-        logger.info(f"API response status: {response.status_code}")
-        try:
-            logger.debug(f"API response content: {response.text[:200]}...")
-        except:
-            logger.debug("Could not log API response content")
+        logger.info("API response status: %s", response.status_code)
+        logger.debug("API response content: %s", LazyPreview(response.content), extra=API_RESPONSE_LOG)
         
         success = response.status_code in (200, 201, 202)
         return success, response
@@ -732,6 +875,7 @@ def add_users_from_url():
     The API should return JSON data containing user records with emp_id and fpt_emp_name fields.
     The function will add each user to the device using their emp_id as the user_id.
     """
+    requests = import_requests()
     try:
         # Get URL from request
         data = request.get_json()
@@ -774,11 +918,10 @@ def add_users_from_url():
                 return jsonify({"status": "error", "message": "No users data found in response"}), 400
 
             logger.info(f"Found {len(users)} users in API response")
+            report_progress(0.1, f"Found {len(users)} users")
 
             # Connect to device using the existing connection method
-            conn = connect_to_device()
-            
-            try:
+            with device_session() as conn:
                 # Get existing users and their user_ids
                 existing_users = conn.get_users()
                 existing_user_ids = {user.user_id: user.uid for user in existing_users}
@@ -799,7 +942,8 @@ def add_users_from_url():
                 failed_users = []
                 skipped_count = 0
                 
-                for user in users:
+                for index, user in enumerate(users):
+                    report_progress(0.1 + 0.9 * index / len(users), f"Adding user {index + 1}/{len(users)}")
                     try:
                         # Skip detailed user logging to reduce console output
                         
@@ -861,10 +1005,9 @@ def add_users_from_url():
                             'error': error_msg,
                             'user_data': user
                         })
-            finally:
-                # Always disconnect from device
-                conn.disconnect()
-                logger.info("Device disconnected")
+            
+            if success_count:
+                validators.invalidate(device_manager.get_active_device_id())
             
             # Return results
             return jsonify({
@@ -892,13 +1035,16 @@ def add_users_from_url():
 
 
 from device_manager import device_manager
+from health_monitor import health_monitor
+from attendance_store import attendance_store
+from fleet_scheduler import fleet_scheduler
 
 # Define cleanup function to ensure proper shutdown
 def cleanup_on_exit():
-    # Force save devices to ensure they persist
+    # Flush debounced device metadata (last_connected, active device) so it persists
     logger.info("Saving device configuration before exit")
     try:
-        device_manager.save_devices()
+        device_manager.flush_pending_writes()
         logger.info(f"Successfully saved {len(device_manager.devices)} devices before exit")
     except Exception as e:
         logger.error(f"Error saving devices on exit: {str(e)}")
@@ -912,7 +1058,10 @@ from routes import *
 
 if __name__ == '__main__':
     try:
-        app.run(debug=True, port=5000, threaded=True, use_reloader=False)
+        # Development server; production deployments use serve.py (waitress)
+        health_monitor.start()
+        fleet_scheduler.start()
+        app.run(debug=os.environ.get('ZK_DEBUG') == '1', port=5000, threaded=True, use_reloader=False)
     except KeyboardInterrupt:
         logger.info("Application shutdown requested. Exiting...")
     except Exception as e:
@@ -2,11 +2,11 @@
 
 
 a = Analysis(
-    ['app.py'],
+    ['serve.py'],
     pathex=[],
     binaries=[],
     datas=[('templates', 'templates'), ('static', 'static')],
-    hiddenimports=[],
+    hiddenimports=['waitress'],
     hookspath=[],
     hooksconfig={},
     runtime_hooks=[],
@@ -0,0 +1,164 @@
+"""
+Logging for ZK Attendance System
+Queue-based non-blocking handlers, per-category sampling and size-capped
+payload previews for hot paths
+"""
+import atexit
+import json
+import logging
+import os
+import queue
+import threading
+from logging.handlers import QueueHandler, QueueListener
+
+# Characters kept by preview() before the text is cut off
+PREVIEW_CHARS = 200
+
+# Sampling rates as "log 1 in N" per category; records at WARNING or above
+# are never sampled. Override with e.g.
+#   ZK_LOG_SAMPLING="send.record=1,api.response=20"
+SAMPLING_ENV = 'ZK_LOG_SAMPLING'
+DEFAULT_SAMPLING = {
+    'send.record': 100,   # per-record lines when records are sent one by one
+    'api.response': 10,   # upstream response bodies
+}
+
+
+def parse_sampling(spec):
+    """Parse "category=N,category=N" into a dict, ignoring malformed entries"""
+    rates = {}
+    for item in (spec or '').split(','):
+        name, _, every = item.partition('=')
+        try:
+            rates[name.strip()] = max(1, int(every))
+        except ValueError:
+            continue
+    return rates
+
+
+class SamplingFilter(logging.Filter):
+    """Passes one in N records of each sampled category
+
+    Records opt in with extra={'category': ...}; uncategorized records and
+    warnings or errors always pass. Records that also carry an integer
+    'sample_key' (e.g. a loop index) are kept or dropped together, so every
+    line about a sampled item is logged.
+    """
+
+    def __init__(self, rates=None):
+        super().__init__()
+        self.rates = dict(rates or {})
+        self._lock = threading.Lock()
+        self._seen = {}
+
+    def filter(self, record):
+        category = getattr(record, 'category', None)
+        if category is None or record.levelno >= logging.WARNING:
+            return True
+        every = self.rates.get(category, 1)
+        if every <= 1:
+            return True
+        key = getattr(record, 'sample_key', None)
+        if key is not None:
+            return key % every == 0
+        with self._lock:
+            seen = self._seen.get(category, 0)
+            self._seen[category] = seen + 1
+        return seen % every == 0
+
+
+class _InProcessQueueHandler(QueueHandler):
+    """QueueHandler that leaves formatting to the listener thread
+
+    The stock prepare() formats the message in the calling thread so records
+    can be pickled; the queue never leaves this process, so request threads
+    only enqueue and the %-args (including lazy previews) are rendered later.
+    """
+
+    def prepare(self, record):
+        return record
+
+
+_encoder = json.JSONEncoder(default=str, ensure_ascii=False)
+
+
+def preview(value, limit=PREVIEW_CHARS):
+    """Return at most limit characters of value for logging
+
+    Dicts and lists are encoded incrementally and encoding stops once enough
+    text exists, so previewing a multi-megabyte payload costs about as much
+    as previewing a small one.
+    """
+    if isinstance(value, (bytes, bytearray)):
+        text = bytes(value[:limit + 1]).decode('utf-8', errors='replace')
+    elif isinstance(value, str):
+        text = value[:limit + 1]
+    else:
+        parts = []
+        size = 0
+        try:
+            for chunk in _encoder.iterencode(value):
+                parts.append(chunk)
+                size += len(chunk)
+                if size > limit:
+                    break
+        except Exception:
+            parts = [repr(value)[:limit + 1]]
+        text = ''.join(parts)
+    if len(text) > limit:
+        return text[:limit] + '...'
+    return text
+
+
+class LazyPreview:
+    """Log argument that is only rendered (via preview()) if the record is emitted"""
+    __slots__ = ('value', 'limit')
+
+    def __init__(self, value, limit=PREVIEW_CHARS):
+        self.value = value
+        self.limit = limit
+
+    def __str__(self):
+        return preview(self.value, self.limit)
+
+
+class QueueLogging:
+    """Routes every log record through a queue to handlers on a background thread"""
+
+    def __init__(self):
+        self.queue = queue.SimpleQueue()
+        self.listener = None
+        self.handlers = []
+        self.sampling = SamplingFilter()
+
+    def start(self, handlers, level=logging.INFO, sampling=None):
+        """Install a queue handler on the root logger and start the listener"""
+        rates = dict(DEFAULT_SAMPLING)
+        rates.update(sampling or {})
+        rates.update(parse_sampling(os.environ.get(SAMPLING_ENV)))
+        self.sampling.rates = rates
+
+        self.handlers = list(handlers)
+        queue_handler = _InProcessQueueHandler(self.queue)
+        queue_handler.addFilter(self.sampling)
+
+        root = logging.getLogger()
+        root.setLevel(level)
+        for handler in root.handlers[:]:
+            root.removeHandler(handler)
+        root.addHandler(queue_handler)
+
+        self.listener = QueueListener(self.queue, *self.handlers, respect_handler_level=True)
+        self.listener.start()
+        # atexit runs hooks in reverse order, so this runs after hooks registered
+        # later (e.g. the app's cleanup) and their last records are still written
+        atexit.register(self.stop)
+
+    def stop(self):
+        """Flush queued records and stop the listener thread"""
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
+
+# Create a global instance of the queue logging setup
+queue_logging = QueueLogging()
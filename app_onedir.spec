@@ -0,0 +1,49 @@
+# -*- mode: python ; coding: utf-8 -*-
+# Startup-optimized build: `pyinstaller app_onedir.spec` writes dist/zk_attendance/.
+# A one-folder build starts without unpacking the whole bundle to a temp
+# directory on every launch (as the one-file app.spec build does), skips UPX
+# so nothing is decompressed at load time, and ships bytecode compiled with
+# -O. Distribute the whole dist/zk_attendance folder.
+
+
+a = Analysis(
+    ['serve.py'],
+    pathex=[],
+    binaries=[],
+    datas=[('templates', 'templates'), ('static', 'static')],
+    hiddenimports=['waitress'],
+    hookspath=[],
+    hooksconfig={},
+    runtime_hooks=[],
+    excludes=['tkinter'],
+    noarchive=False,
+    optimize=1,
+)
+pyz = PYZ(a.pure)
+
+exe = EXE(
+    pyz,
+    a.scripts,
+    [],
+    exclude_binaries=True,
+    name='zk_attendance',
+    debug=False,
+    bootloader_ignore_signals=False,
+    strip=False,
+    upx=False,
+    console=True,
+    disable_windowed_traceback=False,
+    argv_emulation=False,
+    target_arch=None,
+    codesign_identity=None,
+    entitlements_file=None,
+)
+coll = COLLECT(
+    exe,
+    a.binaries,
+    a.datas,
+    strip=False,
+    upx=False,
+    upx_exclude=[],
+    name='zk_attendance',
+)
@@ -0,0 +1,300 @@
+"""
+Attendance Export for ZK Attendance System
+Writes punches from the local attendance store to CSV, XLSX or Parquet
+with bounded memory and caches the files for repeated downloads
+"""
+import csv
+import hashlib
+import importlib.util
+import io
+import json
+import logging
+import os
+import threading
+import time
+from device_manager import APP_CONFIG_DIR
+from attendance_store import attendance_store
+
+# Configure logging
+logger = logging.getLogger('attendance_export')
+
+# Define the directory for cached export files
+EXPORT_DIR = os.path.join(APP_CONFIG_DIR, 'exports')
+
+# Cached exports kept on disk, and how long (seconds) one stays valid
+MAX_EXPORTS = 20
+EXPORT_TTL = 24 * 60 * 60
+
+# Rows read from the store per batch; bounds memory for any range
+BATCH_SIZE = 5000
+
+# Rows per Parquet row group
+PARQUET_ROW_GROUP = 50000
+
+HEADER = ['device_id', 'user_id', 'name', 'punch_date', 'punch_time', 'punch_type', 'status']
+
+FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'xlsx': ('application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', 'xlsx'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+}
+
+# openpyxl and pyarrow are optional and slow to import, so they are only
+# imported by the first export that needs them
+FORMAT_LIBRARIES = {'xlsx': ('XLSX', 'openpyxl'), 'parquet': ('Parquet', 'pyarrow')}
+
+
+def library_available(name):
+    """Whether an optional library is installed, without importing it"""
+    return importlib.util.find_spec(name) is not None
+
+
+class ExportError(Exception):
+    """Raised for export requests that cannot be served (bad format, missing library)"""
+
+
+class AttendanceExporter:
+    """Streams filtered punches from the store into export files
+
+    Rows are read in batches through a dedicated read-only SQLite connection,
+    so an export never holds the store lock between batches and a month of
+    punches from every device is written without loading it into memory.
+    Finished files are cached under a key made of the export parameters and
+    the store's per-device high-water marks, so a repeated export is served
+    from disk until new punches arrive.
+    """
+
+    def __init__(self, directory=EXPORT_DIR, store=attendance_store):
+        self.directory = directory
+        self.store = store
+        self._lock = threading.Lock()
+        self._building = {}
+
+    # -- parameters -------------------------------------------------------
+
+    def check_format(self, fmt):
+        """Validate an export format, raising ExportError when it cannot be produced"""
+        if fmt not in FORMATS:
+            raise ExportError(f"Unsupported export format '{fmt}', use one of: {', '.join(FORMATS)}")
+        if fmt in FORMAT_LIBRARIES:
+            label, library = FORMAT_LIBRARIES[fmt]
+            if not library_available(library):
+                raise ExportError(f"{label} export requires {library} (pip install {library})")
+
+    def cache_key(self, fmt, start_date=None, end_date=None, user_ids=None, device_ids=None):
+        """Hash of the export parameters and the data they cover"""
+        marks = self.store.ingest_status()
+        if device_ids is not None:
+            marks = {device_id: marks.get(device_id) for device_id in device_ids}
+        data_version = {
+            device_id: (state['high_water'], state['punches']) if state else None
+            for device_id, state in sorted(marks.items())
+        }
+        params = {
+            'format': fmt,
+            'start_date': start_date,
+            'end_date': end_date,
+            'user_ids': sorted(user_ids) if user_ids is not None else None,
+            'device_ids': sorted(device_ids) if device_ids is not None else None,
+            'data': data_version
+        }
+        return hashlib.sha256(json.dumps(params, sort_keys=True).encode()).hexdigest()[:32]
+
+    def filename(self, fmt, start_date=None, end_date=None):
+        """Download name for an export, e.g. attendance_2024-01-01_2024-01-31.csv"""
+        parts = ['attendance', start_date or 'start', end_date or 'latest']
+        return '_'.join(parts) + '.' + FORMATS[fmt][1]
+
+    # -- reading ----------------------------------------------------------
+
+    def iter_rows(self, start_date=None, end_date=None, user_ids=None, device_ids=None, batch_size=BATCH_SIZE):
+        """Yield export rows in time order, reading the store in batches"""
+        clauses = []
+        params = []
+        if start_date:
+            clauses.append('p.day >= ?')
+            params.append(start_date)
+        if end_date:
+            clauses.append('p.day <= ?')
+            params.append(end_date)
+        if user_ids is not None:
+            clauses.append(f"p.user_id IN ({', '.join('?' * len(user_ids))})")
+            params.extend(str(user_id) for user_id in user_ids)
+        if device_ids is not None:
+            clauses.append(f"p.device_id IN ({', '.join('?' * len(device_ids))})")
+            params.extend(device_ids)
+        where = ' WHERE ' + ' AND '.join(clauses) if clauses else ''
+
+        # Same punch type labels as the records sent to the attendance API
+        from app import get_punch_type_text
+
+        conn = self.store.reader()
+        try:
+            cursor = conn.execute(
+                'SELECT p.device_id, p.user_id, u.name, p.day, p.timestamp, p.punch, p.status '
+                'FROM punches p LEFT JOIN users u ON u.user_id = p.user_id' + where +
+                ' ORDER BY p.timestamp, p.device_id, p.user_id', params)
+            while True:
+                batch = cursor.fetchmany(batch_size)
+                if not batch:
+                    break
+                for device_id, user_id, name, day, timestamp, punch, status in batch:
+                    yield [device_id, user_id, name or '', day, timestamp, get_punch_type_text(punch), status]
+        finally:
+            conn.close()
+
+    # -- writers ----------------------------------------------------------
+
+    def iter_csv(self, rows, chunk_rows=1000):
+        """Encode rows as CSV text chunks of about chunk_rows rows each"""
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(HEADER)
+        count = 0
+        for row in rows:
+            writer.writerow(row)
+            count += 1
+            if count % chunk_rows == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue()
+
+    def _write_csv(self, rows, path):
+        with open(path, 'w', newline='', encoding='utf-8') as f:
+            for chunk in self.iter_csv(rows):
+                f.write(chunk)
+
+    def _write_xlsx(self, rows, path):
+        import openpyxl
+
+        # write_only mode streams rows to disk instead of keeping cells in memory
+        workbook = openpyxl.Workbook(write_only=True)
+        sheet = workbook.create_sheet('Attendance')
+        sheet.append(HEADER)
+        for row in rows:
+            sheet.append(row)
+        workbook.save(path)
+
+    def _write_parquet(self, rows, path):
+        import pyarrow
+        import pyarrow.parquet
+
+        schema = pyarrow.schema([
+            ('device_id', pyarrow.string()),
+            ('user_id', pyarrow.string()),
+            ('name', pyarrow.string()),
+            ('punch_date', pyarrow.string()),
+            ('punch_time', pyarrow.string()),
+            ('punch_type', pyarrow.string()),
+            ('status', pyarrow.int32()),
+        ])
+        with pyarrow.parquet.ParquetWriter(path, schema) as writer:
+            batch = []
+            for row in rows:
+                batch.append(row)
+                if len(batch) >= PARQUET_ROW_GROUP:
+                    writer.write_table(self._parquet_table(batch, schema))
+                    batch = []
+            if batch:
+                writer.write_table(self._parquet_table(batch, schema))
+
+    def _parquet_table(self, batch, schema):
+        import pyarrow
+
+        columns = zip(*batch)
+        return pyarrow.Table.from_arrays(
+            [pyarrow.array(column, type=field.type) for column, field in zip(columns, schema)], schema=schema)
+
+    # -- cache ------------------------------------------------------------
+
+    def cached_path(self, key, fmt):
+        """Path of a valid cached export, None when missing or expired"""
+        path = os.path.join(self.directory, f"{key}.{FORMATS[fmt][1]}")
+        try:
+            if time.time() - os.path.getmtime(path) < EXPORT_TTL:
+                return path
+        except OSError:
+            pass
+        return None
+
+    def _building_lock(self, key):
+        with self._lock:
+            lock = self._building.get(key)
+            if lock is None:
+                lock = threading.Lock()
+                self._building[key] = lock
+            return lock
+
+    def build(self, fmt, start_date=None, end_date=None, user_ids=None, device_ids=None):
+        """Write an export file (or reuse the cached one) and return its path
+
+        Concurrent requests for the same export wait for a single build.
+        """
+        self.check_format(fmt)
+        key = self.cache_key(fmt, start_date, end_date, user_ids, device_ids)
+        with self._building_lock(key):
+            path = self.cached_path(key, fmt)
+            if path:
+                return path
+            os.makedirs(self.directory, exist_ok=True)
+            path = os.path.join(self.directory, f"{key}.{FORMATS[fmt][1]}")
+            partial = f"{path}.{threading.get_ident()}.part"
+            started = time.perf_counter()
+            rows = self.iter_rows(start_date, end_date, user_ids, device_ids)
+            try:
+                getattr(self, f"_write_{fmt}")(rows, partial)
+                os.replace(partial, path)
+            finally:
+                if os.path.exists(partial):
+                    os.remove(partial)
+            logger.info(f"Built {fmt} export {os.path.basename(path)} in {time.perf_counter() - started:.2f}s")
+            self._prune()
+            return path
+
+    def stream_csv(self, start_date=None, end_date=None, user_ids=None, device_ids=None):
+        """CSV chunks straight from the store, saved to the cache as they are sent
+
+        The cached copy is only kept if the whole file was produced, so a
+        client that disconnects half way never leaves a truncated export.
+        """
+        key = self.cache_key('csv', start_date, end_date, user_ids, device_ids)
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f"{key}.csv")
+        partial = f"{path}.{threading.get_ident()}.part"
+        rows = self.iter_rows(start_date, end_date, user_ids, device_ids)
+        complete = False
+        try:
+            with open(partial, 'w', newline='', encoding='utf-8') as f:
+                for chunk in self.iter_csv(rows):
+                    f.write(chunk)
+                    yield chunk
+            os.replace(partial, path)
+            complete = True
+            self._prune()
+        finally:
+            if not complete and os.path.exists(partial):
+                os.remove(partial)
+
+    def _prune(self):
+        """Drop expired exports and keep at most MAX_EXPORTS files"""
+        with self._lock:
+            try:
+                entries = [
+                    (os.path.getmtime(os.path.join(self.directory, name)), name)
+                    for name in os.listdir(self.directory) if not name.endswith('.part')
+                ]
+            except OSError:
+                return
+            entries.sort(reverse=True)
+            now = time.time()
+            for index, (mtime, name) in enumerate(entries):
+                if index >= MAX_EXPORTS or now - mtime >= EXPORT_TTL:
+                    try:
+                        os.remove(os.path.join(self.directory, name))
+                    except OSError:
+                        pass
+
+# Create a global instance of the attendance exporter
+attendance_exporter = AttendanceExporter()
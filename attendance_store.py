@@ -0,0 +1,445 @@
+"""
+Attendance Store for ZK Attendance System
+Keeps downloaded punches in SQLite and maintains a per-user, per-day
+summary that is updated incrementally as new punches arrive
+"""
+import logging
+import os
+import sqlite3
+import threading
+from datetime import datetime
+from device_manager import APP_CONFIG_DIR
+
+# Configure logging
+logger = logging.getLogger('attendance_store')
+
+# Define the path to the attendance database
+DB_PATH = os.path.join(APP_CONFIG_DIR, 'attendance.db')
+
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS punches (
+    device_id TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    day TEXT NOT NULL,
+    punch INTEGER NOT NULL DEFAULT 0,
+    status INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (device_id, user_id, timestamp)
+);
+CREATE INDEX IF NOT EXISTS punches_day ON punches (day, user_id);
+CREATE INDEX IF NOT EXISTS punches_time ON punches (timestamp);
+CREATE INDEX IF NOT EXISTS punches_device_time ON punches (device_id, timestamp);
+
+CREATE TABLE IF NOT EXISTS daily_summary (
+    user_id TEXT NOT NULL,
+    day TEXT NOT NULL,
+    first_in TEXT NOT NULL,
+    last_out TEXT NOT NULL,
+    punch_count INTEGER NOT NULL,
+    worked_seconds INTEGER NOT NULL,
+    PRIMARY KEY (day, user_id)
+);
+
+CREATE TABLE IF NOT EXISTS ingest_state (
+    device_id TEXT PRIMARY KEY,
+    high_water TEXT NOT NULL,
+    punches INTEGER NOT NULL DEFAULT 0,
+    updated_at TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS users (
+    user_id TEXT PRIMARY KEY,
+    name TEXT
+);
+
+CREATE TABLE IF NOT EXISTS retention_log (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    device_id TEXT NOT NULL,
+    started_at TEXT NOT NULL,
+    finished_at TEXT NOT NULL,
+    watermark TEXT,
+    device_records INTEGER NOT NULL DEFAULT 0,
+    remaining_records INTEGER,
+    cleared INTEGER NOT NULL DEFAULT 0,
+    outcome TEXT NOT NULL,
+    detail TEXT
+);
+CREATE INDEX IF NOT EXISTS retention_log_device ON retention_log (device_id, cleared);
+"""
+
+# Columns added after the first release, created on databases that predate them
+MIGRATIONS = [
+    ('punches', 'sent_at', 'ALTER TABLE punches ADD COLUMN sent_at TEXT'),
+]
+
+# Indexes on migrated columns, created once the columns exist
+MIGRATED_SCHEMA = """
+CREATE INDEX IF NOT EXISTS punches_unsent ON punches (device_id, timestamp) WHERE sent_at IS NULL;
+"""
+
+# Rebuild the summary rows of the given (user_id, day) pairs from their punches
+REFRESH_SUMMARY = """
+INSERT OR REPLACE INTO daily_summary (user_id, day, first_in, last_out, punch_count, worked_seconds)
+SELECT user_id, day, MIN(timestamp), MAX(timestamp), COUNT(*),
+       CAST(strftime('%s', MAX(timestamp)) AS INTEGER) - CAST(strftime('%s', MIN(timestamp)) AS INTEGER)
+FROM punches
+WHERE user_id = ? AND day = ?
+GROUP BY user_id, day
+"""
+
+
+class AttendanceStore:
+    """SQLite-backed punch history with a materialized daily summary
+
+    Each device has a high-water mark (the newest punch timestamp already
+    stored). Punches of a full device download at or after it are inserted
+    directly; older ones (a device clock that was reset, a backdated punch)
+    are checked against the stored punches of the device and the missing
+    ones are stored too, so the primary key, not the mark, decides what is
+    new. Since devices append to their log, only records past those offered
+    by the previous download of the same log need that check. Only the
+    touched (user, day) summary rows are rebuilt.
+    Worked time is the span between the first and last punch of the day.
+    """
+
+    def __init__(self, db_path=DB_PATH):
+        self.db_path = db_path
+        self._lock = threading.RLock()
+        self._conn = None
+        self._listeners = []
+        # device_id -> (records, first timestamp) of the last download ingested
+        self._offered = {}
+
+    def _connect(self):
+        if self._conn is None:
+            conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.executescript(SCHEMA)
+            for table, column, statement in MIGRATIONS:
+                if column not in {row['name'] for row in conn.execute(f'PRAGMA table_info({table})')}:
+                    conn.execute(statement)
+            conn.executescript(MIGRATED_SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    def add_listener(self, listener):
+        """Call listener(device_id, punches=..., users=...) after every ingest
+
+        punches are (device_id, user_id, timestamp, day, punch, status) rows at
+        or after the previous high-water mark, plus older ones that were not
+        stored yet, so a punch may be reported more than once; users are (user_id, name) pairs of a full user download.
+        Listeners run outside the store lock.
+        """
+        self._listeners.append(listener)
+
+    def _notify(self, device_id, **changes):
+        for listener in self._listeners:
+            try:
+                listener(device_id, **changes)
+            except Exception as e:
+                logger.error(f"Error in attendance store listener: {str(e)}")
+
+    def high_water(self, device_id):
+        """Timestamp of the newest stored punch from a device, None if none"""
+        with self._lock:
+            row = self._connect().execute(
+                'SELECT high_water FROM ingest_state WHERE device_id = ?', (device_id,)).fetchone()
+            return row['high_water'] if row else None
+
+    def data_version(self, device_id):
+        """(high-water mark, stored punch count) of a device; changes whenever new punches arrive"""
+        with self._lock:
+            row = self._connect().execute(
+                'SELECT high_water, punches FROM ingest_state WHERE device_id = ?', (device_id,)).fetchone()
+            return tuple(row) if row else None
+
+    def version(self):
+        """(stored punches, last ingest time, known users) across all devices
+
+        Changes whenever any process stores punches or users, so readers in
+        other processes can tell their derived state is stale.
+        """
+        with self._lock:
+            row = self._connect().execute(
+                'SELECT COALESCE(SUM(punches), 0), MAX(updated_at), (SELECT COUNT(*) FROM users) '
+                'FROM ingest_state').fetchone()
+            return tuple(row)
+
+    def ingest(self, device_id, records):
+        """Store new punches from a device download and update the summaries
+
+        records are pyzk Attendance objects (user_id, timestamp, punch,
+        status). Returns the number of punches that were new.
+        """
+        with self._lock:
+            conn = self._connect()
+            mark = self.high_water(device_id)
+            mark_dt = datetime.strptime(mark, TIMESTAMP_FORMAT) if mark else None
+
+            # Devices append to their log, so with the same log start only
+            # records past the ones offered last time can be late arrivals
+            start = records[0].timestamp if records else None
+            offered, offered_start = self._offered.get(device_id, (0, None))
+            checked_from = offered if start == offered_start and len(records) >= offered else 0
+
+            # Punches at the mark itself are re-offered; the primary key drops duplicates
+            rows = []
+            older = []
+            newest = mark_dt
+            for position, record in enumerate(records):
+                timestamp = record.timestamp
+                late = mark_dt is not None and timestamp < mark_dt
+                if late and position < checked_from:
+                    continue
+                text = timestamp.strftime(TIMESTAMP_FORMAT)
+                row = (device_id, str(record.user_id), text, text[:10],
+                       getattr(record, 'punch', 0) or 0, getattr(record, 'status', 0) or 0)
+                if late:
+                    older.append(row)
+                    continue
+                rows.append(row)
+                if newest is None or timestamp > newest:
+                    newest = timestamp
+            late = self._unstored(conn, device_id, older, mark) if older else []
+            if late:
+                logger.warning(f"Storing {len(late)} punches from device {device_id} dated before its "
+                               f"high-water mark {mark} (device clock changed or punch backdated)")
+                rows.extend(late)
+            inserted = self._insert(conn, device_id, rows, newest) if rows else 0
+            self._offered[device_id] = (len(records), start)
+        self._notify(device_id, punches=rows)
+        return inserted
+
+    def _unstored(self, conn, device_id, rows, mark):
+        """Rows dated before the mark that are not stored yet"""
+        stored = {(row[0], row[1]) for row in conn.execute(
+            'SELECT user_id, timestamp FROM punches WHERE device_id = ? AND timestamp >= ? AND timestamp < ?',
+            (device_id, min(row[2] for row in rows), mark))}
+        return [row for row in rows if (row[1], row[2]) not in stored]
+
+    def _insert(self, conn, device_id, rows, newest):
+        """Insert punch rows, rebuild their summaries and advance the mark"""
+        with conn:
+            before = conn.total_changes
+            conn.executemany(
+                'INSERT OR IGNORE INTO punches (device_id, user_id, timestamp, day, punch, status) '
+                'VALUES (?, ?, ?, ?, ?, ?)', rows)
+            inserted = conn.total_changes - before
+            if inserted:
+                touched = {(row[1], row[3]) for row in rows}
+                conn.executemany(REFRESH_SUMMARY, touched)
+            conn.execute(
+                'INSERT INTO ingest_state (device_id, high_water, punches, updated_at) VALUES (?, ?, ?, ?) '
+                'ON CONFLICT(device_id) DO UPDATE SET high_water = excluded.high_water, '
+                'punches = punches + ?, updated_at = excluded.updated_at',
+                (device_id, newest.strftime(TIMESTAMP_FORMAT), inserted,
+                 datetime.now().isoformat(), inserted))
+        if inserted:
+            logger.info(f"Stored {inserted} new punches from device {device_id}")
+        return inserted
+
+    def ingest_users(self, device_id, users):
+        """Remember user names so summaries can be reported without a device"""
+        rows = [(str(user.user_id), user.name) for user in users]
+        if rows:
+            with self._lock:
+                conn = self._connect()
+                with conn:
+                    conn.executemany(
+                        'INSERT INTO users (user_id, name) VALUES (?, ?) '
+                        'ON CONFLICT(user_id) DO UPDATE SET name = excluded.name', rows)
+        self._notify(device_id, users=rows)
+
+    def mark_sent(self, device_id, keys):
+        """Record that punches were acknowledged upstream
+
+        keys are (user_id, 'YYYY-MM-DD HH:MM:SS') pairs. Returns how many
+        stored punches were newly marked.
+        """
+        now = datetime.now().isoformat()
+        rows = [(now, device_id, str(user_id), timestamp) for user_id, timestamp in keys]
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                before = conn.total_changes
+                conn.executemany(
+                    'UPDATE punches SET sent_at = ? WHERE device_id = ? AND user_id = ? AND timestamp = ? '
+                    'AND sent_at IS NULL', rows)
+                return conn.total_changes - before
+
+    def sent_watermark(self, device_id):
+        """Newest timestamp up to which every stored punch of a device was acknowledged upstream
+
+        None when the oldest stored punch has not been acknowledged (or none is stored).
+        """
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute('SELECT MIN(timestamp) FROM punches WHERE device_id = ? AND sent_at IS NULL',
+                               (device_id,)).fetchone()
+            if row[0] is None:
+                row = conn.execute('SELECT MAX(timestamp) FROM punches WHERE device_id = ?', (device_id,)).fetchone()
+            else:
+                row = conn.execute('SELECT MAX(timestamp) FROM punches WHERE device_id = ? AND timestamp < ?',
+                                   (device_id, row[0])).fetchone()
+            return row[0]
+
+    def acknowledged_keys(self, device_id, through):
+        """(user_id, timestamp) of stored, acknowledged punches of a device up to a timestamp"""
+        with self._lock:
+            return {(row[0], row[1]) for row in self._connect().execute(
+                'SELECT user_id, timestamp FROM punches WHERE device_id = ? AND timestamp <= ? '
+                'AND sent_at IS NOT NULL', (device_id, through))}
+
+    def count_punches(self, device_id, after=None):
+        """Stored punches of a device, only those after a timestamp if given"""
+        query = 'SELECT COUNT(*) FROM punches WHERE device_id = ?'
+        params = [device_id]
+        if after:
+            query += ' AND timestamp > ?'
+            params.append(after)
+        with self._lock:
+            return self._connect().execute(query, params).fetchone()[0]
+
+    def trimmed_through(self, device_id):
+        """Watermark of the last verified clear of a device's log, None if it was never cleared"""
+        with self._lock:
+            row = self._connect().execute(
+                'SELECT MAX(watermark) FROM retention_log WHERE device_id = ? AND cleared = 1',
+                (device_id,)).fetchone()
+            return row[0]
+
+    def record_retention(self, device_id, started_at, outcome, watermark=None, device_records=0,
+                         remaining_records=None, cleared=False, detail=None):
+        """Append an audit record of a retention run"""
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.execute(
+                    'INSERT INTO retention_log (device_id, started_at, finished_at, watermark, device_records, '
+                    'remaining_records, cleared, outcome, detail) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    (device_id, started_at, datetime.now().isoformat(), watermark, device_records,
+                     remaining_records, int(cleared), outcome, detail))
+
+    def retention_log(self, device_id=None, limit=50):
+        """Audit records of retention runs, newest first"""
+        where = ' WHERE device_id = ?' if device_id else ''
+        params = [device_id] if device_id else []
+        with self._lock:
+            return [dict(row) for row in self._connect().execute(
+                'SELECT * FROM retention_log' + where + ' ORDER BY id DESC LIMIT ?', params + [limit])]
+
+    def punches_on(self, day):
+        """(device_id, user_id, timestamp) of every stored punch on a YYYY-MM-DD day"""
+        with self._lock:
+            return [tuple(row) for row in self._connect().execute(
+                'SELECT device_id, user_id, timestamp FROM punches WHERE day = ?', (day,))]
+
+    def recent_punches(self, limit=10, device_id=None):
+        """The newest stored punches with user names, newest first"""
+        where = ' WHERE p.device_id = ?' if device_id else ''
+        params = [device_id] if device_id else []
+        query = ('SELECT p.device_id, p.user_id, u.name, p.timestamp, p.punch, p.status '
+                 'FROM punches p LEFT JOIN users u ON u.user_id = p.user_id' + where +
+                 ' ORDER BY p.timestamp DESC LIMIT ?')
+        with self._lock:
+            return [dict(row) for row in self._connect().execute(query, params + [limit])]
+
+    def user_ids(self):
+        """Ids of every user seen in a download"""
+        with self._lock:
+            return [row['user_id'] for row in self._connect().execute('SELECT user_id FROM users')]
+
+    def _range_filter(self, start_date, end_date, user_id):
+        """WHERE clause and parameters shared by the summary queries"""
+        clauses = []
+        params = []
+        if start_date:
+            clauses.append('s.day >= ?')
+            params.append(start_date)
+        if end_date:
+            clauses.append('s.day <= ?')
+            params.append(end_date)
+        if user_id:
+            clauses.append('s.user_id = ?')
+            params.append(str(user_id))
+        return (' WHERE ' + ' AND '.join(clauses) if clauses else ''), params
+
+    def daily_summaries(self, start_date=None, end_date=None, user_id=None):
+        """Summary rows for a date range (inclusive YYYY-MM-DD), oldest first"""
+        where, params = self._range_filter(start_date, end_date, user_id)
+        query = ('SELECT s.user_id, u.name, s.day, s.first_in, s.last_out, s.punch_count, s.worked_seconds '
+                 'FROM daily_summary s LEFT JOIN users u ON u.user_id = s.user_id' + where +
+                 ' ORDER BY s.day, s.user_id')
+        with self._lock:
+            return [dict(row) for row in self._connect().execute(query, params)]
+
+    def user_totals(self, start_date=None, end_date=None, user_id=None):
+        """Per-user totals over a date range: days present, punches, worked seconds"""
+        where, params = self._range_filter(start_date, end_date, user_id)
+        query = ('SELECT s.user_id, u.name, COUNT(*) AS days_present, SUM(s.punch_count) AS punch_count, '
+                 'SUM(s.worked_seconds) AS worked_seconds, MIN(s.day) AS first_day, MAX(s.day) AS last_day '
+                 'FROM daily_summary s LEFT JOIN users u ON u.user_id = s.user_id' + where +
+                 ' GROUP BY s.user_id ORDER BY s.user_id')
+        with self._lock:
+            return [dict(row) for row in self._connect().execute(query, params)]
+
+    def load_columns(self, start_date=None, end_date=None, device_ids=None, through=None, batch_size=50000):
+        """Stored punches in an inclusive YYYY-MM-DD range as PunchColumns, in time order
+
+        through limits the punches to timestamps up to and including it.
+        """
+        # Imported here: punch_columns pulls in numpy, which only analytics need
+        from punch_columns import PunchColumns
+
+        clauses = []
+        params = []
+        if start_date:
+            clauses.append('day >= ?')
+            params.append(start_date)
+        if end_date:
+            clauses.append('day <= ?')
+            params.append(end_date)
+        if device_ids is not None:
+            clauses.append(f"device_id IN ({', '.join('?' * len(device_ids))})")
+            params.extend(device_ids)
+        if through is not None:
+            clauses.append('timestamp <= ?')
+            params.append(through)
+        where = ' WHERE ' + ' AND '.join(clauses) if clauses else ''
+        columns = PunchColumns()
+        with self._lock:
+            cursor = self._connect().execute(
+                "SELECT device_id, user_id, CAST(strftime('%s', timestamp) AS INTEGER), punch, status "
+                'FROM punches' + where + ' ORDER BY timestamp', params)
+            while True:
+                batch = cursor.fetchmany(batch_size)
+                if not batch:
+                    break
+                for device_id, user_id, epoch, punch, status in batch:
+                    columns.append(device_id, user_id, epoch, punch, status)
+        return columns
+
+    def ingest_status(self):
+        """High-water mark, punch count and last ingest time per device"""
+        with self._lock:
+            return {row['device_id']: dict(row) for row in
+                    self._connect().execute('SELECT * FROM ingest_state')}
+
+    def reader(self):
+        """A separate read-only connection for long scans that must not hold the store lock"""
+        with self._lock:
+            self._connect()
+        return sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True, check_same_thread=False)
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+# Create a global instance of the attendance store
+attendance_store = AttendanceStore()
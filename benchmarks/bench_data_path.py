@@ -0,0 +1,195 @@
+"""
+Data Path Micro-benchmarks for ZK Attendance System
+Times the per-record loops (date filtering, organize_attendance,
+format_attendance_record, get_punch_type_text, JSON encoding, the
+columnar punch store) over synthetic punch datasets and compares them
+with stored baselines
+
+Usage:
+    python benchmarks/bench_data_path.py                     # compare with baselines.json
+    python benchmarks/bench_data_path.py --sizes 10000 100000
+    python benchmarks/bench_data_path.py --update-baseline   # record new baselines
+
+Exits with status 1 when a case is slower than its baseline by more than
+--threshold. Timings are scaled by a calibration loop so baselines
+recorded on a different machine remain comparable.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_ROOT)
+
+BASELINE_PATH = os.path.join(BENCH_DIR, 'baselines.json')
+DEFAULT_SIZES = [10000, 100000, 1000000]
+DEFAULT_THRESHOLD = 0.25
+# Slowdowns smaller than this (seconds) are treated as timer noise
+NOISE_FLOOR = 0.002
+
+
+def make_dataset(size, users=2000, days=90, seed=1):
+    """Synthetic pyzk Attendance records spread over `days`, in time order"""
+    from zk.attendance import Attendance
+
+    rng = random.Random(seed)
+    end = datetime(2025, 1, 1)
+    start = end - timedelta(days=days)
+    span = days * 86400
+    records = []
+    for offset in sorted(rng.randrange(span) for _ in range(size)):
+        uid = rng.randint(1, users)
+        records.append(Attendance(str(1000 + uid), start + timedelta(seconds=offset), 1, rng.randint(0, 1), uid))
+    return records, end
+
+
+def calibrate():
+    """Time a fixed pure-Python workload, used to normalise across machines"""
+    best = None
+    for _ in range(5):
+        began = time.perf_counter()
+        data = {}
+        for i in range(200000):
+            data[i % 1000] = str(i)
+        best = min(best or float('inf'), time.perf_counter() - began)
+    return best
+
+
+def build_cases(records, end):
+    """(name, callable) pairs over one dataset; callables return their output"""
+    from app import filter_attendance_by_date, organize_attendance, format_attendance_record, get_punch_type_text
+    from punch_columns import PunchColumns
+
+    week_start = (end - timedelta(days=7)).strftime('%Y-%m-%d')
+    last_day = end.strftime('%Y-%m-%d')
+    formatted = [format_attendance_record(record) for record in records]
+    payload = {"data": formatted}
+    columns = PunchColumns.from_records('bench', records)
+
+    return [
+        ('filter_7_days', lambda: filter_attendance_by_date(records, week_start, last_day)),
+        ('filter_all', lambda: filter_attendance_by_date(records, '2000-01-01', last_day)),
+        ('organize_attendance', lambda: organize_attendance(records)),
+        ('format_attendance_record', lambda: [format_attendance_record(record) for record in records]),
+        ('get_punch_type_text', lambda: [get_punch_type_text(record.punch) for record in records]),
+        ('json_encode', lambda: json.dumps(payload)),
+        ('columns_build', lambda: PunchColumns.from_records('bench', records)),
+        ('columns_filter_7_days', lambda: columns.select(week_start, last_day)),
+        ('columns_daily_7_days', lambda: columns.select(week_start, last_day).daily()),
+        ('columns_by_user', lambda: columns.by_user()),
+    ]
+
+
+def time_case(fn, repeat, min_total=0.2):
+    """Best wall time in seconds over at least `repeat` runs and min_total seconds"""
+    best = float('inf')
+    total = 0.0
+    runs = 0
+    while runs < repeat or total < min_total:
+        began = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - began
+        best = min(best, elapsed)
+        total += elapsed
+        runs += 1
+    return best
+
+
+def load_baselines():
+    if not os.path.exists(BASELINE_PATH):
+        return None
+    with open(BASELINE_PATH) as f:
+        return json.load(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmark the attendance data path")
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES)
+    parser.add_argument('--only', action='append', help="Only run cases whose name contains this text")
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help="Allowed slowdown versus baseline, 0.25 = 25%%")
+    parser.add_argument('--update-baseline', action='store_true', help="Write the results to baselines.json")
+    parser.add_argument('--json', help="Write results to this file")
+    args = parser.parse_args()
+
+    json_path = os.path.abspath(args.json) if args.json else None
+
+    # Importing app writes config.json and app.log, keep them out of the working tree
+    scratch = tempfile.mkdtemp(prefix='zk-bench-')
+    os.environ['ZK_CONFIG_DIR'] = scratch
+    os.chdir(scratch)
+
+    calibration = calibrate()
+    baselines = None if args.update_baseline else load_baselines()
+    scale = calibration / baselines['calibration'] if baselines else 1.0
+
+    results = {}
+    regressions = []
+    print(f"Calibration {calibration * 1000:.1f} ms" + (f" (x{scale:.2f} of baseline machine)" if baselines else ""))
+    header = f"{'case':<40} {'time ms':>10} {'ns/rec':>9} {'baseline':>10} {'change':>8}"
+    print(header)
+    print('-' * len(header))
+
+    for size in args.sizes:
+        records, end = make_dataset(size)
+        repeat = max(1, min(5, 1000000 // size))
+        for name, fn in build_cases(records, end):
+            if args.only and not any(text in name for text in args.only):
+                continue
+            key = f"{name}/{size}"
+            elapsed = time_case(fn, repeat)
+            results[key] = elapsed
+
+            line = f"{key:<40} {elapsed * 1000:>10.1f} {elapsed / size * 1e9:>9.0f}"
+            base = baselines['results'].get(key) if baselines else None
+            if base:
+                expected = base * scale
+                change = elapsed / expected - 1
+                line += f" {expected * 1000:>10.1f} {change:>+8.0%}"
+                if change > args.threshold and elapsed - expected > NOISE_FLOOR:
+                    regressions.append((key, change))
+                    line += "  REGRESSION"
+            print(line)
+        del records
+
+    report = {
+        'calibration': calibration,
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'recorded': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'results': results,
+    }
+
+    if args.update_baseline:
+        existing = load_baselines()
+        if existing:
+            # Keep baselines for sizes or cases that were not run this time,
+            # rescaled to this machine's calibration
+            rescale = calibration / existing['calibration']
+            merged = {key: value * rescale for key, value in existing['results'].items()}
+            merged.update(results)
+            report['results'] = merged
+        with open(BASELINE_PATH, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+        print(f"Baselines written to {BASELINE_PATH}")
+
+    if json_path:
+        with open(json_path, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+    if regressions:
+        print(f"{len(regressions)} case(s) regressed more than {args.threshold:.0%}:")
+        for key, change in regressions:
+            print(f"  {key}: {change:+.0%}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
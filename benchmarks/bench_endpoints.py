@@ -0,0 +1,191 @@
+"""
+Endpoint Benchmarks for ZK Attendance System
+Runs the Flask endpoints against the ZK simulator and reports latency
+percentiles, so device-facing changes can be measured without hardware
+
+Usage:
+    python benchmarks/bench_endpoints.py --users 500 --punches 20000 --latency-ms 2
+    python benchmarks/bench_endpoints.py --iterations 20 --concurrency 8 --json results.json
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_ROOT)
+sys.path.insert(0, BENCH_DIR)
+
+from zk_simulator import SimulatedDevice, ZKSimulator
+
+DEVICE_ID = 'sim'
+
+# (name, method, path) measured one request at a time
+SCENARIOS = [
+    ('device list', 'GET', '/api/devices'),
+    ('config settings', 'GET', '/api/config-settings'),
+    ('device info', 'GET', '/api/device-info'),
+    ('stats', 'GET', '/api/stats'),
+    ('users', 'GET', '/api/users'),
+    ('attendance', 'GET', '/api/attendance'),
+    ('attendance last 7 days', 'GET', '/api/attendance?start_date={week_ago}&end_date={today}'),
+]
+
+
+def percentile(samples, pct):
+    """Nearest-rank percentile of a list of numbers"""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    rank = max(1, int(round(pct / 100.0 * len(ordered))))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def summarize(name, timings, statuses, wall=None):
+    """Collapse raw timings (seconds) into a result row in milliseconds"""
+    result = {
+        'name': name,
+        'requests': len(timings),
+        'statuses': {str(code): statuses.count(code) for code in sorted(set(statuses))},
+        'mean_ms': round(sum(timings) / len(timings) * 1000, 2) if timings else 0.0,
+        'p50_ms': round(percentile(timings, 50) * 1000, 2),
+        'p95_ms': round(percentile(timings, 95) * 1000, 2),
+        'p99_ms': round(percentile(timings, 99) * 1000, 2),
+        'max_ms': round(max(timings) * 1000, 2) if timings else 0.0,
+    }
+    if wall:
+        result['throughput_rps'] = round(len(timings) / wall, 2)
+    return result
+
+
+def run_sequential(client, name, method, path, iterations):
+    timings = []
+    statuses = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        response = client.open(path, method=method)
+        timings.append(time.perf_counter() - start)
+        statuses.append(response.status_code)
+    return summarize(name, timings, statuses)
+
+
+def run_concurrent(app, name, method, path, concurrency, iterations):
+    """Fire the same request from several threads at once"""
+    timings = []
+    statuses = []
+    lock = threading.Lock()
+    barrier = threading.Barrier(concurrency)
+
+    def worker():
+        client = app.test_client()
+        barrier.wait()
+        for _ in range(iterations):
+            start = time.perf_counter()
+            response = client.open(path, method=method)
+            elapsed = time.perf_counter() - start
+            with lock:
+                timings.append(elapsed)
+                statuses.append(response.status_code)
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return summarize(name, timings, statuses, wall=time.perf_counter() - start)
+
+
+def print_table(results):
+    header = f"{'scenario':<34} {'n':>5} {'mean':>9} {'p50':>9} {'p95':>9} {'p99':>9} {'max':>9}  statuses"
+    print(header)
+    print('-' * len(header))
+    for row in results:
+        statuses = ' '.join(f"{code}x{count}" for code, count in row['statuses'].items())
+        print(f"{row['name']:<34} {row['requests']:>5} {row['mean_ms']:>9.1f} {row['p50_ms']:>9.1f} "
+              f"{row['p95_ms']:>9.1f} {row['p99_ms']:>9.1f} {row['max_ms']:>9.1f}  {statuses}")
+    print("(times in ms)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark API endpoints against a simulated ZK device")
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--punches', type=int, default=20000)
+    parser.add_argument('--days', type=int, default=90)
+    parser.add_argument('--latency-ms', type=float, default=1.0, help="Simulated per-packet device latency")
+    parser.add_argument('--jitter-ms', type=float, default=0.0)
+    parser.add_argument('--loss', type=float, default=0.0, help="Simulated reply loss probability")
+    parser.add_argument('--udp', action='store_true', help="Talk to the simulator over UDP")
+    parser.add_argument('--iterations', type=int, default=5, help="Requests per scenario")
+    parser.add_argument('--concurrency', type=int, default=4, help="Threads for the concurrent scenario, 0 to skip")
+    parser.add_argument('--only', action='append', help="Only run scenarios whose name contains this text")
+    parser.add_argument('--json', help="Write results to this file")
+    args = parser.parse_args()
+
+    json_path = os.path.abspath(args.json) if args.json else None
+
+    # Keep config.json and app.log out of the working tree
+    scratch = tempfile.mkdtemp(prefix='zk-bench-')
+    os.environ['ZK_CONFIG_DIR'] = scratch
+    os.chdir(scratch)
+
+    device = SimulatedDevice(users=args.users, punches=args.punches, days=args.days)
+    simulator = ZKSimulator(device, port=0, latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+                            loss=args.loss, udp=args.udp)
+    port = simulator.start()
+
+    from app import app
+    from device_manager import device_manager
+
+    device_manager.add_device(DEVICE_ID, 'Simulator', '127.0.0.1', port, timeout=10, ommit_ping=True)
+    device_manager.set_active_device(DEVICE_ID)
+    if args.udp:
+        device_manager.devices[DEVICE_ID]['force_udp'] = True
+
+    today = time.strftime('%Y-%m-%d')
+    week_ago = time.strftime('%Y-%m-%d', time.localtime(time.time() - 7 * 86400))
+
+    def selected(name):
+        return not args.only or any(text in name for text in args.only)
+
+    client = app.test_client()
+    results = []
+    for name, method, path in SCENARIOS:
+        if not selected(name):
+            continue
+        path = path.format(today=today, week_ago=week_ago)
+        client.open(path, method=method)  # warm up
+        results.append(run_sequential(client, name, method, path, args.iterations))
+
+    name = f"attendance x{args.concurrency} concurrent"
+    if args.concurrency and selected(name):
+        results.append(run_concurrent(app, name, 'GET', '/api/attendance', args.concurrency, args.iterations))
+
+    simulator.stop()
+
+    print(f"Simulator: {args.users} users, {args.punches} punches, {args.latency_ms} ms latency, "
+          f"{'UDP' if args.udp else 'TCP'}, {simulator.commands} device commands served")
+    print_table(results)
+
+    if json_path:
+        report = {
+            'simulator': {
+                'users': args.users,
+                'punches': args.punches,
+                'latency_ms': args.latency_ms,
+                'jitter_ms': args.jitter_ms,
+                'loss': args.loss,
+                'transport': 'udp' if args.udp else 'tcp',
+            },
+            'results': results,
+        }
+        with open(json_path, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,217 @@
+"""
+Send Benchmarks for ZK Attendance System
+Drives the upload path against the ZK simulator and the stub attendance
+API and reports records/s and tail latency
+
+Two modes:
+    endpoint  POST /api/send-attendance end to end (device download,
+              filtering, formatting, upstream POST and fallback)
+    sweep     send pre-formatted records through send_records_to_api over
+              a grid of batch sizes and worker counts, for tuning
+
+Usage:
+    python benchmarks/bench_send.py endpoint --days-window 7 --iterations 5
+    python benchmarks/bench_send.py sweep --batch-size 100 500 2000 --workers 1 4 8 --rate-limit 20
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_ROOT)
+sys.path.insert(0, BENCH_DIR)
+
+from zk_simulator import SimulatedDevice, ZKSimulator
+from stub_api import StubAPI
+from bench_endpoints import percentile
+
+DEVICE_ID = 'sim'
+
+
+def latency_row(timings):
+    """p50/p95/p99/max of a list of seconds, in milliseconds"""
+    return {
+        'p50_ms': round(percentile(timings, 50) * 1000, 2),
+        'p95_ms': round(percentile(timings, 95) * 1000, 2),
+        'p99_ms': round(percentile(timings, 99) * 1000, 2),
+        'max_ms': round(max(timings) * 1000, 2) if timings else 0.0,
+    }
+
+
+def run_endpoint(app, args):
+    """Time complete /api/send-attendance requests"""
+    end = datetime.now()
+    start = end - timedelta(days=args.days_window)
+    body = {'start_date': start.strftime('%Y-%m-%d'), 'end_date': end.strftime('%Y-%m-%d')}
+
+    client = app.test_client()
+    timings = []
+    sent = 0
+    statuses = []
+    for _ in range(args.iterations):
+        began = time.perf_counter()
+        response = client.post('/api/send-attendance', json=body)
+        timings.append(time.perf_counter() - began)
+        statuses.append(response.status_code)
+        sent += (response.get_json() or {}).get('records_sent', 0)
+
+    wall = sum(timings)
+    row = {
+        'name': f"send-attendance {args.days_window}d",
+        'requests': len(timings),
+        'records_sent': sent,
+        'records_per_s': round(sent / wall, 1) if wall else 0.0,
+        'statuses': {str(code): statuses.count(code) for code in sorted(set(statuses))},
+    }
+    row.update(latency_row(timings))
+    return [row]
+
+
+def send_batch(api_url, batch, retries):
+    """POST one batch, honouring Retry-After on 429; returns (accepted, statuses, post timings)"""
+    from app import send_records_to_api
+
+    statuses = []
+    timings = []
+    for attempt in range(retries + 1):
+        began = time.perf_counter()
+        success, response = send_records_to_api(api_url, batch)
+        timings.append(time.perf_counter() - began)
+        status = response.status_code if response is not None else 'error'
+        statuses.append(status)
+        if success:
+            return len(batch), statuses, timings
+        if status != 429 or attempt == retries:
+            break
+        time.sleep(float(response.headers.get('Retry-After', 1)))
+    return 0, statuses, timings
+
+
+def run_sweep(stub, args):
+    """Send the same records with every batch size / worker count combination"""
+    from app import fetch_attendance, format_attendance_record
+
+    records = [format_attendance_record(record) for record in fetch_attendance(DEVICE_ID)]
+    rows = []
+    for batch_size in args.batch_size:
+        batches = [records[i:i + batch_size] for i in range(0, len(records), batch_size)]
+        for workers in args.workers:
+            stub.reset()
+            accepted = 0
+            statuses = []
+            timings = []
+            lock = threading.Lock()
+
+            def work(batch):
+                nonlocal accepted
+                result = send_batch(stub.url, batch, args.retries)
+                with lock:
+                    accepted += result[0]
+                    statuses.extend(result[1])
+                    timings.extend(result[2])
+
+            began = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                list(pool.map(work, batches))
+            wall = time.perf_counter() - began
+
+            row = {
+                'name': f"batch {batch_size} x{workers} workers",
+                'batch_size': batch_size,
+                'workers': workers,
+                'requests': len(timings),
+                'records_sent': accepted,
+                'records_failed': len(records) - accepted,
+                'records_per_s': round(accepted / wall, 1) if wall else 0.0,
+                'statuses': {str(code): statuses.count(code) for code in sorted(set(statuses), key=str)},
+            }
+            row.update(latency_row(timings))
+            rows.append(row)
+    return rows
+
+
+def print_table(rows):
+    header = (f"{'scenario':<28} {'posts':>6} {'sent':>8} {'rec/s':>10} "
+              f"{'p50':>9} {'p95':>9} {'p99':>9} {'max':>9}  statuses")
+    print(header)
+    print('-' * len(header))
+    for row in rows:
+        statuses = ' '.join(f"{code}x{count}" for code, count in row['statuses'].items())
+        print(f"{row['name']:<28} {row['requests']:>6} {row['records_sent']:>8} {row['records_per_s']:>10.1f} "
+              f"{row['p50_ms']:>9.1f} {row['p95_ms']:>9.1f} {row['p99_ms']:>9.1f} {row['max_ms']:>9.1f}  {statuses}")
+    print("(latency in ms; per request in endpoint mode, per upstream POST in sweep mode)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the attendance upload path against a stub API")
+    parser.add_argument('mode', choices=['endpoint', 'sweep'])
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--punches', type=int, default=20000)
+    parser.add_argument('--days', type=int, default=90, help="Simulated punch history in days")
+    parser.add_argument('--device-latency-ms', type=float, default=1.0)
+    parser.add_argument('--days-window', type=int, default=7, help="Date range sent in endpoint mode")
+    parser.add_argument('--iterations', type=int, default=3, help="Requests in endpoint mode")
+    parser.add_argument('--batch-size', type=int, nargs='+', default=[100, 1000, 5000])
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 4])
+    parser.add_argument('--retries', type=int, default=3, help="Retries after a 429 in sweep mode")
+    parser.add_argument('--latency-ms', type=float, default=20.0, help="Stub API base latency")
+    parser.add_argument('--jitter-ms', type=float, default=10.0)
+    parser.add_argument('--per-record-ms', type=float, default=0.01)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--max-payload-kb', type=float, help="Stub replies 413 above this size")
+    parser.add_argument('--rate-limit', type=float, help="Stub replies 429 above this many requests/s")
+    parser.add_argument('--json', help="Write results to this file")
+    args = parser.parse_args()
+
+    json_path = os.path.abspath(args.json) if args.json else None
+
+    # Keep config.json and app.log out of the working tree
+    scratch = tempfile.mkdtemp(prefix='zk-bench-')
+    os.environ['ZK_CONFIG_DIR'] = scratch
+    os.chdir(scratch)
+
+    simulator = ZKSimulator(SimulatedDevice(users=args.users, punches=args.punches, days=args.days),
+                            port=0, latency_ms=args.device_latency_ms)
+    port = simulator.start()
+    stub = StubAPI(latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, per_record_ms=args.per_record_ms,
+                   error_rate=args.error_rate,
+                   max_payload_bytes=int(args.max_payload_kb * 1024) if args.max_payload_kb else None,
+                   rate_limit=args.rate_limit, seed=1)
+    stub.start()
+
+    from app import app, update_config
+    from device_manager import device_manager
+
+    device_manager.add_device(DEVICE_ID, 'Simulator', '127.0.0.1', port, timeout=10, ommit_ping=True)
+    device_manager.set_active_device(DEVICE_ID)
+    update_config({'attendance_api_url': stub.url})
+
+    if args.mode == 'endpoint':
+        if args.max_payload_kb or args.error_rate or args.rate_limit:
+            print("Note: rejected batches fall back to one POST per record with a 0.5 s pause each")
+        rows = run_endpoint(app, args)
+    else:
+        rows = run_sweep(stub, args)
+
+    stub_stats = stub.stats()
+    stub.stop()
+    simulator.stop()
+
+    print(f"Stub API: {args.latency_ms} ms latency, error rate {args.error_rate}, "
+          f"max payload {args.max_payload_kb or '-'} KB, rate limit {args.rate_limit or '-'}/s")
+    print_table(rows)
+
+    if json_path:
+        with open(json_path, 'w') as f:
+            json.dump({'mode': args.mode, 'args': vars(args), 'stub': stub_stats, 'results': rows}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
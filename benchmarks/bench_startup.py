@@ -0,0 +1,140 @@
+"""
+Startup Benchmarks for ZK Attendance System
+Measures how long a fresh interpreter takes to import the app and answer
+its first request, and reports the imports that dominate that time
+
+Usage:
+    python benchmarks/bench_startup.py                   # import app, 5 runs
+    python benchmarks/bench_startup.py --runs 10 --top 25 --first-request /api/dashboard
+    python benchmarks/bench_startup.py --json startup.json
+
+Each run is a new Python process started with -X importtime, so module
+caches do not hide the cost. Exits with status 1 when one of the modules
+that should only load on demand (see DEFERRED) is imported at startup.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(BENCH_DIR)
+
+# Slow modules only needed by some features; they must not load at startup
+DEFERRED = ['numpy', 'openpyxl', 'pyarrow', 'requests', 'urllib3']
+
+# Runs in the child process; prints its timings as JSON after MARKER (the app
+# logs to stdout too)
+MARKER = 'startup-timings:'
+CHILD = """
+import json, sys, time
+started = time.perf_counter()
+module = __import__({module!r})
+imported = time.perf_counter()
+first_request = None
+if {path!r}:
+    from app import app
+    app.test_client().get({path!r})
+    first_request = time.perf_counter() - imported
+print({marker!r} + json.dumps({{'import': imported - started, 'first_request': first_request,
+                  'modules': sorted(sys.modules)}}))
+"""
+
+
+def parse_importtime(stderr):
+    """(name, depth, self_us, cumulative_us) for every line of -X importtime output"""
+    entries = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip())) // 2
+        entries.append((name.strip(), depth, int(self_us), int(cumulative_us)))
+    return entries
+
+
+def run_once(module, path, scratch):
+    env = dict(os.environ, ZK_CONFIG_DIR=scratch, PYTHONPATH=os.pathsep.join(
+        [REPO_ROOT] + ([os.environ['PYTHONPATH']] if os.environ.get('PYTHONPATH') else [])))
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', CHILD.format(module=module, path=path, marker=MARKER)],
+        cwd=scratch, env=env, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{result.stderr[-2000:]}")
+    line = next(line for line in result.stdout.splitlines() if line.startswith(MARKER))
+    timings = json.loads(line[len(MARKER):])
+    timings['entries'] = parse_importtime(result.stderr)
+    return timings
+
+
+def summarize(runs, top):
+    """Median timings and the slowest imports, averaged over runs"""
+    self_times = {}
+    cumulative_times = {}
+    depths = {}
+    for run in runs:
+        for name, depth, self_us, cumulative_us in run['entries']:
+            self_times.setdefault(name, []).append(self_us)
+            cumulative_times.setdefault(name, []).append(cumulative_us)
+            depths[name] = min(depth, depths.get(name, depth))
+
+    def mean_ms(samples):
+        return round(sum(samples) / len(runs) / 1000, 2)
+
+    first_requests = [run['first_request'] for run in runs if run['first_request'] is not None]
+    loaded = set(runs[0]['modules'])
+    return {
+        'import_ms': round(statistics.median(run['import'] for run in runs) * 1000, 1),
+        'first_request_ms': round(statistics.median(first_requests) * 1000, 1) if first_requests else None,
+        'modules_loaded': len(loaded),
+        # Top-level imports show which direct dependency to defer
+        'slowest_imports': sorted(
+            ((name, mean_ms(samples)) for name, samples in cumulative_times.items() if depths[name] <= 1),
+            key=lambda item: item[1], reverse=True)[:top],
+        'slowest_modules': sorted(
+            ((name, mean_ms(samples)) for name, samples in self_times.items()),
+            key=lambda item: item[1], reverse=True)[:top],
+        'deferred_loaded': [name for name in DEFERRED if name in loaded],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Profile the app's import time in fresh processes")
+    parser.add_argument('--module', default='app', help="Module to import")
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=15, help="Imports listed in each table")
+    parser.add_argument('--first-request', default='/api/stats',
+                        help="Path requested after the import, empty to skip")
+    parser.add_argument('--json', help="Write results to this file")
+    args = parser.parse_args()
+
+    # Keep config.json, app.log and the attendance database out of the working tree
+    scratch = tempfile.mkdtemp(prefix='zk-startup-')
+    runs = [run_once(args.module, args.first_request, scratch) for _ in range(args.runs)]
+    summary = summarize(runs, args.top)
+
+    print(f"import {args.module}: {summary['import_ms']} ms (median of {args.runs}), "
+          f"{summary['modules_loaded']} modules loaded")
+    if summary['first_request_ms'] is not None:
+        print(f"first request {args.first_request}: {summary['first_request_ms']} ms")
+    print("\nSlowest imports (cumulative ms, top level)")
+    for name, ms in summary['slowest_imports']:
+        print(f"  {ms:8.2f}  {name}")
+    print("\nSlowest modules (self ms)")
+    for name, ms in summary['slowest_modules']:
+        print(f"  {ms:8.2f}  {name}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(summary, f, indent=2)
+
+    if summary['deferred_loaded']:
+        print(f"\nLoaded at startup but should be deferred: {', '.join(summary['deferred_loaded'])}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
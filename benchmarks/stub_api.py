@@ -0,0 +1,205 @@
+"""
+Stub Attendance API for ZK Attendance System
+A local stand-in for the upstream attendance endpoint with configurable
+latency, error rate, payload limit (413) and rate limit (429)
+
+Usage:
+    python benchmarks/stub_api.py --port 8099 --latency-ms 50 --max-payload-kb 512 --rate-limit 20
+"""
+import argparse
+import json
+import logging
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Configure logging
+logger = logging.getLogger('stub_api')
+
+
+class TokenBucket:
+    """Simple rate limiter, rate requests per second with a burst allowance"""
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.capacity = float(burst or max(1, rate))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def take(self):
+        """Consume a token, returns seconds to wait (0 if allowed)"""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            return (1 - self.tokens) / self.rate
+
+
+class StubAPI:
+    """Threaded HTTP server that accepts {"data": [...]} attendance payloads"""
+
+    def __init__(self, host='127.0.0.1', port=0, latency_ms=0.0, jitter_ms=0.0,
+                 per_record_ms=0.0, error_rate=0.0, error_status=500,
+                 max_payload_bytes=None, rate_limit=None, burst=None, seed=None):
+        self.host = host
+        self.port = port
+        self.latency = latency_ms / 1000.0
+        self.jitter = jitter_ms / 1000.0
+        self.per_record = per_record_ms / 1000.0
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.max_payload_bytes = max_payload_bytes
+        self.bucket = TokenBucket(rate_limit, burst) if rate_limit else None
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.requests = 0
+            self.records_accepted = 0
+            self.bytes_received = 0
+            self.statuses = {}
+
+    def stats(self):
+        with self._lock:
+            return {
+                'requests': self.requests,
+                'records_accepted': self.records_accepted,
+                'bytes_received': self.bytes_received,
+                'statuses': dict(self.statuses)
+            }
+
+    def _record(self, status, size, accepted=0):
+        with self._lock:
+            self.requests += 1
+            self.bytes_received += size
+            self.records_accepted += accepted
+            self.statuses[str(status)] = self.statuses.get(str(status), 0) + 1
+
+    def _roll(self):
+        with self._lock:
+            return self._rng.random(), self._rng.uniform(0, self.jitter)
+
+    def handle_post(self, body):
+        """Decide the response for a payload, returns (status, headers, document)"""
+        size = len(body)
+        if self.max_payload_bytes and size > self.max_payload_bytes:
+            self._record(413, size)
+            return 413, {}, {"status": "error", "message": f"Payload of {size} bytes exceeds {self.max_payload_bytes}"}
+
+        if self.bucket:
+            wait = self.bucket.take()
+            if wait:
+                self._record(429, size)
+                return 429, {'Retry-After': str(max(1, round(wait)))}, {"status": "error", "message": "Too many requests"}
+
+        try:
+            records = json.loads(body).get('data', [])
+        except (ValueError, AttributeError):
+            self._record(400, size)
+            return 400, {}, {"status": "error", "message": "Body must be a JSON object with a data array"}
+
+        roll, jitter = self._roll()
+        time.sleep(self.latency + jitter + self.per_record * len(records))
+
+        if roll < self.error_rate:
+            self._record(self.error_status, size)
+            return self.error_status, {}, {"status": "error", "message": "Injected failure"}
+
+        self._record(200, size, len(records))
+        return 200, {}, {"status": "success", "received": len(records)}
+
+    def start(self):
+        """Start serving in a background thread, returns the bound port"""
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def _send(self, status, document, headers=None):
+                payload = json.dumps(document).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                body = self.rfile.read(length)
+                if self.path.rstrip('/') == '/reset':
+                    stub.reset()
+                    self._send(200, {"status": "success"})
+                    return
+                status, headers, document = stub.handle_post(body)
+                self._send(status, document, headers)
+
+            def do_GET(self):
+                if self.path.rstrip('/') == '/stats':
+                    self._send(200, stub.stats())
+                else:
+                    self._send(404, {"status": "error", "message": "POST attendance payloads to any path"})
+
+            def log_message(self, format, *args):
+                logger.debug(format % args)
+
+        self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        logger.info(f"Stub attendance API listening on {self.url}")
+        return self.port
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}/attendance"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a stub upstream attendance API")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8099)
+    parser.add_argument('--latency-ms', type=float, default=0.0, help="Base delay per request")
+    parser.add_argument('--jitter-ms', type=float, default=0.0, help="Random extra delay per request")
+    parser.add_argument('--per-record-ms', type=float, default=0.0, help="Extra delay per record in the payload")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Probability of an injected failure")
+    parser.add_argument('--error-status', type=int, default=500)
+    parser.add_argument('--max-payload-kb', type=float, help="Reply 413 to larger payloads")
+    parser.add_argument('--rate-limit', type=float, help="Requests per second before replying 429")
+    parser.add_argument('--burst', type=int, help="Requests allowed in a burst above the rate limit")
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    stub = StubAPI(args.host, args.port, latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+                   per_record_ms=args.per_record_ms, error_rate=args.error_rate,
+                   error_status=args.error_status,
+                   max_payload_bytes=int(args.max_payload_kb * 1024) if args.max_payload_kb else None,
+                   rate_limit=args.rate_limit, burst=args.burst, seed=args.seed)
+    stub.start()
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        stub.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,549 @@
+"""
+ZK Device Simulator for ZK Attendance System
+Speaks enough of the ZK TCP/UDP protocol for pyzk's connect, get_users,
+get_attendance, set_user, delete_user and template commands to work
+against a local, configurable fake terminal
+
+Usage:
+    python benchmarks/zk_simulator.py --users 5000 --punches 100000 --latency-ms 5
+"""
+import argparse
+import logging
+import random
+import socketserver
+import threading
+import time
+from datetime import datetime, timedelta
+from struct import pack, unpack
+
+from zk import const
+
+# Configure logging
+logger = logging.getLogger('zk_simulator')
+
+# Largest CMD_DATA payload a UDP client reads per datagram (recv(1024 + 8))
+UDP_CHUNK = 1024
+
+# Extra delay applied to a "lost" TCP segment, modelling a retransmission timeout
+TCP_RETRANSMIT_DELAY = 0.2
+
+# CMD_READ_BUFFER / CMD_PREPARE_BUFFER are not named in pyzk's const module
+CMD_PREPARE_BUFFER = 1503
+CMD_READ_BUFFER = 1504
+CMD_GET_USER_TEMPLATE = 88
+CMD_SAVE_USERTEMPS = 110
+
+
+def checksum(buf):
+    """Packet checksum, same algorithm as pyzk / zkemsdk.c"""
+    total = 0
+    length = len(buf)
+    i = 0
+    while length > 1:
+        total += buf[i] | (buf[i + 1] << 8)
+        if total > const.USHRT_MAX:
+            total -= const.USHRT_MAX
+        i += 2
+        length -= 2
+    if length:
+        total += buf[-1]
+    while total > const.USHRT_MAX:
+        total -= const.USHRT_MAX
+    total = ~total
+    while total < 0:
+        total += const.USHRT_MAX
+    return total
+
+
+def make_packet(command, session_id, reply_id, data=b''):
+    """Build a response header + payload"""
+    chk = checksum(pack('<4H', command, 0, session_id, reply_id) + data)
+    return pack('<4H', command, chk, session_id, reply_id) + data
+
+
+def encode_time(t):
+    """Encode a datetime the way ZK terminals store it (zkemsdk.c EncodeTime)"""
+    return (
+        ((t.year % 100) * 12 * 31 + ((t.month - 1) * 31) + t.day - 1) *
+        (24 * 60 * 60) + (t.hour * 60 + t.minute) * 60 + t.second
+    )
+
+
+def _cstr(value, encoding='UTF-8'):
+    return value.split(b'\x00')[0].decode(encoding, errors='ignore')
+
+
+class SimulatedDevice:
+    """In-memory state of a fake ZK terminal"""
+
+    def __init__(self, users=100, punches=1000, days=30, fingers_per_user=0,
+                 serial_number='SIM0000001', seed=1):
+        self.lock = threading.RLock()
+        self.serial_number = serial_number
+        self.firmware_version = 'Ver 6.60 Sim'
+        self.platform = 'ZMM220_TFT'
+        self.device_name = 'ZK Simulator'
+        self.enabled = True
+        self._version = 0
+        self._cache = {}
+
+        rng = random.Random(seed)
+        self.users = {}
+        for uid in range(1, users + 1):
+            self.users[uid] = {
+                'uid': uid,
+                'privilege': const.USER_DEFAULT,
+                'password': '',
+                'name': f"User {uid}",
+                'card': 0,
+                'group_id': '1',
+                'user_id': str(1000 + uid)
+            }
+
+        self.templates = {}
+        for uid in range(1, users + 1):
+            for fid in range(fingers_per_user):
+                self.templates[(uid, fid)] = (1, rng.randbytes(512))
+
+        # Punches spread over the last `days` days, in time order
+        self.attendance = []
+        if users:
+            now = datetime.now().replace(microsecond=0)
+            start = now - timedelta(days=days)
+            span = int((now - start).total_seconds())
+            for offset in sorted(rng.randrange(span) for _ in range(punches)):
+                uid = rng.randint(1, users)
+                self.attendance.append((uid, self.users[uid]['user_id'], 1,
+                                        start + timedelta(seconds=offset), rng.randint(0, 1)))
+
+    def _changed(self):
+        self._version += 1
+        self._cache.clear()
+
+    def add_punch(self, uid, timestamp=None, punch=0, status=1):
+        """Record a new punch, as if a user badged on the terminal"""
+        with self.lock:
+            user = self.users[uid]
+            self.attendance.append((uid, user['user_id'], status, timestamp or datetime.now().replace(microsecond=0), punch))
+            self._changed()
+
+    def sizes(self):
+        """CMD_GET_FREE_SIZES payload: 20 ints of counters plus 3 of face info"""
+        with self.lock:
+            fields = [0] * 20
+            fields[4] = len(self.users)
+            fields[6] = len(self.templates)
+            fields[8] = len(self.attendance)
+            fields[14] = 3000
+            fields[15] = 10000
+            fields[16] = 1000000
+            fields[17] = fields[14] - fields[6]
+            fields[18] = fields[15] - fields[4]
+            fields[19] = fields[16] - fields[8]
+            return pack('20i', *fields) + pack('3i', 0, 0, 0)
+
+    def _cached(self, key, build):
+        with self.lock:
+            data = self._cache.get(key)
+            if data is None:
+                data = build()
+                self._cache[key] = data
+            return data
+
+    def user_buffer(self):
+        """Users in the 72-byte (ZK8) record format, prefixed with the total size"""
+        def build():
+            records = b''.join(
+                pack('<HB8s24sIx7sx24s', u['uid'], u['privilege'], u['password'].encode(),
+                     u['name'].encode(), u['card'], u['group_id'].encode(), u['user_id'].encode())
+                for u in self.users.values())
+            return pack('I', len(records)) + records
+        return self._cached('users', build)
+
+    def attendance_buffer(self):
+        """Punches in the 40-byte record format, prefixed with the total size"""
+        def build():
+            records = b''.join(
+                pack('<H24sB4sB8s', uid, user_id.encode(), status,
+                     pack('<I', encode_time(timestamp)), punch, b'')
+                for uid, user_id, status, timestamp, punch in self.attendance)
+            return pack('I', len(records)) + records
+        return self._cached('attendance', build)
+
+    def template_buffer(self):
+        """Fingerprint templates, prefixed with the total size"""
+        def build():
+            records = b''.join(
+                pack('<HHbb', len(template) + 6, uid, fid, valid) + template
+                for (uid, fid), (valid, template) in sorted(self.templates.items()))
+            return pack('i', len(records)) + records
+        return self._cached('templates', build)
+
+    def set_user(self, data):
+        """Apply a CMD_USER_WRQ payload (28 or 72 byte format)"""
+        if len(data) >= 72:
+            uid, privilege, password, name, card, group_id, user_id = unpack('<HB8s24s4sx7sx24s', data[:72])
+            card = unpack('<I', card)[0]
+            group_id = _cstr(group_id)
+            user_id = _cstr(user_id)
+        else:
+            uid, privilege, password, name, card, group_id, _tz, user_id = unpack('<HB5s8sIxBHI', data[:28])
+            group_id = str(group_id)
+            user_id = str(user_id)
+        with self.lock:
+            self.users[uid] = {
+                'uid': uid,
+                'privilege': privilege,
+                'password': _cstr(password),
+                'name': _cstr(name),
+                'card': card,
+                'group_id': group_id,
+                'user_id': user_id
+            }
+            self._changed()
+
+    def delete_user(self, uid):
+        with self.lock:
+            if self.users.pop(uid, None) is None:
+                return False
+            for key in [k for k in self.templates if k[0] == uid]:
+                del self.templates[key]
+            self._changed()
+            return True
+
+    def save_user_templates(self, buffer):
+        """Apply a CMD_SAVE_USERTEMPS upload (users, template table, templates)"""
+        upack_len, table_len, fpack_len = unpack('III', buffer[:12])
+        upack = buffer[12:12 + upack_len]
+        table = buffer[12 + upack_len:12 + upack_len + table_len]
+        fpack = buffer[12 + upack_len + table_len:12 + upack_len + table_len + fpack_len]
+
+        record_size = 73 if upack_len % 73 == 0 else 29
+        with self.lock:
+            for i in range(0, len(upack), record_size):
+                chunk = upack[i:i + record_size]
+                if record_size == 73:
+                    _, uid, privilege, password, name, card, _, group_id, user_id = unpack('<BHB8s24sIB7sx24s', chunk)
+                    group_id = _cstr(group_id)
+                    user_id = _cstr(user_id)
+                else:
+                    _, uid, privilege, password, name, card, group_id, _, user_id = unpack('<BHB5s8sIxBhI', chunk)
+                    group_id = str(group_id)
+                    user_id = str(user_id)
+                self.users[uid] = {
+                    'uid': uid,
+                    'privilege': privilege,
+                    'password': _cstr(password),
+                    'name': _cstr(name),
+                    'card': card,
+                    'group_id': group_id,
+                    'user_id': user_id
+                }
+            for i in range(0, len(table), 8):
+                _, uid, fnum, start = unpack('<bHbI', table[i:i + 8])
+                size = unpack('H', fpack[start:start + 2])[0]
+                self.templates[(uid, fnum - 0x10)] = (1, fpack[start + 2:start + 2 + size])
+            self._changed()
+
+    def option(self, key):
+        values = {
+            '~SerialNumber': self.serial_number,
+            '~Platform': self.platform,
+            '~DeviceName': self.device_name,
+            'MAC': '00:17:61:00:00:01',
+            '~ZKFPVersion': '10',
+            '~ExtendFmt': '0',
+            '~UserExtFmt': '0',
+            'FaceFunOn': '0',
+            'CompatOldFirmware': '0',
+            'IPAddress': '127.0.0.1',
+            'NetMask': '255.255.255.0',
+            'GATEIPAddress': '0.0.0.0',
+        }
+        return values.get(key, '')
+
+
+class _Session:
+    """Per-connection protocol state"""
+
+    def __init__(self, session_id):
+        self.session_id = session_id
+        self.read_buffer = b''
+        self.upload = b''
+        self.upload_size = 0
+
+
+class ZKSimulator:
+    """Serves a SimulatedDevice over TCP and UDP"""
+
+    def __init__(self, device=None, host='127.0.0.1', port=4370, latency_ms=0.0,
+                 jitter_ms=0.0, loss=0.0, udp=True, seed=None):
+        self.device = device or SimulatedDevice()
+        self.host = host
+        self.port = port
+        self.latency = latency_ms / 1000.0
+        self.jitter = jitter_ms / 1000.0
+        self.loss = loss
+        self.udp = udp
+        self._rng = random.Random(seed)
+        self._rng_lock = threading.Lock()
+        self._session_lock = threading.Lock()
+        self._next_session = 1
+        self._udp_sessions = {}
+        self._servers = []
+        self._threads = []
+        self.commands = 0
+
+    # -- fault injection -------------------------------------------------
+
+    def _delay(self):
+        if self.latency or self.jitter:
+            with self._rng_lock:
+                delay = self.latency + self._rng.uniform(0, self.jitter)
+            time.sleep(delay)
+
+    def _lost(self):
+        if not self.loss:
+            return False
+        with self._rng_lock:
+            return self._rng.random() < self.loss
+
+    def _new_session(self):
+        with self._session_lock:
+            session_id = self._next_session
+            self._next_session = self._next_session % 0xfffe + 1
+            return _Session(session_id)
+
+    # -- command dispatch -------------------------------------------------
+
+    def dispatch(self, command, data, session, transport):
+        """Handle one request, returning a list of (command, payload) replies"""
+        self.commands += 1
+        device = self.device
+        ok = [(const.CMD_ACK_OK, b'')]
+
+        if command in (const.CMD_CONNECT, const.CMD_AUTH):
+            return ok
+        if command == const.CMD_EXIT:
+            return ok
+        if command == const.CMD_ACK_OK:
+            return []  # client acknowledging an event, no reply
+        if command in (const.CMD_ENABLEDEVICE, const.CMD_DISABLEDEVICE):
+            device.enabled = command == const.CMD_ENABLEDEVICE
+            return ok
+        if command in (const.CMD_REFRESHDATA, const.CMD_TESTVOICE, const.CMD_UNLOCK, const.CMD_REG_EVENT):
+            return ok
+        if command == const.CMD_GET_VERSION:
+            return [(const.CMD_ACK_OK, device.firmware_version.encode() + b'\x00')]
+        if command == const.CMD_OPTIONS_RRQ:
+            key = _cstr(data)
+            value = device.option(key)
+            return [(const.CMD_ACK_OK, f"{key}={value}".encode() + b'\x00')]
+        if command == const.CMD_GET_FREE_SIZES:
+            return [(const.CMD_ACK_OK, device.sizes())]
+        if command == const.CMD_GET_TIME:
+            return [(const.CMD_ACK_OK, pack('<I', encode_time(datetime.now())))]
+        if command == const.CMD_GET_PINWIDTH:
+            return [(const.CMD_ACK_OK, bytes([9]) + b'\x00')]
+
+        if command == CMD_PREPARE_BUFFER:
+            _, inner, fct, _ext = unpack('<bhii', data[:11])
+            if inner == const.CMD_USERTEMP_RRQ:
+                session.read_buffer = device.user_buffer()
+            elif inner == const.CMD_ATTLOG_RRQ:
+                session.read_buffer = device.attendance_buffer()
+            elif inner == const.CMD_DB_RRQ and fct == const.FCT_FINGERTMP:
+                session.read_buffer = device.template_buffer()
+            else:
+                session.read_buffer = pack('I', 0)
+            return [(const.CMD_ACK_OK, b'\x00' + pack('I', len(session.read_buffer)) + b'\x00' * 4)]
+        if command == CMD_READ_BUFFER:
+            start, size = unpack('<ii', data[:8])
+            chunk = session.read_buffer[start:start + size]
+            if transport == 'tcp':
+                return [(const.CMD_DATA, chunk)]
+            replies = [(const.CMD_PREPARE_DATA, pack('I', len(chunk)))]
+            for i in range(0, len(chunk), UDP_CHUNK):
+                replies.append((const.CMD_DATA, chunk[i:i + UDP_CHUNK]))
+            replies.append((const.CMD_ACK_OK, b''))
+            return replies
+        if command == const.CMD_FREE_DATA:
+            session.read_buffer = b''
+            session.upload = b''
+            return ok
+
+        if command == const.CMD_PREPARE_DATA:
+            session.upload_size = unpack('I', data[:4])[0]
+            session.upload = b''
+            return ok
+        if command == const.CMD_DATA:
+            session.upload += data
+            return ok
+        if command == CMD_SAVE_USERTEMPS:
+            device.save_user_templates(session.upload)
+            session.upload = b''
+            return ok
+
+        if command == const.CMD_USER_WRQ:
+            device.set_user(data)
+            return ok
+        if command == const.CMD_DELETE_USER:
+            uid = unpack('h', data[:2])[0]
+            return ok if device.delete_user(uid) else [(const.CMD_ACK_ERROR, b'')]
+        if command == const.CMD_DELETE_USERTEMP:
+            uid, fid = unpack('hb', data[:3])
+            with device.lock:
+                removed = device.templates.pop((uid, fid), None)
+                device._changed()
+            return ok if removed else [(const.CMD_ACK_ERROR, b'')]
+        if command == CMD_GET_USER_TEMPLATE:
+            uid, fid = unpack('hb', data[:3])
+            with device.lock:
+                entry = device.templates.get((uid, fid))
+            if not entry:
+                return [(const.CMD_ACK_ERROR, b'')]
+            return [(const.CMD_DATA, entry[1] + b'\x00')]
+        if command == const.CMD_CLEAR_ATTLOG:
+            with device.lock:
+                device.attendance = []
+                device._changed()
+            return ok
+        if command == const.CMD_CLEAR_DATA:
+            with device.lock:
+                device.users = {}
+                device.templates = {}
+                device.attendance = []
+                device._changed()
+            return ok
+
+        logger.debug(f"Unsupported command {command}")
+        return [(const.CMD_ACK_UNKNOWN, b'')]
+
+    # -- servers ----------------------------------------------------------
+
+    def start(self):
+        """Start serving in background threads, returns the bound port"""
+        simulator = self
+
+        class TCPHandler(socketserver.BaseRequestHandler):
+            def handle(self):
+                sock = self.request
+                session = simulator._new_session()
+                while True:
+                    top = _recv_exact(sock, 8)
+                    if not top:
+                        return
+                    magic1, magic2, length = unpack('<HHI', top)
+                    if (magic1, magic2) != (const.MACHINE_PREPARE_DATA_1, const.MACHINE_PREPARE_DATA_2):
+                        return
+                    packet = _recv_exact(sock, length)
+                    if not packet or len(packet) < 8:
+                        return
+                    command, _, _, reply_id = unpack('<4H', packet[:8])
+                    replies = simulator.dispatch(command, packet[8:], session, 'tcp')
+                    for reply_command, payload in replies:
+                        simulator._delay()
+                        if simulator._lost():
+                            # TCP retransmits, so loss shows up as extra latency
+                            time.sleep(TCP_RETRANSMIT_DELAY)
+                        body = make_packet(reply_command, session.session_id, reply_id, payload)
+                        sock.sendall(pack('<HHI', const.MACHINE_PREPARE_DATA_1,
+                                          const.MACHINE_PREPARE_DATA_2, len(body)) + body)
+                    if command == const.CMD_EXIT:
+                        return
+
+        class UDPHandler(socketserver.BaseRequestHandler):
+            def handle(self):
+                packet, sock = self.request
+                if len(packet) < 8:
+                    return
+                command, _, session_id, reply_id = unpack('<4H', packet[:8])
+                with simulator._session_lock:
+                    session = simulator._udp_sessions.get(session_id)
+                if command == const.CMD_CONNECT or session is None:
+                    session = simulator._new_session()
+                    with simulator._session_lock:
+                        simulator._udp_sessions[session.session_id] = session
+                replies = simulator.dispatch(command, packet[8:], session, 'udp')
+                for reply_command, payload in replies:
+                    simulator._delay()
+                    if simulator._lost():
+                        continue  # datagram dropped, the client times out
+                    sock.sendto(make_packet(reply_command, session.session_id, reply_id, payload),
+                                self.client_address)
+                if command == const.CMD_EXIT:
+                    with simulator._session_lock:
+                        simulator._udp_sessions.pop(session.session_id, None)
+
+        class TCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+            allow_reuse_address = True
+            daemon_threads = True
+
+        class UDPServer(socketserver.ThreadingMixIn, socketserver.UDPServer):
+            allow_reuse_address = True
+            daemon_threads = True
+
+        tcp_server = TCPServer((self.host, self.port), TCPHandler)
+        self.port = tcp_server.server_address[1]
+        self._servers.append(tcp_server)
+        if self.udp:
+            self._servers.append(UDPServer((self.host, self.port), UDPHandler))
+
+        for server in self._servers:
+            thread = threading.Thread(target=server.serve_forever, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info(f"ZK simulator listening on {self.host}:{self.port} "
+                    f"({len(self.device.users)} users, {len(self.device.attendance)} punches)")
+        return self.port
+
+    def stop(self):
+        for server in self._servers:
+            server.shutdown()
+            server.server_close()
+        self._servers = []
+        self._threads = []
+
+
+def _recv_exact(sock, size):
+    """Read exactly size bytes, or return b'' if the peer closed the connection"""
+    chunks = []
+    while size > 0:
+        chunk = sock.recv(size)
+        if not chunk:
+            return b''
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a simulated ZK attendance terminal")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=4370)
+    parser.add_argument('--users', type=int, default=5000)
+    parser.add_argument('--punches', type=int, default=100000)
+    parser.add_argument('--days', type=int, default=90, help="Spread punches over this many days")
+    parser.add_argument('--fingers', type=int, default=0, help="Fingerprint templates per user")
+    parser.add_argument('--latency-ms', type=float, default=0.0, help="Delay before every reply packet")
+    parser.add_argument('--jitter-ms', type=float, default=0.0, help="Random extra delay per reply packet")
+    parser.add_argument('--loss', type=float, default=0.0, help="Probability of losing a reply packet")
+    parser.add_argument('--no-udp', action='store_true', help="Only serve TCP")
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    device = SimulatedDevice(users=args.users, punches=args.punches, days=args.days,
+                             fingers_per_user=args.fingers, seed=args.seed)
+    simulator = ZKSimulator(device, host=args.host, port=args.port, latency_ms=args.latency_ms,
+                            jitter_ms=args.jitter_ms, loss=args.loss, udp=not args.no_udp, seed=args.seed)
+    simulator.start()
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        simulator.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+"""
+Conditional Responses for ZK Attendance System
+Adds ETag/Last-Modified validators to polled API endpoints and answers
+polls for unchanged data with 304 Not Modified
+"""
+import logging
+import threading
+import time
+from datetime import datetime, timezone
+from flask import request, make_response
+
+# Configure logging
+logger = logging.getLogger('conditional')
+
+# Seconds a validator for device-backed data is trusted without reading the
+# device again, as long as the stored data version has not moved
+REVALIDATE_WINDOW = 30
+
+# Validators remembered at most (one per endpoint, query and device)
+MAX_ENTRIES = 1000
+
+
+class ValidatorCache:
+    """ETags and Last-Modified times of the representations last served
+
+    The ETag is a hash of the response body, so any process serving the same
+    data produces the same validator. For endpoints backed by a device the
+    validator is remembered together with a data version (the attendance
+    store's high-water mark) and the time the body was built: a poll carrying
+    that validator within REVALIDATE_WINDOW, while the version is unchanged,
+    is answered 304 without reading the device. After the window the device
+    is read again and the client still gets a 304 if the body is identical.
+    """
+
+    def __init__(self, window=REVALIDATE_WINDOW):
+        self.window = window
+        self._lock = threading.Lock()
+        # key -> (etag, last_modified, version, built_at)
+        self._entries = {}
+
+    def request_key(self, device_id=None):
+        """Key of the current request: path, query arguments and device"""
+        return (request.path, tuple(sorted(request.args.items(multi=True))), device_id)
+
+    def not_modified(self, key, version=None):
+        """A 304 response when the client holds the current representation, otherwise None
+
+        Only trusts validators built within the revalidation window for the
+        same data version, so the caller can skip rebuilding the body.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None:
+            return None
+        etag, last_modified, entry_version, built_at = entry
+        if entry_version != version or time.monotonic() - built_at > self.window:
+            return None
+
+        # If-None-Match takes precedence over If-Modified-Since
+        if request.if_none_match:
+            matched = request.if_none_match.contains(etag)
+        elif request.if_modified_since:
+            matched = request.if_modified_since >= last_modified
+        else:
+            matched = False
+        if not matched:
+            return None
+
+        response = make_response('', 304)
+        response.set_etag(etag)
+        response.last_modified = last_modified
+        response.cache_control.no_cache = True
+        return response
+
+    def conditional(self, response, key, version=None):
+        """Add validators to a response and turn it into a 304 if the client's copy is current"""
+        response = make_response(response)
+        if response.status_code != 200:
+            return response
+        response.add_etag()
+        etag, _ = response.get_etag()
+        now = datetime.now(timezone.utc).replace(microsecond=0)
+
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            last_modified = entry[1] if entry and entry[0] == etag else now
+            self._entries[key] = (etag, last_modified, version, time.monotonic())
+            while len(self._entries) > MAX_ENTRIES:
+                self._entries.pop(next(iter(self._entries)))
+
+        response.last_modified = last_modified
+        # Clients may keep the body but must revalidate before using it
+        response.cache_control.no_cache = True
+        return response.make_conditional(request)
+
+    def invalidate(self, device_id):
+        """Forget validators of a device after writing to it"""
+        with self._lock:
+            for key in [key for key in self._entries if key[2] == device_id]:
+                del self._entries[key]
+
+# Create a global instance of the validator cache
+validators = ValidatorCache()
@@ -0,0 +1,343 @@
+"""
+Configuration Service for ZK Attendance System
+Keeps the parsed config.json in memory and reloads it only when the file changes
+"""
+import logging
+import copy
+import json
+import os
+import sys
+import shutil
+import tempfile
+import threading
+from metrics import timed, CONFIG_IO_SECONDS
+
+# Configure logging
+logger = logging.getLogger('config_service')
+
+# Define the path to the SAS_attendance folder on D: drive for executable mode
+# or use the current directory for development mode
+def get_config_dir():
+    # Tools such as the benchmarks point the app at a scratch directory
+    if os.environ.get('ZK_CONFIG_DIR'):
+        return os.environ['ZK_CONFIG_DIR']
+    # Check if running as executable (PyInstaller sets this attribute)
+    if getattr(sys, 'frozen', False):
+        # Running as executable - use D:\SAS_attendance\
+        config_dir = os.path.join('D:\\', 'SAS_attendance')
+        # Create the directory if it doesn't exist
+        if not os.path.exists(config_dir):
+            try:
+                os.makedirs(config_dir)
+            except Exception:
+                pass  # Silently handle errors when running as executable
+        return config_dir
+    else:
+        # Running in development mode - use current directory
+        return os.path.dirname(os.path.abspath(__file__))
+
+# Define the exact path to config.json
+CONFIG_PATH = os.path.join(get_config_dir(), 'config.json')
+
+# Maximum delay, in seconds, before volatile metadata such as last_connected
+# is written to disk by a WriteBehindQueue
+WRITE_BEHIND_INTERVAL = 5
+
+# Define all expected fields and their defaults
+DEFAULT_CONFIG = {
+    'registered_devices': {},
+    'active_device': '',
+    'attendance_api_url': '',
+    'employees_api_url': '',
+    'last_successful_send': {
+        'last_send_time': '',
+        'last_send_data': {
+            'count': 0,
+            'summary': ''
+        }
+    },
+    'base_api_url': '',
+    'api_token': '',
+    # Device log clearing (see device_retention): off until enabled; runs
+    # between window_start and window_end (local time, may span midnight)
+    # once a device holds min_records punches since its last clear
+    'retention': {
+        'enabled': False,
+        'window_start': '01:00',
+        'window_end': '05:00',
+        'min_records': 1000
+    }
+}
+
+
+def atomic_write_json(path, data):
+    """Write JSON to path atomically
+
+    The data goes to a temporary file in the same directory which is fsynced
+    once and then renamed over the target, so readers never see a partially
+    written file and no read-back verification is needed.
+    """
+    directory = os.path.dirname(path) or '.'
+    fd, tmp_path = tempfile.mkstemp(prefix='.tmp-', suffix='.json', dir=directory)
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f, indent=4)
+            f.flush()
+            os.fsync(f.fileno())  # Single fsync, before the rename makes it visible
+        os.replace(tmp_path, path)
+    except Exception:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+class WriteBehindQueue:
+    """Coalesces frequent saves of volatile state into periodic writes
+
+    schedule() marks the state dirty and arms a timer; every change made
+    before the timer fires is persisted by a single call to flush_fn, so
+    writes happen at most once per interval. flush() writes immediately
+    and is used on shutdown.
+    """
+
+    def __init__(self, flush_fn, interval=WRITE_BEHIND_INTERVAL):
+        self._flush_fn = flush_fn
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._timer = None
+        self._dirty = False
+
+    def schedule(self):
+        """Mark the state dirty and make sure a flush is pending"""
+        with self._lock:
+            self._dirty = True
+            if self._timer is None:
+                self._timer = threading.Timer(self.interval, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def discard(self):
+        """Forget pending changes because the caller just saved everything"""
+        with self._lock:
+            self._dirty = False
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+
+    def flush(self):
+        """Write pending changes now, returns True if anything was written"""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if not self._dirty:
+                return False
+            self._dirty = False
+        try:
+            self._flush_fn()
+        except Exception as e:
+            logger.error(f"Error flushing write-behind queue: {str(e)}")
+            # Keep the changes so the next schedule() or flush() retries them
+            with self._lock:
+                self._dirty = True
+            return False
+        return True
+
+    @property
+    def pending(self):
+        return self._dirty
+
+
+class ReadOnlyDict(dict):
+    """Dict that rejects mutation, handed out as a shared config snapshot
+
+    Subclassing dict keeps snapshots JSON-serializable by jsonify.
+    """
+
+    def _readonly(self, *args, **kwargs):
+        raise TypeError("Config snapshots are read-only, use update_config() to change settings")
+
+    __setitem__ = _readonly
+    __delitem__ = _readonly
+    clear = _readonly
+    pop = _readonly
+    popitem = _readonly
+    setdefault = _readonly
+    update = _readonly
+
+    def __copy__(self):
+        return _thaw(self)
+
+    def __deepcopy__(self, memo):
+        return _thaw(self)
+
+    def copy(self):
+        """Return a mutable deep copy"""
+        return _thaw(self)
+
+
+def _freeze(value):
+    """Recursively convert dicts to ReadOnlyDict and lists to tuples"""
+    if isinstance(value, dict):
+        return ReadOnlyDict((k, _freeze(v)) for k, v in value.items())
+    if isinstance(value, list):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+
+def _thaw(value):
+    """Recursively convert a frozen snapshot back to plain dicts and lists"""
+    if isinstance(value, dict):
+        return {k: _thaw(v) for k, v in value.items()}
+    if isinstance(value, tuple):
+        return [_thaw(v) for v in value]
+    return value
+
+
+class ConfigService:
+    """Caches config.json in memory, invalidated by file mtime and size"""
+
+    def __init__(self, config_path=CONFIG_PATH):
+        self.config_path = config_path
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._stamp = None
+
+    def _file_stamp(self):
+        """Identify the current file version by (mtime_ns, size), None if missing"""
+        try:
+            st = os.stat(self.config_path)
+            return (st.st_mtime_ns, st.st_size)
+        except OSError:
+            return None
+
+    def _load(self):
+        """Read config.json and merge it with the defaults
+
+        Returns the merged config and whether a migration save is needed.
+        """
+        # Only log in development mode
+        if not getattr(sys, 'frozen', False):
+            logger.info(f"Loading config from: {self.config_path}")
+
+        config = copy.deepcopy(DEFAULT_CONFIG)
+        loaded = {}
+        if os.path.exists(self.config_path):
+            try:
+                with timed(CONFIG_IO_SECONDS, operation='load'):
+                    with open(self.config_path, 'r') as f:
+                        loaded = json.load(f)
+                # Merge loaded config with defaults
+                for k in DEFAULT_CONFIG:
+                    if k in loaded:
+                        config[k] = loaded[k]
+            except json.JSONDecodeError as e:
+                logger.error(f"JSON decode error loading config: {str(e)}")
+                # Keep a backup of the corrupted file before the migration save replaces it
+                try:
+                    shutil.copyfile(self.config_path, f"{self.config_path}.bak")
+                    logger.info(f"Created backup of corrupted config file: {self.config_path}.bak")
+                except Exception as e2:
+                    logger.error(f"Failed to back up corrupted config file: {str(e2)}")
+                loaded = {}
+            except Exception as e:
+                logger.error(f"Error loading config: {str(e)}")
+                loaded = {}
+        needs_migration = not os.path.exists(self.config_path) or any(k not in loaded for k in DEFAULT_CONFIG)
+        return config, needs_migration
+
+    def snapshot(self):
+        """Return the current config as a read-only snapshot
+
+        The file is only re-read and re-parsed when its mtime or size
+        changed since the last load, so repeated calls cost one stat().
+        """
+        stamp = self._file_stamp()
+        snapshot = self._snapshot
+        if snapshot is not None and stamp == self._stamp:
+            return snapshot
+
+        with self._lock:
+            # Another thread may have reloaded while we waited
+            stamp = self._file_stamp()
+            if self._snapshot is not None and stamp == self._stamp:
+                return self._snapshot
+
+            config, needs_migration = self._load()
+            if needs_migration:
+                # Save config if missing any keys (migration)
+                self._write(config)
+            else:
+                self._snapshot = _freeze(config)
+                self._stamp = stamp
+            return self._snapshot
+
+    def get(self):
+        """Return a mutable copy of the current config"""
+        return _thaw(self.snapshot())
+
+    def save(self, config):
+        """Save configuration, keeping only the expected fields
+
+        When running as executable, always save all expected fields, including new ones.
+        """
+        with self._lock:
+            self._write(config)
+
+    def update(self, changes):
+        """Apply top-level changes to the current config and save it"""
+        return self.modify(lambda config: config.update(changes))
+
+    def modify(self, fn):
+        """Call fn(config) on a mutable copy of the config on disk and save the result
+
+        The copy is re-read under the lock if the file changed, so fn can
+        merge its changes into what other processes saved in the meantime.
+        """
+        with self._lock:
+            config = _thaw(self._snapshot) if self._snapshot is not None else None
+            if config is None or self._file_stamp() != self._stamp:
+                config, _ = self._load()
+            fn(config)
+            self._write(config)
+            return self._snapshot
+
+    def _write(self, config):
+        """Write config to disk and refresh the cache (caller holds the lock)"""
+        # Only log in development mode
+        if not getattr(sys, 'frozen', False):
+            logger.info(f"Saving config to: {self.config_path}")
+
+        # Always include all fields
+        config_to_save = copy.deepcopy(DEFAULT_CONFIG)
+        for k in DEFAULT_CONFIG:
+            if k in config:
+                config_to_save[k] = _thaw(config[k])
+        try:
+            with timed(CONFIG_IO_SECONDS, operation='save'):
+                atomic_write_json(self.config_path, config_to_save)
+            if not getattr(sys, 'frozen', False):
+                logger.info(f"Config saved successfully to {self.config_path}")
+        except Exception as e:
+            if not getattr(sys, 'frozen', False):
+                logger.error(f"Error saving config file: {str(e)}")
+            # Don't raise exception in executable mode
+            if not getattr(sys, 'frozen', False):
+                raise
+            # Keep serving the in-memory config even if the disk write failed
+            self._snapshot = _freeze(config_to_save)
+            return
+
+        self._snapshot = _freeze(config_to_save)
+        self._stamp = self._file_stamp()
+
+    def invalidate(self):
+        """Drop the cached config so the next read goes to disk"""
+        with self._lock:
+            self._snapshot = None
+            self._stamp = None
+
+# Create a global instance of the config service
+config_service = ConfigService()
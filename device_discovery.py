@@ -0,0 +1,173 @@
+"""
+Device Discovery for ZK Attendance System
+Scans a network range for ZK terminals in parallel, identifies them and
+suggests how to register the ones that are not registered yet
+"""
+import ipaddress
+import logging
+import re
+import socket
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from zk import ZK
+from zk.exception import ZKErrorResponse
+from device_manager import device_manager, DEFAULT_PORT, DEFAULT_TIMEOUT
+from health_monitor import health_monitor
+from jobs import report_progress
+
+# Configure logging
+logger = logging.getLogger('device_discovery')
+
+# Largest range scanned in one request (a /22)
+MAX_HOSTS = 1024
+
+# Hosts probed at the same time with a plain TCP connect, and the seconds
+# each connect may take; a closed or empty address costs at most this long
+MAX_PARALLEL_PROBES = 64
+PROBE_TIMEOUT = 1.0
+
+# ZK sessions opened at the same time to identify open ports, and their timeout
+MAX_PARALLEL_SESSIONS = 8
+SESSION_TIMEOUT = 5
+
+
+class DeviceDiscovery:
+    """Parallel scanner for ZK terminals on a subnet
+
+    A scan first tries a TCP connect to the ZK port of every address in the
+    range, MAX_PARALLEL_PROBES at a time, so a /22 finishes in about
+    1024 / 64 * PROBE_TIMEOUT seconds instead of minutes. Addresses with the
+    port open get a ZK session (at most MAX_PARALLEL_SESSIONS at once) that
+    reads serial number, firmware, platform, name and MAC; a terminal that
+    answers but requires a communication key is reported as locked.
+    Registered devices are not opened again: their cached health metadata
+    is reported instead, so the scan never competes with their device lane.
+    """
+
+    def parse_range(self, cidr):
+        """Host addresses of a CIDR range (or a single address), raising ValueError when too large"""
+        network = ipaddress.ip_network(str(cidr).strip(), strict=False)
+        if network.version != 4:
+            raise ValueError("Only IPv4 ranges can be scanned")
+        if network.num_addresses > MAX_HOSTS + 2:
+            raise ValueError(f"Range {network} has {network.num_addresses} addresses, at most {MAX_HOSTS} can be scanned")
+        hosts = list(network.hosts()) or [network.network_address]
+        return network, [str(host) for host in hosts]
+
+    def _port_open(self, ip, port, timeout):
+        start = time.perf_counter()
+        try:
+            sock = socket.create_connection((ip, port), timeout=timeout)
+            sock.close()
+            return round((time.perf_counter() - start) * 1000, 1)
+        except OSError:
+            return None
+
+    def _fingerprint(self, ip, port, timeout):
+        """Identify a ZK terminal with a short session; zk is False if the port is something else"""
+        info = {'zk': False, 'locked': False}
+        conn = None
+        try:
+            conn = ZK(ip, port=port, timeout=timeout, ommit_ping=True).connect()
+            info.update({
+                'zk': True,
+                'serial_number': conn.get_serialnumber(),
+                'firmware_version': conn.get_firmware_version(),
+                'platform': conn.get_platform(),
+                'device_name': conn.get_device_name(),
+                'mac': conn.get_mac()
+            })
+        except ZKErrorResponse as e:
+            # It speaks the ZK protocol but rejected the session (communication key)
+            info.update(zk=True, locked=True, error=str(e))
+        except Exception as e:
+            info['error'] = str(e) or e.__class__.__name__
+        finally:
+            if conn is not None:
+                try:
+                    conn.disconnect()
+                except Exception:
+                    pass
+        return info
+
+    def _registered(self):
+        """(ip, port) -> device_id of every registered device"""
+        return {(device['ip'], int(device['port'])): device_id
+                for device_id, device in device_manager.get_all_devices().items()}
+
+    def _suggest(self, result, taken):
+        """Registration body for POST /api/devices with an unused device id"""
+        serial = result.get('serial_number')
+        base = re.sub(r'[^A-Za-z0-9_-]', '', serial) if serial else ''
+        base = base or f"zk-{result['ip'].replace('.', '-')}"
+        device_id = base
+        suffix = 2
+        while device_id in taken:
+            device_id = f"{base}-{suffix}"
+            suffix += 1
+        taken.add(device_id)
+        name = result.get('device_name') or (f"ZK {serial}" if serial else f"ZK {result['ip']}")
+        return {"device_id": device_id, "name": name, "ip": result['ip'], "port": result['port'],
+                "timeout": DEFAULT_TIMEOUT}
+
+    def scan(self, cidr, port=DEFAULT_PORT, probe_timeout=PROBE_TIMEOUT, session_timeout=SESSION_TIMEOUT):
+        """Scan a range and return the responders, ZK terminals first"""
+        network, hosts = self.parse_range(cidr)
+        port = int(port)
+        started = time.perf_counter()
+        registered = self._registered()
+        logger.info(f"Scanning {len(hosts)} addresses in {network} on port {port}")
+
+        open_hosts = {}
+        with ThreadPoolExecutor(max_workers=min(MAX_PARALLEL_PROBES, len(hosts))) as pool:
+            futures = {pool.submit(self._port_open, ip, port, probe_timeout): ip for ip in hosts}
+            for done, future in enumerate(as_completed(futures), 1):
+                latency = future.result()
+                if latency is not None:
+                    open_hosts[futures[future]] = latency
+                if done % 64 == 0 or done == len(hosts):
+                    report_progress(0.8 * done / len(hosts), f"Probed {done}/{len(hosts)} addresses, {len(open_hosts)} open")
+
+        results = []
+        unregistered = []
+        for ip, latency in open_hosts.items():
+            result = {'ip': ip, 'port': port, 'latency_ms': latency}
+            device_id = registered.get((ip, port))
+            if device_id is not None:
+                health = health_monitor.get(device_id) or {}
+                result.update({key: health.get(key) for key in
+                               ('serial_number', 'firmware_version', 'platform', 'device_name', 'mac')})
+                result.update(zk=True, locked=False, registered_as=device_id)
+            else:
+                unregistered.append(result)
+            results.append(result)
+
+        if unregistered:
+            report_progress(0.8, f"Identifying {len(unregistered)} responders")
+            with ThreadPoolExecutor(max_workers=min(MAX_PARALLEL_SESSIONS, len(unregistered))) as pool:
+                for result, info in zip(unregistered, pool.map(
+                        lambda result: self._fingerprint(result['ip'], port, session_timeout), unregistered)):
+                    result.update(info)
+                    result['registered_as'] = None
+
+        taken = set(device_manager.get_all_devices())
+        for result in sorted(unregistered, key=lambda result: ipaddress.ip_address(result['ip'])):
+            if result['zk']:
+                result['suggested'] = self._suggest(result, taken)
+
+        results.sort(key=lambda result: (not result['zk'], ipaddress.ip_address(result['ip'])))
+        elapsed = round(time.perf_counter() - started, 2)
+        terminals = sum(1 for result in results if result['zk'])
+        logger.info(f"Scan of {network} found {terminals} ZK terminals ({len(open_hosts)} open ports) in {elapsed}s")
+        return {
+            "network": str(network),
+            "port": port,
+            "scanned": len(hosts),
+            "open": len(open_hosts),
+            "terminals": terminals,
+            "elapsed_s": elapsed,
+            "devices": results
+        }
+
+# Create a global instance of the device discovery scanner
+device_discovery = DeviceDiscovery()
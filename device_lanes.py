@@ -0,0 +1,105 @@
+"""
+Device Lanes for ZK Attendance System
+Serializes commands per device and coalesces identical in-flight reads
+"""
+import logging
+import threading
+
+# Configure logging
+logger = logging.getLogger('device_lanes')
+
+# How long, in seconds, a request waits for a busy device before giving up
+LANE_TIMEOUT = 120
+
+
+class DeviceBusyError(Exception):
+    """Raised when a device lane cannot be acquired in time"""
+    pass
+
+
+class DeviceLanes:
+    """One lock per device so only one session talks to a terminal at a time
+
+    ZK terminals handle concurrent sessions badly, so every command for a
+    device runs inside that device's lane. Different devices still run in
+    parallel. The locks are re-entrant so a thread already holding a lane
+    can call helpers that also acquire it.
+    """
+
+    def __init__(self, timeout=LANE_TIMEOUT):
+        self.timeout = timeout
+        self._guard = threading.Lock()
+        self._locks = {}
+
+    def _lock_for(self, device_id):
+        with self._guard:
+            lock = self._locks.get(device_id)
+            if lock is None:
+                lock = threading.RLock()
+                self._locks[device_id] = lock
+            return lock
+
+    def acquire(self, device_id):
+        """Enter the lane for a device, raising DeviceBusyError on timeout"""
+        lock = self._lock_for(device_id)
+        if not lock.acquire(timeout=self.timeout):
+            raise DeviceBusyError(f"Device {device_id} is busy, try again later")
+        return lock
+
+    def release(self, device_id):
+        """Leave the lane for a device"""
+        self._lock_for(device_id).release()
+
+
+class _Call:
+    """A read in progress whose result is shared by all waiting callers"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Coalesces concurrent calls with the same key into one execution
+
+    The first caller for a key runs the function; callers arriving while it
+    is still running wait and receive the same result (or exception).
+    Results are not cached once the call completes.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                call.waiters += 1
+                leader = False
+            else:
+                call = _Call()
+                self._calls[key] = call
+                leader = True
+
+        if not leader:
+            logger.info(f"Joining in-flight read {key}")
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+            if call.waiters:
+                logger.info(f"Shared read {key} with {call.waiters} concurrent callers")
+        return call.result
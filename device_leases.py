@@ -0,0 +1,271 @@
+"""
+Device Leases for ZK Attendance System
+Splits device ownership between several worker instances through leases
+in a shared SQLite database, renewed by heartbeat and taken over when an
+instance stops renewing them
+"""
+import logging
+import math
+import os
+import socket
+import sqlite3
+import threading
+import time
+import zlib
+from device_manager import device_manager, APP_CONFIG_DIR
+
+# Configure logging
+logger = logging.getLogger('device_leases')
+
+# Define the path to the lease database, shared by every instance
+LEASES_PATH = os.path.join(APP_CONFIG_DIR, 'leases.db')
+
+# Seconds a lease stays valid without renewal; another instance takes the
+# device over once it has expired
+LEASE_TTL = 30
+
+# Seconds between heartbeats (renewal, rebalancing and takeover)
+HEARTBEAT_INTERVAL = 10
+
+# Seconds an instance waits for another one holding the database lock
+BUSY_TIMEOUT = 5
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS instances (
+    instance_id TEXT PRIMARY KEY,
+    started_at REAL NOT NULL,
+    heartbeat_at REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS leases (
+    device_id TEXT PRIMARY KEY,
+    owner TEXT NOT NULL,
+    epoch INTEGER NOT NULL DEFAULT 1,
+    acquired_at REAL NOT NULL,
+    expires_at REAL NOT NULL
+);
+"""
+
+
+def default_instance_id():
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+def _spread(device_id):
+    """Stable order used to choose which devices to give up or claim first"""
+    return zlib.crc32(device_id.encode())
+
+
+class DeviceLeases:
+    """Time-limited device ownership shared between worker instances
+
+    Every HEARTBEAT_INTERVAL an instance, in one write transaction: records
+    its heartbeat, renews the leases it holds, gives up leases above its
+    fair share (devices divided by live instances, rounded up) and claims
+    free or expired leases up to that share. A new instance therefore gets
+    devices as soon as the others shed their excess, and the devices of an
+    instance that died are claimed by the survivors after LEASE_TTL.
+
+    An instance only treats a device as its own while its last successful
+    heartbeat is recent enough that the lease cannot have expired, so one
+    that loses the database stops polling before anyone else can take over.
+    Each change of owner increments the lease epoch.
+
+    Without start() (a single instance) every device is owned locally.
+    """
+
+    def __init__(self, path=LEASES_PATH, ttl=LEASE_TTL, interval=HEARTBEAT_INTERVAL):
+        self.path = path
+        self.ttl = ttl
+        self.interval = interval
+        self.instance_id = None
+        self._lock = threading.Lock()
+        self._owned = set()
+        self._valid_until = 0
+        self._listeners = []
+        self._thread = None
+        self._stop = threading.Event()
+
+    @property
+    def enabled(self):
+        return self.instance_id is not None
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.executescript(SCHEMA)
+        return conn
+
+    def add_listener(self, listener):
+        """Call listener(acquired, lost) with sets of device ids whenever ownership changes"""
+        self._listeners.append(listener)
+
+    def _notify(self, acquired, lost):
+        for listener in self._listeners:
+            try:
+                listener(acquired, lost)
+            except Exception as e:
+                logger.error(f"Error in device lease listener: {str(e)}")
+
+    # -- ownership --------------------------------------------------------
+
+    def owns(self, device_id):
+        """Whether this instance may run background work for a device"""
+        if not self.enabled:
+            return True
+        with self._lock:
+            return device_id in self._owned and time.time() < self._valid_until
+
+    def owned(self):
+        """Device ids currently owned by this instance"""
+        if not self.enabled:
+            return set(device_manager.get_all_devices())
+        with self._lock:
+            return set(self._owned) if time.time() < self._valid_until else set()
+
+    def heartbeat(self):
+        """Renew, rebalance and claim leases; returns the owned device ids"""
+        device_manager.reload_if_changed()
+        device_ids = sorted(device_manager.get_all_devices(), key=_spread)
+        conn = self._connect()
+        try:
+            now = time.time()
+            expires = now + self.ttl
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute(
+                'INSERT INTO instances (instance_id, started_at, heartbeat_at) VALUES (?, ?, ?) '
+                'ON CONFLICT (instance_id) DO UPDATE SET heartbeat_at = excluded.heartbeat_at',
+                (self.instance_id, now, now))
+            conn.execute('DELETE FROM instances WHERE heartbeat_at < ?', (now - self.ttl,))
+            live = conn.execute('SELECT COUNT(*) FROM instances').fetchone()[0]
+            share = math.ceil(len(device_ids) / live) if device_ids else 0
+
+            leases = {row[0]: row[1:] for row in conn.execute('SELECT device_id, owner, epoch, expires_at FROM leases')}
+            for device_id in set(leases) - set(device_ids):
+                # Removed device
+                conn.execute('DELETE FROM leases WHERE device_id = ?', (device_id,))
+
+            mine = [device_id for device_id in device_ids
+                    if device_id in leases and leases[device_id][0] == self.instance_id]
+            # Give up the excess from the end of the order, so shares stay stable
+            for device_id in mine[share:]:
+                conn.execute('DELETE FROM leases WHERE device_id = ? AND owner = ?', (device_id, self.instance_id))
+            mine = mine[:share]
+            conn.execute('UPDATE leases SET expires_at = ? WHERE owner = ?', (expires, self.instance_id))
+
+            for device_id in device_ids:
+                if len(mine) >= share:
+                    break
+                lease = leases.get(device_id)
+                if lease is not None and (lease[0] == self.instance_id or lease[2] >= now):
+                    continue
+                epoch = lease[1] + 1 if lease else 1
+                conn.execute(
+                    'INSERT OR REPLACE INTO leases (device_id, owner, epoch, acquired_at, expires_at) '
+                    'VALUES (?, ?, ?, ?, ?)', (device_id, self.instance_id, epoch, now, expires))
+                if lease is not None:
+                    logger.info(f"Took over device {device_id} from {lease[0]} (lease epoch {epoch})")
+                mine.append(device_id)
+            conn.execute('COMMIT')
+        except Exception:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+
+        owned = set(mine)
+        with self._lock:
+            acquired = owned - self._owned
+            lost = self._owned - owned
+            self._owned = owned
+            # Stop short of expiry so work ends before another instance may claim the devices
+            self._valid_until = now + self.ttl - self.interval
+        if acquired or lost:
+            logger.info(f"Instance {self.instance_id} owns {len(owned)} of {len(device_ids)} devices "
+                        f"({live} instances): +{len(acquired)} -{len(lost)}")
+            self._notify(acquired, lost)
+        return owned
+
+    def release(self):
+        """Give up every lease of this instance so others take over at once"""
+        with self._lock:
+            lost = set(self._owned)
+            self._owned = set()
+            self._valid_until = 0
+        conn = self._connect()
+        try:
+            conn.execute('DELETE FROM leases WHERE owner = ?', (self.instance_id,))
+            conn.execute('DELETE FROM instances WHERE instance_id = ?', (self.instance_id,))
+        finally:
+            conn.close()
+        if lost:
+            self._notify(set(), lost)
+
+    # -- background thread ------------------------------------------------
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.heartbeat()
+            except Exception as e:
+                logger.error(f"Device lease heartbeat failed: {str(e)}")
+            self._stop.wait(self.interval)
+        try:
+            self.release()
+        except Exception as e:
+            logger.warning(f"Could not release device leases: {str(e)}")
+
+    def start(self, instance_id=None):
+        """Join the shared lease table and heartbeat in the background (idempotent)"""
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self.instance_id = instance_id or self.instance_id or default_instance_id()
+            self._stop.clear()
+        # Claim a share before background work starts looking for devices
+        try:
+            self.heartbeat()
+        except Exception as e:
+            logger.error(f"Device lease heartbeat failed: {str(e)}")
+        with self._lock:
+            self._thread = threading.Thread(target=self._run, name='device-leases', daemon=True)
+            self._thread.start()
+        logger.info(f"Device sharding enabled as instance {self.instance_id}, "
+                    f"lease {self.ttl}s renewed every {self.interval}s")
+
+    def stop(self, timeout=None):
+        """Stop heartbeating and release this instance's leases"""
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def status(self):
+        """Live instances and every lease in the shared table
+
+        Also readable from processes that do not take part (web processes).
+        """
+        if not os.path.exists(self.path):
+            return {"enabled": self.enabled, "instance_id": self.instance_id, "owned": [],
+                    "instances": [], "leases": []}
+        now = time.time()
+        conn = self._connect()
+        try:
+            instances = [
+                {"instance_id": row[0], "started_at": row[1], "heartbeat_age": round(now - row[2], 1),
+                 "devices": row[3]}
+                for row in conn.execute(
+                    'SELECT i.instance_id, i.started_at, i.heartbeat_at, COUNT(l.device_id) FROM instances i '
+                    'LEFT JOIN leases l ON l.owner = i.instance_id AND l.expires_at >= ? '
+                    'GROUP BY i.instance_id ORDER BY i.started_at', (now,))]
+            leases = [
+                {"device_id": row[0], "owner": row[1], "epoch": row[2], "expires_in": round(row[3] - now, 1)}
+                for row in conn.execute('SELECT device_id, owner, epoch, expires_at FROM leases ORDER BY device_id')]
+        finally:
+            conn.close()
+        return {"enabled": self.enabled, "instance_id": self.instance_id,
+                "owned": sorted(self.owned()) if self.enabled else [],
+                "instances": instances, "leases": leases}
+
+# Create a global instance of the device leases
+device_leases = DeviceLeases()
@@ -7,9 +7,16 @@ import json
 import os
 import sys
 import tempfile
+import threading
+from contextlib import contextmanager
 from zk import ZK
 from flask import session, request, has_request_context
 from datetime import datetime
+from config_service import config_service, get_config_dir, WriteBehindQueue
+from app_logging import queue_logging
+from device_lanes import DeviceLanes, SingleFlight
+from metrics import timed, DEVICE_CONNECT_SECONDS
+from request_timing import span
 
 # Get application data directory
 def get_app_data_directory():
@@ -77,37 +84,20 @@ logger = logging.getLogger('device_manager')
 
 # Set device_manager logger to WARNING level for console output
 # This will reduce console messages while still logging to file
-for handler in logging.getLogger().handlers:
+for handler in logging.getLogger().handlers + queue_logging.handlers:
     if isinstance(handler, logging.StreamHandler) and handler.stream == sys.stdout:
         logger.setLevel(logging.WARNING)
 
-# Define the path to the SAS_attendance folder on D: drive for executable mode
-# or use the current directory for development mode
-def get_config_dir():
-    # Check if running as executable (PyInstaller sets this attribute)
-    if getattr(sys, 'frozen', False):
-        # Disable logging when running as executable
-        for handler in logger.handlers[:]:  # Make a copy of the list to avoid modification during iteration
-            logger.removeHandler(handler)
-            
-        # Running as executable - use D:\SAS_attendance\
-        config_dir = os.path.join('D:\\', 'SAS_attendance')
-        # Create the directory if it doesn't exist
-        if not os.path.exists(config_dir):
-            try:
-                os.makedirs(config_dir)
-            except Exception:
-                pass  # Silently handle errors when running as executable
-        return config_dir
-    else:
-        # Running in development mode - use current directory
-        return os.path.dirname(os.path.abspath(__file__))
-
-# Get the appropriate config directory
+# Get the appropriate config directory (D:\SAS_attendance for the executable)
 APP_CONFIG_DIR = get_config_dir()
 
-# Define the exact path to config.json and devices.json
-CONFIG_PATH = os.path.join(APP_CONFIG_DIR, 'config.json')
+# Disable logging when running as executable
+if getattr(sys, 'frozen', False):
+    for handler in logger.handlers[:]:  # Make a copy of the list to avoid modification during iteration
+        logger.removeHandler(handler)
+
+# config.json is owned by the config service; devices.json is legacy, read-only
+CONFIG_PATH = config_service.config_path
 DEVICES_PATH = os.path.join(APP_CONFIG_DIR, 'devices.json')
 
 # Default device settings
@@ -119,79 +109,114 @@ class DeviceManager:
     """Manages multiple ZK device connections and operations"""
     
     def __init__(self):
-        self.devices = {}
-        self.active_device = None
-        self.load_devices()
+        # Devices are read from config.json on first use, not at import time,
+        # so starting the app does not wait on config parsing and device logs
+        self._devices = None
+        self._active_device = None
+        # Guards self.devices against concurrent request and background threads
+        self._state_lock = threading.RLock()
+        # Volatile metadata (last_connected, session-driven active device) is
+        # persisted lazily so frequent polling doesn't turn into frequent writes
+        self._write_behind = WriteBehindQueue(self.save_devices)
+        # Serialize sessions per device and share identical in-flight reads
+        self._lanes = DeviceLanes()
+        self._single_flight = SingleFlight()
+        self._loaded_config = None
+    
+    def _ensure_loaded(self):
+        if self._devices is None:
+            with self._state_lock:
+                if self._devices is None:
+                    self._devices = {}
+                    self.load_devices()
+    
+    @property
+    def devices(self):
+        self._ensure_loaded()
+        return self._devices
+    
+    @devices.setter
+    def devices(self, value):
+        self._devices = value
+    
+    @property
+    def active_device(self):
+        self._ensure_loaded()
+        return self._active_device
+    
+    @active_device.setter
+    def active_device(self, value):
+        self._active_device = value
     
     def load_devices(self):
         """Load saved devices from main config file"""
-        # Use the global CONFIG_PATH
-        config_file = CONFIG_PATH
-        
         # Only log in development mode
         if not getattr(sys, 'frozen', False):
-            logger.info(f"Loading devices from config file: {config_file}")
+            logger.info(f"Loading devices from config file: {CONFIG_PATH}")
         
-        if os.path.exists(config_file) and os.path.getsize(config_file) > 0:
-            try:
-                with open(config_file, 'r') as f:
-                    file_content = f.read().strip()
-                    if not file_content:  # Check if file is empty after stripping whitespace
-                        logger.warning(f"Config file exists but is empty: {config_file}")
-                        self._load_from_legacy_file()
-                        return
-                        
-                    # Reset file pointer to beginning
-                    f.seek(0)
-                    config = json.load(f)
-                    # Load registered devices
-                    if 'registered_devices' in config and isinstance(config['registered_devices'], dict):
-                        self.devices = config['registered_devices']
-                        logger.info(f"Loaded {len(self.devices)} devices from main config")
-                        
-                        # Log the loaded devices for debugging
-                        for device_id, device in self.devices.items():
-                            logger.info(f"Loaded device: ID={device_id}, Name={device.get('name')}, IP={device.get('ip')}")
-                        
-                        # Load active device if it exists
-                        if 'active_device' in config and config['active_device'] in self.devices:
-                            self.active_device = config['active_device']
-                            logger.info(f"Loaded active device {self.active_device} from config")
-                    else:
-                        logger.warning("No registered_devices found in config.json or invalid format")
-                        # Try to load from old devices.json for backward compatibility
-                        self._load_from_legacy_file()
-            except json.JSONDecodeError as e:
-                logger.error(f"JSON decode error loading devices from config: {str(e)}")
-                # Try to create a valid config file
-                try:
-                    # Create a backup of the corrupted file
-                    backup_file = f"{config_file}.bak"
-                    if os.path.exists(config_file):
-                        with open(config_file, 'r') as src, open(backup_file, 'w') as dst:
-                            dst.write(src.read())
-                        logger.info(f"Created backup of corrupted config file: {backup_file}")
-                    
-                    # Create a new valid config file
-                    with open(config_file, 'w') as f:
-                        json.dump({'registered_devices': {}}, f, indent=4)
-                    logger.info(f"Created new empty config file after JSON decode error")
-                except Exception as e2:
-                    logger.error(f"Failed to create new config file: {str(e2)}")
-                
-                # Try to load from old devices.json for backward compatibility
-                self._load_from_legacy_file()
-            except Exception as e:
-                logger.error(f"Error loading devices from config: {str(e)}")
-                # Try to load from old devices.json for backward compatibility
-                self._load_from_legacy_file()
+        try:
+            config = config_service.snapshot()
+        except Exception as e:
+            logger.error(f"Error loading devices from config: {str(e)}")
+            # Try to load from old devices.json for backward compatibility
+            self._load_from_legacy_file()
+            return
+        
+        self._loaded_config = config
+        
+        # Load registered devices (as a mutable copy of the read-only snapshot)
+        registered_devices = config.get('registered_devices')
+        if registered_devices:
+            self.devices = registered_devices.copy()
+            logger.info(f"Loaded {len(self.devices)} devices from main config")
+            
+            # Log the loaded devices for debugging
+            for device_id, device in self.devices.items():
+                logger.debug(f"Loaded device: ID={device_id}, Name={device.get('name')}, IP={device.get('ip')}")
+            
+            # Load active device if it exists
+            if config.get('active_device') in self.devices:
+                self.active_device = config['active_device']
+                logger.info(f"Loaded active device {self.active_device} from config")
         else:
-            logger.warning(f"Config file not found at {config_file}, trying legacy devices.json")
+            logger.warning("No registered_devices found in config.json, trying legacy devices.json")
             # Try to load from old devices.json for backward compatibility
             self._load_from_legacy_file()
             
+    def reload_if_changed(self):
+        """Pick up devices saved by another process since they were loaded
+        
+        Costs one stat() of config.json when nothing changed. Devices known
+        here keep their newer last_connected, which may still be waiting in
+        the write-behind queue.
+        """
+        self._ensure_loaded()
+        config = config_service.snapshot()
+        if config is self._loaded_config:
+            return False
+        
+        registered_devices = config.get('registered_devices') or {}
+        with self._state_lock:
+            self._loaded_config = config
+            devices = {device_id: dict(device) for device_id, device in registered_devices.items()}
+            if devices == self.devices:
+                return False
+            for device_id, device in devices.items():
+                local = self.devices.get(device_id)
+                if local and (local.get('last_connected') or '') > (device.get('last_connected') or ''):
+                    device['last_connected'] = local['last_connected']
+            self.devices = devices
+            if config.get('active_device') in self.devices:
+                self.active_device = config['active_device']
+        logger.info(f"Reloaded {len(self.devices)} devices changed by another process")
+        return True
+    
     def _load_from_legacy_file(self):
-        """Load devices from legacy devices.json file for backward compatibility"""
+        """Load devices from legacy devices.json file for backward compatibility
+        
+        devices.json is only read to migrate old installs; config.json is the
+        single source of truth and the only file written.
+        """
         # Use the global DEVICES_PATH
         devices_file = DEVICES_PATH
         
@@ -205,111 +230,107 @@ class DeviceManager:
                     self.devices = json.load(f)
                 if not getattr(sys, 'frozen', False):
                     logger.info(f"Loaded {len(self.devices)} devices from legacy devices.json")
+                if self.devices:
+                    # Migrate into config.json so the legacy file is no longer needed
+                    self.save_devices()
             except Exception as e:
                 if not getattr(sys, 'frozen', False):
                     logger.error(f"Error loading devices from legacy file: {str(e)}")
                 self.devices = {}
     
+    def _merge_changes(self, config):
+        """Apply what changed here since the config was loaded onto a fresh config
+        
+        Devices added or removed here are added or removed, and only the
+        fields changed here are written into the other devices, so devices
+        and settings saved meanwhile by another process are kept.
+        """
+        loaded = self._loaded_config or {}
+        base_devices = loaded.get('registered_devices') or {}
+        devices = config.get('registered_devices') or {}
+        for device_id in base_devices:
+            if device_id not in self.devices:
+                devices.pop(device_id, None)
+        for device_id, device in self.devices.items():
+            base = base_devices.get(device_id)
+            if base is None:
+                devices[device_id] = dict(device)
+                continue
+            if device_id not in devices:
+                # Removed by another process
+                continue
+            for field, value in device.items():
+                if base.get(field) != value:
+                    devices[device_id][field] = value
+        config['registered_devices'] = devices
+        if self.active_device and self.active_device != loaded.get('active_device'):
+            config['active_device'] = self.active_device
+    
     def save_devices(self):
-        """Save devices to main config file"""
-        # Use the global CONFIG_PATH
-        config_file = CONFIG_PATH
+        """Save device changes to main config file
         
+        Performs a single atomic write of config.json (temp file + rename),
+        merging this process's changes into the config currently on disk
+        (see _merge_changes); afterwards the devices here match the file.
+        """
         # Only log in development mode
         if not getattr(sys, 'frozen', False):
-            logger.info(f"Saving devices to config file: {config_file}")
+            logger.info(f"Saving devices to config file: {CONFIG_PATH}")
         
-        try:
-            # Load current config
-            if os.path.exists(config_file):
-                with open(config_file, 'r') as f:
-                    config = json.load(f)
-            else:
-                config = {}
-                
-            # Update registered_devices in config
-            config['registered_devices'] = self.devices
-            
-            # Save active device to config
-            if self.active_device:
-                config['active_device'] = self.active_device
-                if not getattr(sys, 'frozen', False):
-                    logger.info(f"Saving active device {self.active_device} to config")
-            
-            # Ensure the file is properly closed and flushed to disk
-            with open(config_file, 'w') as f:
-                json.dump(config, f, indent=4)
-                f.flush()
-                os.fsync(f.fileno())  # Force write to disk
-                
-            logger.info(f"Saved {len(self.devices)} devices to main config at {config_file}")
-            
-            # Also save to legacy file for backward compatibility
-            self._save_to_legacy_file()
-            
-            # Verify the save was successful by reading back the file
+        # Loading reads the config, which must not happen under the config lock
+        self._ensure_loaded()
+        with self._state_lock:
+            # Everything pending in the write-behind queue is part of this save
+            self._write_behind.discard()
             try:
-                # Make sure the file exists and has content before trying to load it
-                if os.path.exists(config_file) and os.path.getsize(config_file) > 0:
-                    with open(config_file, 'r') as f:
-                        saved_config = json.load(f)
-                        if 'registered_devices' in saved_config and saved_config['registered_devices'] == self.devices:
-                            logger.info("Device save verification successful")
-                        else:
-                            logger.warning("Device save verification failed - data mismatch")
-                else:
-                    logger.warning(f"Device save verification failed: File is empty or does not exist")
+                config = config_service.modify(self._merge_changes)
             except Exception as e:
-                logger.warning(f"Device save verification failed: {str(e)}")
-                # If verification fails, try to recreate the file with the current data
-                try:
-                    with open(config_file, 'w') as f:
-                        json.dump({'registered_devices': self.devices}, f, indent=4)
-                        f.flush()
-                        os.fsync(f.fileno())
-                    logger.info("Recreated config file after verification failure")
-                except Exception as e2:
-                    logger.error(f"Failed to recreate config file: {str(e2)}")
-        
-        except Exception as e:
-            logger.error(f"Error saving devices to main config: {str(e)}")
-            # Try saving to legacy file as fallback
-            self._save_to_legacy_file()
+                logger.error(f"Error saving devices to main config: {str(e)}")
+                # The changes are still here; queue them so the write is retried
+                self._write_behind.schedule()
+                return
+            self._loaded_config = config
+            self.devices = {device_id: dict(device) for device_id, device
+                            in (config.get('registered_devices') or {}).items()}
+            if config.get('active_device') in self.devices:
+                self.active_device = config['active_device']
+        logger.info(f"Saved {len(self.devices)} devices to main config at {CONFIG_PATH}")
     
-    def _save_to_legacy_file(self):
-        """Save devices to legacy devices.json file for backward compatibility"""
-        # Use the global DEVICES_PATH
-        devices_file = DEVICES_PATH
-        logger.info(f"Saving devices to legacy file: {devices_file}")
-        
-        try:
-            with open(devices_file, 'w') as f:
-                json.dump(self.devices, f, indent=4)
-                f.flush()
-                os.fsync(f.fileno())  # Force write to disk
-            logger.info(f"Saved {len(self.devices)} devices to legacy devices.json at {devices_file}")
-        except Exception as e:
-            logger.error(f"Error saving devices to legacy file: {str(e)}")
+    def schedule_save(self):
+        """Queue a debounced save of volatile device metadata"""
+        self._write_behind.schedule()
     
-    def add_device(self, device_id, name, ip, port=DEFAULT_PORT, timeout=DEFAULT_TIMEOUT):
-        """Add a new device to the manager"""
+    def flush_pending_writes(self):
+        """Write any queued device metadata to disk immediately"""
+        if self._write_behind.flush():
+            logger.info("Flushed pending device metadata to config")
+    
+    def add_device(self, device_id, name, ip, port=DEFAULT_PORT, timeout=DEFAULT_TIMEOUT, ommit_ping=False):
+        """Add a new device to the manager
+
+        ommit_ping skips pyzk's ICMP reachability check before connecting,
+        for networks that block ping or hosts without a ping binary.
+        """
         if device_id in self.devices:
             logger.warning(f"Device ID {device_id} already exists, updating")
         
-        self.devices[device_id] = {
-            'name': name,
-            'ip': ip,
-            'port': int(port),
-            'timeout': int(timeout),
-            'last_connected': None
-        }
+        with self._state_lock:
+            self.devices[device_id] = {
+                'name': name,
+                'ip': ip,
+                'port': int(port),
+                'timeout': int(timeout),
+                'ommit_ping': bool(ommit_ping),
+                'last_connected': None
+            }
         self.save_devices()
         return device_id
     
     def remove_device(self, device_id):
         """Remove a device from the manager"""
         if device_id in self.devices:
-            del self.devices[device_id]
+            with self._state_lock:
+                self.devices.pop(device_id, None)
             self.save_devices()
             logger.info(f"Removed device {device_id}")
             return True
@@ -323,20 +344,23 @@ class DeviceManager:
         """Get all registered devices"""
         return self.devices
     
-    def set_active_device(self, device_id):
-        """Set the active device for the current session and save to config"""
+    def set_active_device(self, device_id, save=True):
+        """Set the active device for the current session and save to config
+        
+        The config is only written when the active device actually changes.
+        Pass save=False when the caller persists the change itself.
+        """
         if device_id in self.devices:
+            changed = self.active_device != device_id
             self.active_device = device_id
             if has_request_context():
                 session['active_device'] = device_id
-            logger.info(f"Set active device to {device_id}")
             
-            # Save the active device to config immediately
-            try:
-                self.save_devices()
-                logger.info(f"Saved active device {device_id} to config")
-            except Exception as e:
-                logger.error(f"Error saving active device to config: {str(e)}")
+            if changed:
+                logger.info(f"Set active device to {device_id}")
+                if save:
+                    self.save_devices()
+                    logger.info(f"Saved active device {device_id} to config")
                 
             return True
         return False
@@ -349,8 +373,10 @@ class DeviceManager:
             device_id = request.headers.get('X-Device-ID') or session.get('active_device')
             if device_id and device_id in self.devices:
                 # If found in session, make sure it's also saved to config
+                # (debounced, sessions may disagree on every request)
                 if self.active_device != device_id:
-                    self.set_active_device(device_id)
+                    self.set_active_device(device_id, save=False)
+                    self.schedule_save()
                 return device_id
         
         # If not in session, use the active device from config
@@ -367,16 +393,74 @@ class DeviceManager:
             
         # Otherwise, use the first device and set it as active
         first_device = next(iter(self.devices))
-        self.set_active_device(first_device)
+        self.set_active_device(first_device, save=False)
+        self.schedule_save()
         return first_device
     
-    def connect_to_device(self, device_id=None):
-        """Connect to a specific device or the active device"""
-        # If no device_id specified, use active device
+    def resolve_device_id(self, device_id=None):
+        """Return device_id, or the active device if none was given"""
         if not device_id:
             device_id = self.get_active_device_id()
             if not device_id:
                 raise ValueError("No active device set and no device ID provided")
+        return device_id
+    
+    @contextmanager
+    def device_session(self, device_id=None, set_active=True):
+        """Connect to a device inside its lane and disconnect afterwards
+        
+        Only one session per device is open at a time; other callers for the
+        same device wait for the lane (see device_lanes.LANE_TIMEOUT).
+        Background work passes set_active=False (see connect_to_device).
+        """
+        device_id = self.resolve_device_id(device_id)
+        with span('device_wait'):
+            self._lanes.acquire(device_id)
+        try:
+            conn = self.connect_to_device(device_id, set_active=set_active)
+            try:
+                yield conn
+            finally:
+                try:
+                    conn.disconnect()
+                    logger.info(f"Disconnected from device {device_id}")
+                except Exception as e:
+                    logger.warning(f"Error disconnecting from device {device_id}: {str(e)}")
+        finally:
+            self._lanes.release(device_id)
+    
+    def read_shared(self, key, fn, device_id=None, set_active=True, after=None):
+        """Run fn(conn) in a device session, sharing the result with concurrent callers
+        
+        Callers that ask for the same key on the same device while a read is in
+        flight wait for it and receive the same result instead of starting
+        another download. The result must be treated as read-only. after, if
+        given, is called with the result once per actual read (not once per
+        caller), after the session is closed.
+        """
+        device_id = self.resolve_device_id(device_id)
+        
+        def run():
+            with self.device_session(device_id, set_active=set_active) as conn:
+                result = fn(conn)
+            if after is not None:
+                after(result)
+            return result
+        
+        return self._single_flight.do((device_id, key), run)
+    
+    def connect_to_device(self, device_id=None, set_active=True):
+        """Connect to a specific device or the active device
+        
+        Returns a raw connection outside the device lane; prefer
+        device_session() so commands to the device are serialized.
+        With set_active=False (background polling, probes) the device only
+        gets its last_connected stamp in memory: the active device is left
+        alone and no config save is queued, the stamp is written with the
+        next save of this process.
+        """
+        # If no device_id specified, use active device
+        device_id = self.resolve_device_id(device_id)
         
         # Get device details
         device = self.devices.get(device_id)
@@ -387,20 +471,24 @@ class DeviceManager:
         ip = device['ip']
         port = device['port']
         timeout = device['timeout']
+        ommit_ping = device.get('ommit_ping', False)
+        force_udp = device.get('force_udp', False)
         
         logger.info(f"Connecting to device {device_id} at {ip}:{port}")
-        zk = ZK(ip, port=port, timeout=timeout)
-        conn = zk.connect()
-        
-        if not conn:
-            raise ConnectionError(f"Failed to connect to device {device_id} at {ip}:{port}")
-        
-        # Update last connected timestamp
-        self.devices[device_id]['last_connected'] = datetime.now().isoformat()
-        self.save_devices()
+        with timed(DEVICE_CONNECT_SECONDS, device=device_id):
+            zk = ZK(ip, port=port, timeout=timeout, ommit_ping=ommit_ping, force_udp=force_udp)
+            conn = zk.connect()
+            
+            if not conn:
+                raise ConnectionError(f"Failed to connect to device {device_id} at {ip}:{port}")
         
-        # Set as active device
-        self.set_active_device(device_id)
+        # Update last connected timestamp and set as active device; both are
+        # volatile metadata, so they go through the write-behind queue
+        with self._state_lock:
+            self.devices[device_id]['last_connected'] = datetime.now().isoformat()
+        if set_active:
+            self.set_active_device(device_id, save=False)
+            self.schedule_save()
         
         return conn
     
@@ -418,8 +506,8 @@ class DeviceManager:
     def test_connection(self, device_id):
         """Test connection to a device"""
         try:
-            conn = self.connect_to_device(device_id)
-            conn.disconnect()
+            with self.device_session(device_id):
+                pass
             return True
         except Exception as e:
             logger.error(f"Connection test failed for device {device_id}: {str(e)}")
@@ -0,0 +1,152 @@
+"""
+Device Log Retention for ZK Attendance System
+Clears a device's attendance log once every punch on it is stored locally
+and acknowledged upstream, inside a configured quiet window, verifying the
+result and keeping an audit record of every run
+"""
+import logging
+import threading
+from datetime import datetime
+from config_service import config_service, DEFAULT_CONFIG
+from device_manager import device_manager
+from attendance_store import attendance_store, TIMESTAMP_FORMAT
+from conditional import validators
+
+# Configure logging
+logger = logging.getLogger('device_retention')
+
+# Audit outcomes
+CLEARED = 'cleared'
+CLEARED_UNVERIFIED = 'cleared_unverified'
+SKIPPED = 'skipped'
+FAILED = 'failed'
+
+
+class DeviceRetention:
+    """Watermark-guarded clearing of device attendance logs
+
+    The watermark of a device is the newest timestamp up to which every
+    stored punch has been acknowledged by the upstream API (see
+    AttendanceStore.sent_watermark). ZK devices can only clear their whole
+    log, so a run clears it only when every punch on the device is at or
+    below the watermark. A run disables the device (no new punches during
+    the window), downloads and stores the log, checks each punch against
+    the acknowledged punches in the store, clears, reads the log again to
+    verify it is empty and enables the device. Every run that reaches the
+    device is written to the retention_log table.
+
+    Cleared punches stay available: attendance views, reports and sends
+    of a cleared device are completed from the store over their date
+    range (see app._with_archived); background polls only read the device.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # device_id -> date of the last automatic attempt
+        self._attempted = {}
+
+    def settings(self):
+        """The "retention" section of config.json, completed with the defaults"""
+        settings = dict(DEFAULT_CONFIG['retention'])
+        settings.update(config_service.snapshot().get('retention') or {})
+        return settings
+
+    def in_window(self, settings, now=None):
+        now = (now or datetime.now()).strftime('%H:%M')
+        start, end = settings['window_start'], settings['window_end']
+        if start <= end:
+            return start <= now < end
+        return now >= start or now < end
+
+    def check(self, device_id):
+        """Clear a device's log if policy allows it now; called after each background poll
+
+        Runs at most once per device and day, and only when everything
+        stored from the device has been acknowledged upstream.
+        """
+        try:
+            settings = self.settings()
+            if not settings['enabled'] or not self.in_window(settings):
+                return None
+            today = datetime.now().date()
+            with self._lock:
+                if self._attempted.get(device_id) == today:
+                    return None
+            since = attendance_store.trimmed_through(device_id)
+            if attendance_store.count_punches(device_id, after=since) < int(settings['min_records']):
+                return None
+            high_water = attendance_store.high_water(device_id)
+            watermark = attendance_store.sent_watermark(device_id)
+            if watermark is None or watermark < high_water:
+                logger.debug(f"Not clearing device {device_id}: punches after {watermark} not sent yet")
+                return None
+            with self._lock:
+                self._attempted[device_id] = today
+            return self.trim(device_id)
+        except Exception as e:
+            logger.error(f"Error checking retention of device {device_id}: {str(e)}")
+            return None
+
+    def _unconfirmed(self, device_id, records, watermark):
+        """Reason the device log must not be cleared, None if every punch is safe"""
+        if not records:
+            return "device log is empty"
+        if watermark is None:
+            return "no punches acknowledged upstream"
+        acknowledged = attendance_store.acknowledged_keys(device_id, watermark)
+        pending = [r for r in records
+                   if (str(r.user_id), r.timestamp.strftime(TIMESTAMP_FORMAT)) not in acknowledged]
+        if pending:
+            newest = max(r.timestamp for r in pending).strftime(TIMESTAMP_FORMAT)
+            return f"{len(pending)} punches not acknowledged upstream (newest {newest}, watermark {watermark})"
+        return None
+
+    def trim(self, device_id):
+        """Clear a device's attendance log if every punch on it is safe; returns the audit record"""
+        started_at = datetime.now().isoformat()
+        audit = {'device_id': device_id, 'watermark': None, 'device_records': 0,
+                 'remaining_records': None, 'cleared': False, 'outcome': FAILED, 'detail': None}
+        try:
+            with device_manager.device_session(device_id, set_active=False) as conn:
+                # Nobody can punch while the log is checked and cleared
+                conn.disable_device()
+                try:
+                    records = conn.get_attendance()
+                    audit['device_records'] = len(records)
+                    attendance_store.ingest(device_id, records)
+                    audit['watermark'] = attendance_store.sent_watermark(device_id)
+                    reason = self._unconfirmed(device_id, records, audit['watermark'])
+                    if reason:
+                        audit.update(outcome=SKIPPED, detail=reason)
+                    else:
+                        conn.clear_attendance()
+                        audit['cleared'] = True
+                        audit['remaining_records'] = len(conn.get_attendance())
+                        if audit['remaining_records']:
+                            audit.update(outcome=CLEARED_UNVERIFIED,
+                                         detail=f"{audit['remaining_records']} punches still on the device")
+                        else:
+                            audit['outcome'] = CLEARED
+                finally:
+                    conn.enable_device()
+        except Exception as e:
+            audit['detail'] = str(e)
+
+        if audit['cleared']:
+            validators.invalidate(device_id)
+
+        attendance_store.record_retention(
+            device_id, started_at, audit['outcome'], watermark=audit['watermark'],
+            device_records=audit['device_records'], remaining_records=audit['remaining_records'],
+            cleared=audit['cleared'], detail=audit['detail'])
+        if audit['outcome'] == CLEARED:
+            logger.info(f"Cleared {audit['device_records']} punches from device {device_id} "
+                        f"(acknowledged through {audit['watermark']})")
+        elif audit['outcome'] == SKIPPED:
+            logger.info(f"Kept the log of device {device_id}: {audit['detail']}")
+        else:
+            logger.warning(f"Clearing the log of device {device_id} {audit['outcome']}: {audit['detail']}")
+        return audit
+
+# Create a global instance of the device retention policy
+device_retention = DeviceRetention()
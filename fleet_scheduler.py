@@ -0,0 +1,312 @@
+"""
+Fleet Scheduler for ZK Attendance System
+Polls the attendance log of every registered device in the background,
+staggered and prioritized by activity, under a global concurrency cap
+"""
+import heapq
+import logging
+import os
+import random
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from device_manager import device_manager
+from health_monitor import health_monitor
+from attendance_store import attendance_store
+from device_leases import device_leases
+from device_retention import device_retention
+
+# Configure logging
+logger = logging.getLogger('fleet_scheduler')
+
+# Seconds between polls of a device with normal activity, and the bounds the
+# interval adapts within (busy devices towards MIN, idle ones towards MAX).
+# A device can set its own base interval with "poll_interval" in config.json.
+BASE_INTERVAL = 300
+MIN_INTERVAL = 60
+MAX_INTERVAL = 30 * 60
+
+# Interval multipliers after a poll that brought new punches / none
+BUSY_FACTOR = 0.5
+IDLE_FACTOR = 1.5
+
+# Devices downloading at the same time, across the whole fleet
+MAX_CONCURRENT_POLLS = 8
+
+# Retry delay after the first failure, doubled per further failure up to the cap
+FAILURE_BACKOFF = 60
+MAX_BACKOFF = 60 * 60
+
+# Random spread (fraction of the delay) so devices never fall into lockstep
+JITTER = 0.1
+
+# Seconds between checks for added or removed devices
+RECONCILE_INTERVAL = 30
+
+# Set ZK_FLEET_POLLING=0 to never start the scheduler
+ENABLED = os.environ.get('ZK_FLEET_POLLING', '1') != '0'
+
+
+class DeviceSchedule:
+    """Polling state of one device"""
+
+    def __init__(self, device_id, interval, due):
+        self.device_id = device_id
+        self.interval = interval
+        self.due = due
+        self.failures = 0
+        self.polling = False
+        self.polls = 0
+        self.last_poll = None
+        self.last_new = None
+        self.last_error = None
+        self.last_duration_ms = None
+
+    def to_dict(self, now):
+        return {
+            "device_id": self.device_id,
+            "interval": round(self.interval),
+            "next_poll_in": None if self.polling else max(0, round(self.due - now)),
+            "polling": self.polling,
+            "polls": self.polls,
+            "failures": self.failures,
+            "last_poll": self.last_poll,
+            "last_new_punches": self.last_new,
+            "last_duration_ms": self.last_duration_ms,
+            "last_error": self.last_error
+        }
+
+
+class FleetScheduler:
+    """Background attendance polling for every registered device
+
+    Each device has its own due time in a heap. First polls are staggered
+    over the base interval by a hash of the device id, so a restart or a
+    batch of new devices never polls everything at once. After a poll the
+    interval adapts to activity: halved when new punches arrived, stretched
+    when there were none. Failures back off exponentially, and devices the
+    health monitor reports offline are skipped without a connection attempt.
+    At most MAX_CONCURRENT_POLLS downloads run at a time; a due device
+    waits for a free slot. With sharding (see device_leases) only the
+    devices leased to this instance are scheduled.
+    """
+
+    def __init__(self, max_concurrent=MAX_CONCURRENT_POLLS):
+        self.max_concurrent = max_concurrent
+        self._lock = threading.Lock()
+        self._schedules = {}
+        self._heap = []
+        self._slots = threading.BoundedSemaphore(max_concurrent)
+        self._in_flight = 0
+        self._executor = None
+        self._thread = None
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._reconciled_at = None
+        device_leases.add_listener(self._leases_changed)
+
+    # -- scheduling -------------------------------------------------------
+
+    def _base_interval(self, device):
+        try:
+            interval = float(device.get('poll_interval') or BASE_INTERVAL)
+        except (TypeError, ValueError):
+            interval = BASE_INTERVAL
+        return min(max(interval, MIN_INTERVAL), MAX_INTERVAL)
+
+    def _jittered(self, delay):
+        return delay * random.uniform(1 - JITTER, 1 + JITTER)
+
+    def _push(self, schedule, due):
+        """Schedule a device's next poll (caller holds the lock)"""
+        schedule.due = due
+        heapq.heappush(self._heap, (due, schedule.device_id))
+
+    def _reconcile(self):
+        """Start scheduling new devices and forget removed ones (or ones leased elsewhere)"""
+        device_manager.reload_if_changed()
+        devices = {device_id: device for device_id, device in device_manager.get_all_devices().items()
+                   if device_leases.owns(device_id)}
+        now = time.monotonic()
+        with self._lock:
+            for device_id in list(self._schedules):
+                if device_id not in devices:
+                    del self._schedules[device_id]
+            for device_id, device in devices.items():
+                if device_id in self._schedules:
+                    continue
+                interval = self._base_interval(device)
+                # Same offset for a device on every start, spread over the interval
+                offset = zlib.crc32(device_id.encode()) % int(interval)
+                schedule = DeviceSchedule(device_id, interval, now + offset)
+                self._schedules[device_id] = schedule
+                self._push(schedule, schedule.due)
+        self._reconciled_at = now
+
+    def _leases_changed(self, acquired, lost):
+        # Pick up the new device set at once instead of at the next reconcile
+        self._reconciled_at = None
+        self._wake.set()
+
+    def _next_due(self):
+        """Pop the next due device, or return the seconds until one is due (caller holds the lock)"""
+        while self._heap:
+            due, device_id = self._heap[0]
+            schedule = self._schedules.get(device_id)
+            if schedule is None or schedule.due != due or schedule.polling:
+                # Removed device or superseded entry
+                heapq.heappop(self._heap)
+                continue
+            wait = due - time.monotonic()
+            if wait > 0:
+                return None, wait
+            heapq.heappop(self._heap)
+            schedule.polling = True
+            return schedule, 0
+        return None, RECONCILE_INTERVAL
+
+    def poll_now(self, device_id):
+        """Move a device to the front of the queue; False if it is not scheduled"""
+        with self._lock:
+            schedule = self._schedules.get(device_id)
+            if schedule is None:
+                return False
+            if not schedule.polling:
+                self._push(schedule, time.monotonic())
+        self._wake.set()
+        return True
+
+    # -- polling ----------------------------------------------------------
+
+    def _poll(self, schedule):
+        """Download one device's attendance log into the store and reschedule it"""
+        # Import here to avoid circular imports
+        from app import fetch_attendance
+
+        device_id = schedule.device_id
+        if not device_leases.owns(device_id):
+            # Lease lost while the device was queued; its new owner polls it
+            self._slots.release()
+            with self._lock:
+                self._in_flight -= 1
+                schedule.polling = False
+                if self._schedules.get(device_id) is schedule:
+                    del self._schedules[device_id]
+            return
+
+        started = time.perf_counter()
+        new_punches = None
+        error = None
+        offline = False
+        try:
+            health = health_monitor.get(device_id)
+            if health is not None and not health.get('reachable'):
+                # Known offline: no connection attempt, check again after the next probe
+                offline = True
+                error = f"offline: {health.get('error') or 'unreachable'}"
+            else:
+                before = attendance_store.data_version(device_id)
+                fetch_attendance(device_id, set_active=False)
+                after = attendance_store.data_version(device_id)
+                new_punches = (after[1] if after else 0) - (before[1] if before else 0)
+                # Clears the device log in the retention window once it is all sent
+                device_retention.check(device_id)
+        except Exception as e:
+            error = str(e) or e.__class__.__name__
+        finally:
+            self._slots.release()
+        self._finish(schedule, new_punches, error, offline, time.perf_counter() - started)
+
+    def _finish(self, schedule, new_punches, error, offline, duration):
+        with self._lock:
+            self._in_flight -= 1
+            schedule.polling = False
+            schedule.polls += 1
+            schedule.last_poll = datetime.now().isoformat()
+            schedule.last_duration_ms = round(duration * 1000, 1)
+            schedule.last_error = error
+            if error is None:
+                schedule.failures = 0
+                schedule.last_new = new_punches
+                factor = BUSY_FACTOR if new_punches else IDLE_FACTOR
+                schedule.interval = min(max(schedule.interval * factor, MIN_INTERVAL), MAX_INTERVAL)
+                delay = schedule.interval
+            else:
+                schedule.failures += 1
+                if offline:
+                    delay = FAILURE_BACKOFF
+                else:
+                    delay = min(FAILURE_BACKOFF * 2 ** (schedule.failures - 1), MAX_BACKOFF)
+            if self._schedules.get(schedule.device_id) is schedule:
+                self._push(schedule, time.monotonic() + self._jittered(delay))
+
+        if error is None:
+            if new_punches:
+                logger.info(f"Polled device {schedule.device_id}: {new_punches} new punches, "
+                            f"next poll in {round(schedule.interval)}s")
+        elif not offline and (schedule.failures == 1 or schedule.failures % 10 == 0):
+            logger.warning(f"Polling device {schedule.device_id} failed ({schedule.failures}x), "
+                           f"retrying in {round(delay)}s: {error}")
+
+    # -- background thread ------------------------------------------------
+
+    def _run(self):
+        while not self._stop.is_set():
+            if self._reconciled_at is None or time.monotonic() - self._reconciled_at >= RECONCILE_INTERVAL:
+                try:
+                    self._reconcile()
+                except Exception as e:
+                    logger.error(f"Error reading the device list: {str(e)}")
+
+            # Wait for a free slot before taking a device off the queue, so
+            # the most overdue device gets the slot when one frees up
+            if not self._slots.acquire(timeout=1):
+                continue
+            with self._lock:
+                schedule, wait = self._next_due()
+                if schedule is not None:
+                    self._in_flight += 1
+            if schedule is None:
+                self._slots.release()
+                self._wake.wait(min(wait, RECONCILE_INTERVAL))
+                self._wake.clear()
+                continue
+
+            self._executor.submit(self._poll, schedule)
+
+    def start(self):
+        """Start the background scheduler thread (idempotent)"""
+        if not ENABLED:
+            logger.info("Fleet polling disabled by ZK_FLEET_POLLING=0")
+            return
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._stop.clear()
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_concurrent, thread_name_prefix='fleet-poll')
+            self._thread = threading.Thread(target=self._run, name='fleet-scheduler', daemon=True)
+            self._thread.start()
+        logger.info(f"Fleet scheduler started, at most {self.max_concurrent} devices polled at once")
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def status(self):
+        """Scheduler state and per-device schedules, soonest poll first"""
+        now = time.monotonic()
+        with self._lock:
+            devices = sorted((schedule.to_dict(now) for schedule in self._schedules.values()),
+                             key=lambda entry: (entry['next_poll_in'] is not None, entry['next_poll_in'] or 0))
+            return {
+                "running": bool(self._thread and self._thread.is_alive()),
+                "max_concurrent": self.max_concurrent,
+                "in_flight": self._in_flight,
+                "devices": devices
+            }
+
+# Create a global instance of the fleet scheduler
+fleet_scheduler = FleetScheduler()
@@ -0,0 +1,362 @@
+"""
+Device Health Monitor for ZK Attendance System
+Probes registered devices in the background and caches reachability,
+latency and static metadata so device endpoints never wait on a terminal
+"""
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from device_manager import device_manager, APP_CONFIG_DIR
+from device_leases import device_leases
+
+# Configure logging
+logger = logging.getLogger('health_monitor')
+
+# Seconds between probe rounds
+HEALTH_INTERVAL = 60
+
+# Upper bound, in seconds, for a reachability probe regardless of device timeout
+PROBE_TIMEOUT = 3
+
+# Seconds before static metadata (serial, firmware, ...) is fetched again
+METADATA_TTL = 6 * 60 * 60
+
+# Devices probed in parallel, so one dead terminal does not delay the others
+MAX_PARALLEL_PROBES = 8
+
+# Cache snapshot shared between a worker process that probes and web
+# processes that only read it (see serve.py); web processes request an
+# early probe round by touching the wake file
+SNAPSHOT_PATH = os.path.join(APP_CONFIG_DIR, 'device_health.json')
+WAKE_SUFFIX = '.wake'
+
+# Seconds between checks of the wake file while waiting for the next round
+WAKE_POLL = 2
+
+METADATA_FIELDS = ('serial_number', 'firmware_version', 'platform', 'device_name', 'mac', 'workcode')
+
+
+class DeviceHealthMonitor:
+    """Background prober with an in-memory cache of device health
+
+    Reachability is a plain TCP connect to the device port, which does not
+    open a ZK session and so never competes with real commands for the
+    device lane. Static metadata needs a session and is only refreshed every
+    METADATA_TTL, when the address changes or when a device comes back online;
+    a failed session marks the device unreachable until a later one succeeds.
+
+    When the app runs as separate web and worker processes, the worker
+    publishes the cache to a snapshot file and the web processes follow it
+    instead of probing, so devices are probed once however many web
+    processes serve requests. With sharding (see device_leases) a worker
+    only probes the devices it holds the lease of and takes the status of
+    the others from the snapshot published by their owners.
+    """
+
+    def __init__(self, interval=HEALTH_INTERVAL):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._cache = {}
+        self._probe_locks = {}
+        self._thread = None
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self.snapshot_path = None
+        self.passive = False
+        self._snapshot_mtime = None
+        self._wake_mtime = None
+        device_leases.add_listener(self._leases_changed)
+
+    # -- cache ------------------------------------------------------------
+
+    def get(self, device_id):
+        """Cached health of a device, None if it was never probed"""
+        self._follow()
+        with self._lock:
+            status = self._cache.get(device_id)
+            return dict(status) if status else None
+
+    def get_all(self):
+        """Cached health of every device that has been probed"""
+        self._follow()
+        with self._lock:
+            return {device_id: dict(status) for device_id, status in self._cache.items()}
+
+    def _update(self, device_id, **fields):
+        with self._lock:
+            status = self._cache.setdefault(device_id, {'device_id': device_id})
+            status.update(fields)
+            status = dict(status)
+        self._publish()
+        return status
+
+    def record_metadata(self, device_id, info):
+        """Store metadata read by a foreground request (e.g. /api/connect)"""
+        device = device_manager.get_device(device_id) or {}
+        fields = {key: info.get(key) for key in METADATA_FIELDS if key in info}
+        self._update(device_id, metadata_at=time.time(), address=(device.get('ip'), device.get('port')),
+                     reachable=True, checked_at=datetime.now().isoformat(), error=None, **fields)
+
+    # -- sharing with other processes -------------------------------------
+
+    def share_snapshot(self, path=SNAPSHOT_PATH):
+        """Probe as usual and publish every cache change to path (worker process)"""
+        self.snapshot_path = path
+        self.passive = False
+        try:
+            self._wake_mtime = os.path.getmtime(path + WAKE_SUFFIX)
+        except OSError:
+            self._wake_mtime = None
+
+    def follow_snapshot(self, path=SNAPSHOT_PATH):
+        """Never probe; serve the cache published by a worker process (web process)"""
+        self.snapshot_path = path
+        self.passive = True
+
+    def _merge_shared(self, cache):
+        """Take the status of devices leased by other instances from the published snapshot"""
+        try:
+            with open(self.snapshot_path) as f:
+                published = json.load(f)
+        except (OSError, ValueError):
+            return cache
+        registered = device_manager.get_all_devices()
+        others = {device_id: status for device_id, status in published.items()
+                  if device_id in registered and not device_leases.owns(device_id)}
+        with self._lock:
+            self._cache.update(others)
+        cache.update(others)
+        return cache
+
+    def _publish(self):
+        if self.passive or not self.snapshot_path:
+            return
+        with self._lock:
+            cache = dict(self._cache)
+        if device_leases.enabled:
+            # Other shards publish to the same file
+            cache = self._merge_shared(cache)
+        snapshot = json.dumps(cache, default=str)
+        temp_path = f"{self.snapshot_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(temp_path, 'w') as f:
+                f.write(snapshot)
+            os.replace(temp_path, self.snapshot_path)
+        except OSError as e:
+            logger.warning(f"Could not publish device health snapshot: {str(e)}")
+
+    def _follow(self):
+        """Reload the published snapshot when it changed (passive mode only)"""
+        if not self.passive:
+            return
+        try:
+            mtime = os.path.getmtime(self.snapshot_path)
+            if mtime == self._snapshot_mtime:
+                return
+            with open(self.snapshot_path) as f:
+                cache = json.load(f)
+        except (OSError, ValueError):
+            return
+        with self._lock:
+            self._cache = cache
+            self._snapshot_mtime = mtime
+
+    def _wake_file_touched(self):
+        """True when a web process asked for an early round since the last check"""
+        try:
+            mtime = os.path.getmtime(self.snapshot_path + WAKE_SUFFIX)
+        except OSError:
+            return False
+        touched = mtime != self._wake_mtime
+        self._wake_mtime = mtime
+        return touched
+
+    # -- probing ----------------------------------------------------------
+
+    def _probe_lock(self, device_id):
+        with self._lock:
+            lock = self._probe_locks.get(device_id)
+            if lock is None:
+                lock = threading.Lock()
+                self._probe_locks[device_id] = lock
+            return lock
+
+    def _check_reachable(self, device):
+        """TCP connect to the device, returns (reachable, latency_ms, error)"""
+        timeout = min(device.get('timeout', PROBE_TIMEOUT), PROBE_TIMEOUT)
+        start = time.perf_counter()
+        try:
+            sock = socket.create_connection((device['ip'], int(device['port'])), timeout=timeout)
+            sock.close()
+            return True, round((time.perf_counter() - start) * 1000, 1), None
+        except OSError as e:
+            return False, None, str(e) or e.__class__.__name__
+
+    def _read_metadata(self, device_id):
+        """Open a ZK session and read static device information"""
+        start = time.perf_counter()
+        with device_manager.device_session(device_id, set_active=False) as conn:
+            info = {
+                'serial_number': conn.get_serialnumber(),
+                'firmware_version': conn.get_firmware_version(),
+                'platform': conn.get_platform(),
+                'device_name': conn.get_device_name(),
+                'mac': conn.get_mac(),
+                # Not every pyzk release implements get_workcode
+                'workcode': conn.get_workcode() if hasattr(conn, 'get_workcode') else None
+            }
+        info['session_ms'] = round((time.perf_counter() - start) * 1000, 1)
+        return info
+
+    def probe(self, device_id, metadata=True):
+        """Probe one device now and return its updated status
+
+        Concurrent probes of the same device are collapsed into one. In
+        passive mode, or when another instance holds the device lease,
+        nothing is probed and the cached status is returned.
+        """
+        if self.passive or not device_leases.owns(device_id):
+            return self.get(device_id)
+        lock = self._probe_lock(device_id)
+        if not lock.acquire(blocking=False):
+            # Someone else is probing; wait for them and use their result
+            with lock:
+                return self.get(device_id)
+        try:
+            device = device_manager.get_device(device_id)
+            if not device:
+                with self._lock:
+                    self._cache.pop(device_id, None)
+                return None
+
+            previous = self.get(device_id) or {}
+            address = (device.get('ip'), device.get('port'))
+
+            if device.get('force_udp'):
+                # No TCP listener to knock on, a session is the only probe
+                reachable, latency, error = False, None, None
+            else:
+                reachable, latency, error = self._check_reachable(device)
+
+            fields = {
+                'reachable': reachable,
+                'latency_ms': latency,
+                'error': error,
+                'checked_at': datetime.now().isoformat()
+            }
+
+            stale = (
+                previous.get('metadata_at') is None or
+                time.time() - previous['metadata_at'] > METADATA_TTL or
+                previous.get('address') != address or
+                not previous.get('reachable')
+            )
+            if device.get('force_udp') or (metadata and reachable and stale):
+                try:
+                    info = self._read_metadata(device_id)
+                    fields.update(info)
+                    fields.update(reachable=True, error=None, metadata_at=time.time(), address=address)
+                    if latency is None:
+                        fields['latency_ms'] = info['session_ms']
+                except Exception as e:
+                    # The port answered but the terminal did not speak ZK (or is wedged)
+                    logger.warning(f"Could not read metadata from device {device_id}: {str(e)}")
+                    fields.update(reachable=False, error=str(e))
+
+            if previous and previous.get('reachable') != fields['reachable']:
+                state = 'online' if fields['reachable'] else f"offline ({fields['error']})"
+                logger.info(f"Device {device_id} is {state}")
+            if fields['reachable']:
+                fields['last_seen'] = fields['checked_at']
+
+            return self._update(device_id, **fields)
+        finally:
+            lock.release()
+
+    def probe_all(self):
+        """Probe every registered device this instance owns in parallel"""
+        # Devices may have been added through a web process (see serve.py)
+        device_manager.reload_if_changed()
+        registered = device_manager.get_all_devices()
+        with self._lock:
+            for device_id in list(self._cache):
+                if device_id not in registered:
+                    self._cache.pop(device_id, None)
+        device_ids = [device_id for device_id in registered if device_leases.owns(device_id)]
+        if device_ids:
+            with ThreadPoolExecutor(max_workers=min(MAX_PARALLEL_PROBES, len(device_ids))) as pool:
+                list(pool.map(self._safe_probe, device_ids))
+        # Also publishes removals of devices that were deleted
+        self._publish()
+
+    def _safe_probe(self, device_id):
+        try:
+            return self.probe(device_id)
+        except Exception as e:
+            logger.error(f"Error probing device {device_id}: {str(e)}")
+            return None
+
+    # -- background thread ------------------------------------------------
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.probe_all()
+            self._wait_for_next_round()
+
+    def _leases_changed(self, acquired, lost):
+        # Probe devices taken over from another instance without waiting a round
+        if acquired:
+            self._wake.set()
+
+    def _wait_for_next_round(self):
+        deadline = time.monotonic() + self.interval
+        while not self._stop.is_set():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            if self.snapshot_path is None:
+                self._wake.wait(remaining)
+                break
+            # Other processes can only wake us through the wake file
+            if self._wake.wait(min(remaining, WAKE_POLL)) or self._wake_file_touched():
+                break
+        self._wake.clear()
+
+    def start(self):
+        """Start the background probe thread (idempotent, never in passive mode)"""
+        if self.passive:
+            return
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='device-health', daemon=True)
+            self._thread.start()
+        logger.info(f"Device health monitor started, probing every {self.interval}s")
+
+    def ensure_started(self):
+        if not (self._thread and self._thread.is_alive()):
+            self.start()
+
+    def wake(self):
+        """Run a probe round now, e.g. after a device was added or changed"""
+        if self.passive:
+            try:
+                with open(self.snapshot_path + WAKE_SUFFIX, 'w') as f:
+                    f.write(datetime.now().isoformat())
+            except OSError as e:
+                logger.warning(f"Could not wake the health monitor worker: {str(e)}")
+            return
+        self._wake.set()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+# Create a global instance of the health monitor
+health_monitor = DeviceHealthMonitor()
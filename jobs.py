@@ -0,0 +1,273 @@
+"""
+Background Jobs for ZK Attendance System
+Runs long operations (range sends, user imports, reports) on a worker
+pool, exposes their progress and caches results of repeatable jobs
+"""
+import hashlib
+import json
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+# Configure logging
+logger = logging.getLogger('jobs')
+
+# Worker threads shared by all jobs; device work is serialized per device anyway
+JOB_WORKERS = 2
+
+# Seconds a finished cacheable job answers identical submissions
+RESULT_TTL = 10 * 60
+
+# Seconds finished jobs stay visible, and how many are kept at most
+JOB_RETENTION = 60 * 60
+MAX_FINISHED_JOBS = 100
+
+# Seconds between SSE keep-alive comments while a job makes no progress
+EVENT_KEEPALIVE = 15
+
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+FINISHED = (SUCCEEDED, FAILED, CANCELLED)
+
+
+class JobCancelled(BaseException):
+    """Raised from report_progress() inside a job whose cancellation was requested
+
+    Derives from BaseException so the broad `except Exception` handlers in the
+    view functions run as jobs do not turn a cancellation into an error reply.
+    """
+
+
+_current = threading.local()
+
+
+def report_progress(fraction=None, message=None):
+    """Update the progress of the job running in this thread, if any
+
+    fraction is 0..1. Safe to call from code that also runs outside jobs
+    (e.g. a view function serving a normal request), where it does nothing.
+    """
+    job = getattr(_current, 'job', None)
+    if job is None:
+        return
+    job.update(fraction, message)
+    if job.cancel_requested:
+        raise JobCancelled()
+
+
+def params_key(kind, params):
+    """Stable hash of a job kind and its parameters"""
+    encoded = json.dumps({'kind': kind, 'params': params}, sort_keys=True, default=str)
+    return hashlib.sha256(encoded.encode()).hexdigest()
+
+
+class Job:
+    """State of one submitted job; every change bumps version and wakes waiters"""
+
+    def __init__(self, kind, params, key):
+        self.id = uuid.uuid4().hex[:16]
+        self.kind = kind
+        self.params = params
+        self.key = key
+        self.status = QUEUED
+        self.progress = 0.0
+        self.message = None
+        self.result = None
+        self.http_status = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.cancel_requested = False
+        self.future = None
+        self.version = 0
+        self._cond = threading.Condition()
+
+    @property
+    def done(self):
+        return self.status in FINISHED
+
+    def _changed(self, **fields):
+        with self._cond:
+            for name, value in fields.items():
+                setattr(self, name, value)
+            self.version += 1
+            self._cond.notify_all()
+
+    def update(self, fraction=None, message=None):
+        fields = {}
+        if fraction is not None:
+            fields['progress'] = max(0.0, min(1.0, float(fraction)))
+        if message is not None:
+            fields['message'] = message
+        if fields:
+            self._changed(**fields)
+
+    def wait(self, version, timeout):
+        """Block until the job changes past version (or timeout); returns the current version"""
+        with self._cond:
+            if self.version == version and not self.done:
+                self._cond.wait(timeout)
+            return self.version
+
+    def to_dict(self, include_result=True):
+        def stamp(value):
+            return datetime.fromtimestamp(value).isoformat() if value else None
+
+        data = {
+            "id": self.id,
+            "kind": self.kind,
+            "params": self.params,
+            "status": self.status,
+            "progress": round(self.progress, 3),
+            "message": self.message,
+            "error": self.error,
+            "created_at": stamp(self.created_at),
+            "started_at": stamp(self.started_at),
+            "finished_at": stamp(self.finished_at),
+        }
+        if include_result and self.done:
+            data["http_status"] = self.http_status
+            data["result"] = self.result
+        return data
+
+
+class JobManager:
+    """Registry of job kinds, a worker pool and a TTL cache of results
+
+    A job kind is a callable run(job, **params) returning (http_status,
+    result). Submitting a job whose identical twin (same kind and parameter
+    hash) is still queued or running returns that job instead of starting a
+    second one. For cacheable kinds a successful twin that finished less than
+    its TTL ago is returned too, so identical reports are served instantly.
+    """
+
+    def __init__(self, workers=JOB_WORKERS):
+        self.workers = workers
+        self._lock = threading.Lock()
+        self._kinds = {}
+        self._jobs = {}
+        self._by_key = {}
+        self._executor = None
+
+    def register(self, kind, run, cacheable=False, ttl=RESULT_TTL):
+        """Make a job kind available to submit()"""
+        self._kinds[kind] = {'run': run, 'cacheable': cacheable, 'ttl': ttl}
+
+    def kinds(self):
+        return {kind: {'cacheable': spec['cacheable'], 'ttl': spec['ttl']} for kind, spec in self._kinds.items()}
+
+    def _pool(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='job')
+        return self._executor
+
+    def submit(self, kind, params=None):
+        """Queue a job and return (job, reused) where reused means an existing job was returned"""
+        spec = self._kinds.get(kind)
+        if spec is None:
+            raise ValueError(f"Unknown job kind '{kind}'")
+        params = dict(params or {})
+        key = params_key(kind, params)
+
+        with self._lock:
+            self._prune()
+            existing = self._jobs.get(self._by_key.get(key))
+            if existing is not None:
+                if not existing.done:
+                    return existing, True
+                fresh = time.time() - existing.finished_at < spec['ttl']
+                if spec['cacheable'] and existing.status == SUCCEEDED and fresh:
+                    return existing, True
+
+            job = Job(kind, params, key)
+            self._jobs[job.id] = job
+            self._by_key[key] = job.id
+            job.future = self._pool().submit(self._run, job, spec['run'])
+        logger.info(f"Queued {kind} job {job.id}")
+        return job, False
+
+    def _run(self, job, run):
+        if job.cancel_requested:
+            job._changed(status=CANCELLED, finished_at=time.time())
+            return
+        job._changed(status=RUNNING, started_at=time.time())
+        _current.job = job
+        try:
+            http_status, result = run(job, **job.params)
+            if http_status >= 400:
+                error = result.get('message') if isinstance(result, dict) else f"HTTP {http_status}"
+                job._changed(status=FAILED, http_status=http_status, result=result, error=error,
+                             finished_at=time.time())
+            else:
+                job._changed(status=SUCCEEDED, progress=1.0, http_status=http_status, result=result,
+                             finished_at=time.time())
+        except JobCancelled:
+            job._changed(status=CANCELLED, finished_at=time.time())
+        except Exception as e:
+            logger.error(f"Job {job.id} ({job.kind}) failed: {str(e)}")
+            job._changed(status=FAILED, error=str(e), finished_at=time.time())
+        finally:
+            _current.job = None
+        logger.info(f"{job.kind} job {job.id} {job.status} in {job.finished_at - job.started_at:.1f}s")
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list_jobs(self):
+        """All retained jobs, newest first"""
+        with self._lock:
+            self._prune()
+            jobs = list(self._jobs.values())
+        return sorted(jobs, key=lambda job: job.created_at, reverse=True)
+
+    def cancel(self, job_id):
+        """Ask a job to stop; queued jobs never start, running ones stop at their next progress report"""
+        job = self.get(job_id)
+        if job is None or job.done:
+            return job
+        job.cancel_requested = True
+        if job.future is not None and job.future.cancel():
+            job._changed(status=CANCELLED, finished_at=time.time())
+        return job
+
+    def events(self, job_id, keepalive=EVENT_KEEPALIVE):
+        """Server-Sent Events for a job: a progress event per change, then a done event"""
+        job = self.get(job_id)
+        version = -1
+        while True:
+            current = job.wait(version, keepalive)
+            if current == version:
+                yield ": keep-alive\n\n"
+                continue
+            version = current
+            if job.done:
+                yield f"event: done\ndata: {json.dumps(job.to_dict(), default=str)}\n\n"
+                return
+            yield f"event: progress\ndata: {json.dumps(job.to_dict(include_result=False), default=str)}\n\n"
+
+    def _prune(self):
+        """Forget finished jobs past their retention (caller holds the lock)"""
+        now = time.time()
+        finished = sorted((job for job in self._jobs.values() if job.done), key=lambda job: job.finished_at)
+        excess = len(finished) - MAX_FINISHED_JOBS
+        for index, job in enumerate(finished):
+            ttl = self._kinds.get(job.kind, {}).get('ttl', RESULT_TTL)
+            if index < excess or now - job.finished_at > max(ttl, JOB_RETENTION):
+                self._jobs.pop(job.id, None)
+                if self._by_key.get(job.key) == job.id:
+                    self._by_key.pop(job.key, None)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+# Create a global instance of the job manager
+job_manager = JobManager()
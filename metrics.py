@@ -0,0 +1,207 @@
+"""
+Metrics for ZK Attendance System
+Latency histograms and counters exposed in Prometheus text format at /metrics
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+# Bucket upper bounds in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Device and upstream calls routinely take seconds, up to the connect timeouts
+SLOW_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+def _escape(value):
+    """Escape a label value for the Prometheus text format"""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labelnames, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.extend(f'{name}="{_escape(value)}"' for name, value in extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Counter:
+    """Monotonically increasing count per label set"""
+    type_name = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def collect(self):
+        with self._lock:
+            values = dict(self._values)
+        lines = []
+        for key, value in sorted(values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    """Distribution of observed values (seconds) per label set"""
+    type_name = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        self._lock = threading.Lock()
+        # key -> [bucket counts..., sum, count]
+        self._values = {}
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = [0] * (len(self.buckets) + 2)
+                self._values[key] = state
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def collect(self):
+        with self._lock:
+            values = {key: list(state) for key, state in self._values.items()}
+        lines = []
+        for key, state in sorted(values.items()):
+            for i, bound in enumerate(self.buckets):
+                labels = _format_labels(self.labelnames, key, [('le', _format_value(bound))])
+                lines.append(f"{self.name}_bucket{labels} {state[i]}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(state[-2])}")
+            lines.append(f"{self.name}_count{labels} {state[-1]}")
+        return lines
+
+
+class MetricsRegistry:
+    """Holds all metrics and renders them for scraping"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+
+    def register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self):
+        """Render every metric in the Prometheus text exposition format"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type_name}")
+            lines.extend(metric.collect())
+        return '\n'.join(lines) + '\n'
+
+
+# Callables notified after every timed() block, e.g. to build per-request spans
+_timing_listeners = []
+
+
+def add_timing_listener(listener):
+    """Call listener(histogram, labels, seconds) after every timed() block"""
+    _timing_listeners.append(listener)
+
+
+class _Timing:
+    """Handle yielded by timed() so callers can refine the outcome label"""
+
+    def __init__(self):
+        self.outcome = 'success'
+
+
+@contextmanager
+def timed(histogram, **labels):
+    """Time the block and record it in histogram, labelled with its outcome
+
+    The outcome is 'error' if the block raises, otherwise 'success' unless
+    the caller set timing.outcome (e.g. to an HTTP status class).
+    """
+    timing = _Timing()
+    start = time.perf_counter()
+    try:
+        yield timing
+    except BaseException:
+        timing.outcome = 'error'
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        histogram.observe(elapsed, outcome=timing.outcome, **labels)
+        for listener in _timing_listeners:
+            try:
+                listener(histogram, labels, elapsed)
+            except Exception:
+                pass  # Instrumentation must never break the timed code
+
+
+def http_outcome(status_code):
+    """Outcome label for an upstream HTTP response"""
+    if 200 <= status_code < 300:
+        return 'success'
+    return f"http_{status_code}"
+
+# Create the global registry and the application metrics
+registry = MetricsRegistry()
+
+DEVICE_CONNECT_SECONDS = registry.histogram(
+    'zk_device_connect_seconds', 'Time to open a session with a ZK device',
+    ('device', 'outcome'), SLOW_BUCKETS)
+DEVICE_READ_SECONDS = registry.histogram(
+    'zk_device_read_seconds', 'Time to download data from a ZK device',
+    ('device', 'operation', 'outcome'), SLOW_BUCKETS)
+DEVICE_RECORDS_READ = registry.counter(
+    'zk_device_records_read_total', 'Records downloaded from ZK devices',
+    ('device', 'kind'))
+RECORD_FORMAT_SECONDS = registry.histogram(
+    'zk_record_format_seconds', 'Time to filter and format attendance records',
+    ('device', 'stage', 'outcome'))
+UPSTREAM_POST_SECONDS = registry.histogram(
+    'zk_upstream_post_seconds', 'Time to POST attendance records to the upstream API',
+    ('device', 'mode', 'outcome'), SLOW_BUCKETS)
+UPSTREAM_RECORDS_SENT = registry.counter(
+    'zk_upstream_records_sent_total', 'Attendance records accepted by the upstream API',
+    ('device', 'mode'))
+CONFIG_IO_SECONDS = registry.histogram(
+    'zk_config_io_seconds', 'Time to read or write config.json',
+    ('operation', 'outcome'))
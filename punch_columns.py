@@ -0,0 +1,289 @@
+"""
+Punch Columns for ZK Attendance System
+Compact column-oriented storage of punches for analytics over long date
+ranges and many devices, with vectorized filtering and aggregation
+"""
+import logging
+from array import array
+from bisect import bisect_left
+from datetime import datetime, timedelta
+
+# numpy is optional; without it the same operations run as plain loops
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Configure logging
+logger = logging.getLogger('punch_columns')
+
+SECONDS_PER_DAY = 86400
+EPOCH = datetime(1970, 1, 1)
+ONE_SECOND = timedelta(seconds=1)
+
+# Column name -> array typecode (and the matching numpy dtype)
+COLUMNS = {
+    'epoch': 'q',         # seconds since 1970-01-01 of the device's local time
+    'user_index': 'i',    # index into the user_id string table
+    'device_index': 'H',  # index into the device_id string table
+    'uid': 'i',           # device-internal user slot
+    'status': 'B',
+    'punch': 'B',
+}
+DTYPES = {'q': 'int64', 'i': 'int32', 'H': 'uint16', 'B': 'uint8'}
+
+
+def to_epoch(timestamp):
+    """Seconds since 1970-01-01 of a naive device timestamp, taken as-is (no timezone)"""
+    return (timestamp - EPOCH) // ONE_SECOND
+
+
+def from_epoch(seconds):
+    return EPOCH + timedelta(seconds=int(seconds))
+
+
+def day_bounds(start_date=None, end_date=None):
+    """Epoch range [start, end) covering inclusive YYYY-MM-DD dates; None for open ends"""
+    start = to_epoch(datetime.strptime(start_date, '%Y-%m-%d')) if start_date else None
+    end = to_epoch(datetime.strptime(end_date, '%Y-%m-%d')) + SECONDS_PER_DAY if end_date else None
+    return start, end
+
+
+class StringTable:
+    """Interns strings as small integers"""
+
+    def __init__(self, values=()):
+        self.values = []
+        self.index = {}
+        for value in values:
+            self.intern(value)
+
+    def intern(self, value):
+        position = self.index.get(value)
+        if position is None:
+            position = len(self.values)
+            self.values.append(value)
+            self.index[value] = position
+        return position
+
+    def __len__(self):
+        return len(self.values)
+
+
+class PunchColumns:
+    """Punches as parallel typed arrays, about 20 bytes per punch
+
+    Rows are kept in timestamp order (appends out of order are sorted on the
+    next query), so date ranges are found by binary search. User and device
+    ids are stored once in string tables. With numpy installed, filtering and
+    aggregation run on zero-copy numpy views of the arrays.
+    """
+
+    def __init__(self, users=None, devices=None):
+        self.users = users if users is not None else StringTable()
+        self.devices = devices if devices is not None else StringTable()
+        for name, typecode in COLUMNS.items():
+            setattr(self, name, array(typecode))
+        self._sorted = True
+
+    # -- building ---------------------------------------------------------
+
+    def append(self, device_id, user_id, timestamp, punch=0, status=0, uid=0):
+        """Add one punch; timestamp is a datetime or epoch seconds"""
+        epoch = timestamp if isinstance(timestamp, int) else to_epoch(timestamp)
+        if self._sorted and self.epoch and epoch < self.epoch[-1]:
+            self._sorted = False
+        self.epoch.append(epoch)
+        self.user_index.append(self.users.intern(str(user_id)))
+        self.device_index.append(self.devices.intern(device_id))
+        self.uid.append(uid or 0)
+        self.status.append(status or 0)
+        self.punch.append(punch or 0)
+
+    def extend_records(self, device_id, records):
+        """Add pyzk Attendance records downloaded from a device"""
+        # Bound methods hoisted out of the loop; this runs once per punch
+        epochs, last = self.epoch, (self.epoch[-1] if self.epoch else None)
+        add_epoch, add_user = epochs.append, self.user_index.append
+        add_uid, add_status, add_punch = self.uid.append, self.status.append, self.punch.append
+        intern = self.users.intern
+        device = self.devices.intern(device_id)
+        count = 0
+        for record in records:
+            epoch = (record.timestamp - EPOCH) // ONE_SECOND
+            if last is not None and epoch < last:
+                self._sorted = False
+            last = epoch
+            add_epoch(epoch)
+            add_user(intern(str(record.user_id)))
+            add_uid(record.uid or 0)
+            add_status(record.status or 0)
+            add_punch(record.punch or 0)
+            count += 1
+        self.device_index.extend(array('H', [device]) * count)
+        return self
+
+    @classmethod
+    def from_records(cls, device_id, records):
+        return cls().extend_records(device_id, records)
+
+    def __len__(self):
+        return len(self.epoch)
+
+    @property
+    def nbytes(self):
+        """Memory held by the column arrays (string tables excluded)"""
+        return sum(len(column) * column.itemsize for column in self._columns())
+
+    def _columns(self):
+        return [getattr(self, name) for name in COLUMNS]
+
+    def _view(self, name):
+        """numpy view of a column without copying"""
+        column = getattr(self, name)
+        dtype = DTYPES[column.typecode]
+        return numpy.frombuffer(column, dtype=dtype) if len(column) else numpy.zeros(0, dtype)
+
+    def _ensure_sorted(self):
+        if self._sorted:
+            return
+        if numpy is not None:
+            order = numpy.argsort(self._view('epoch'), kind='stable')
+            for name, typecode in COLUMNS.items():
+                setattr(self, name, array(typecode, self._view(name)[order].tobytes()))
+        else:
+            order = sorted(range(len(self.epoch)), key=self.epoch.__getitem__)
+            for name, typecode in COLUMNS.items():
+                column = getattr(self, name)
+                setattr(self, name, array(typecode, [column[i] for i in order]))
+        self._sorted = True
+
+    def _take(self, positions):
+        """New PunchColumns holding the rows at positions (a slice, index list or numpy array)"""
+        subset = PunchColumns(self.users, self.devices)
+        for name, typecode in COLUMNS.items():
+            if isinstance(positions, slice):
+                setattr(subset, name, getattr(self, name)[positions])
+            elif numpy is not None:
+                setattr(subset, name, array(typecode, self._view(name)[positions].tobytes()))
+            else:
+                column = getattr(self, name)
+                setattr(subset, name, array(typecode, [column[i] for i in positions]))
+        return subset
+
+    # -- queries ----------------------------------------------------------
+
+    def select(self, start_date=None, end_date=None, user_ids=None, device_ids=None):
+        """Punches within an inclusive YYYY-MM-DD range, optionally for some users or devices"""
+        self._ensure_sorted()
+        start, end = day_bounds(start_date, end_date)
+        lo = bisect_left(self.epoch, start) if start is not None else 0
+        hi = bisect_left(self.epoch, end) if end is not None else len(self.epoch)
+        subset = self._take(slice(lo, hi))
+        if user_ids is None and device_ids is None:
+            return subset
+
+        wanted_users = None
+        if user_ids is not None:
+            wanted_users = {self.users.index[str(u)] for u in user_ids if str(u) in self.users.index}
+        wanted_devices = None
+        if device_ids is not None:
+            wanted_devices = {self.devices.index[d] for d in device_ids if d in self.devices.index}
+
+        if numpy is not None:
+            mask = numpy.ones(len(subset), dtype=bool)
+            if wanted_users is not None:
+                mask &= numpy.isin(subset._view('user_index'), list(wanted_users))
+            if wanted_devices is not None:
+                mask &= numpy.isin(subset._view('device_index'), list(wanted_devices))
+            return subset._take(numpy.nonzero(mask)[0])
+
+        positions = [
+            i for i in range(len(subset))
+            if (wanted_users is None or subset.user_index[i] in wanted_users) and
+               (wanted_devices is None or subset.device_index[i] in wanted_devices)
+        ]
+        return subset._take(positions)
+
+    def count_between(self, start_epoch, end_epoch):
+        """Number of punches with start_epoch <= epoch < end_epoch"""
+        self._ensure_sorted()
+        return bisect_left(self.epoch, end_epoch) - bisect_left(self.epoch, start_epoch)
+
+    def by_user(self):
+        """Per-user punch count and first/last punch, keyed by user_id"""
+        self._ensure_sorted()
+        result = {}
+        if numpy is not None and len(self):
+            users = self._view('user_index')
+            epochs = self._view('epoch')
+            # Rows are in time order, so the first and last occurrence are the extremes
+            present, first, counts = numpy.unique(users, return_index=True, return_counts=True)
+            _, last_reversed = numpy.unique(users[::-1], return_index=True)
+            last = len(users) - 1 - last_reversed
+            for index, count, first_row, last_row in zip(present.tolist(), counts.tolist(),
+                                                         first.tolist(), last.tolist()):
+                result[self.users.values[index]] = {
+                    'punch_count': count,
+                    'first': from_epoch(epochs[first_row]),
+                    'last': from_epoch(epochs[last_row])
+                }
+            return result
+
+        for epoch, index in zip(self.epoch, self.user_index):
+            entry = result.get(index)
+            if entry is None:
+                result[index] = [1, epoch, epoch]
+            else:
+                entry[0] += 1
+                entry[2] = epoch
+        return {
+            self.users.values[index]: {'punch_count': count, 'first': from_epoch(first), 'last': from_epoch(last)}
+            for index, (count, first, last) in result.items()
+        }
+
+    def daily(self):
+        """Per (user, day) first punch, last punch, punch count and worked seconds
+
+        Rows match AttendanceStore.daily_summaries(), ordered by day then user.
+        """
+        self._ensure_sorted()
+        groups = {}
+        if numpy is not None and len(self):
+            epochs = self._view('epoch')
+            days = epochs // SECONDS_PER_DAY
+            keys = days * len(self.users) + self._view('user_index')
+            # Stable sort by key keeps time order within each (day, user) group
+            order = numpy.argsort(keys, kind='stable')
+            sorted_keys = keys[order]
+            starts = numpy.flatnonzero(numpy.r_[True, sorted_keys[1:] != sorted_keys[:-1]])
+            ends = numpy.r_[starts[1:], len(sorted_keys)] - 1
+            sorted_epochs = epochs[order]
+            for key, start, end in zip(sorted_keys[starts].tolist(), starts.tolist(), ends.tolist()):
+                groups[divmod(key, len(self.users))] = (end - start + 1, int(sorted_epochs[start]), int(sorted_epochs[end]))
+        else:
+            for epoch, index in zip(self.epoch, self.user_index):
+                key = (epoch // SECONDS_PER_DAY, index)
+                entry = groups.get(key)
+                groups[key] = (1, epoch, epoch) if entry is None else (entry[0] + 1, entry[1], epoch)
+
+        rows = []
+        for (day, index), (count, first, last) in sorted(groups.items(), key=lambda item: (item[0][0], self.users.values[item[0][1]])):
+            rows.append({
+                'user_id': self.users.values[index],
+                'day': from_epoch(day * SECONDS_PER_DAY).strftime('%Y-%m-%d'),
+                'first_in': from_epoch(first).strftime('%Y-%m-%d %H:%M:%S'),
+                'last_out': from_epoch(last).strftime('%Y-%m-%d %H:%M:%S'),
+                'punch_count': count,
+                'worked_seconds': last - first
+            })
+        return rows
+
+    def rows(self):
+        """Iterate (device_id, user_id, timestamp, punch, status, uid) in time order"""
+        self._ensure_sorted()
+        users = self.users.values
+        devices = self.devices.values
+        for epoch, user, device, punch, status, uid in zip(self.epoch, self.user_index, self.device_index,
+                                                          self.punch, self.status, self.uid):
+            yield devices[device], users[user], from_epoch(epoch), punch, status, uid
@@ -0,0 +1,199 @@
+"""
+Request Timing for ZK Attendance System
+Collects per-request timing spans, reports them in a Server-Timing header
+and the log, and captures cProfile profiles of single requests on demand
+"""
+import cProfile
+import hmac
+import logging
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from flask import g, request, has_request_context
+from metrics import add_timing_listener
+
+# Configure logging
+logger = logging.getLogger('request_timing')
+
+# Requests slower than this many seconds are always logged at INFO level
+SLOW_REQUEST_SECONDS = 1.0
+
+# Profiling is disabled unless this environment variable holds a token;
+# a request is profiled when it sends the same token in the X-Profile
+# header or the ?profile= query parameter
+PROFILE_TOKEN_ENV = 'ZK_PROFILE_TOKEN'
+
+# How many saved profiles to keep on disk
+MAX_PROFILES = 20
+
+# Span names for the histograms recorded through metrics.timed()
+SPAN_NAMES = {
+    'zk_device_connect_seconds': 'device_connect',
+    'zk_device_read_seconds': '{operation}',
+    'zk_record_format_seconds': 'format_{stage}',
+    'zk_upstream_post_seconds': 'upstream_{mode}',
+    'zk_config_io_seconds': 'config_{operation}',
+}
+
+
+def add_span(name, seconds):
+    """Add a duration to the current request's span, if there is a request"""
+    if not has_request_context():
+        return
+    spans = g.get('timing_spans')
+    if spans is None:
+        return
+    total, count = spans.get(name, (0.0, 0))
+    spans[name] = (total + seconds, count + 1)
+
+
+@contextmanager
+def span(name):
+    """Time the block as a named span of the current request"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_span(name, time.perf_counter() - start)
+
+
+def _on_timed(histogram, labels, seconds):
+    """metrics.timed() listener turning instrumented blocks into spans"""
+    template = SPAN_NAMES.get(histogram.name)
+    if template:
+        add_span(template.format(**labels), seconds)
+
+
+def server_timing_header(spans, total):
+    """Format spans as a Server-Timing header value (durations in ms)"""
+    parts = []
+    for name, (seconds, count) in spans.items():
+        entry = f"{name};dur={seconds * 1000:.1f}"
+        if count > 1:
+            entry += f';desc="x{count}"'
+        parts.append(entry)
+    parts.append(f"total;dur={total * 1000:.1f}")
+    return ', '.join(parts)
+
+
+class ProfileStore:
+    """Saves cProfile output of profiled requests for later download"""
+
+    def __init__(self, directory=None, max_profiles=MAX_PROFILES):
+        self.directory = directory
+        self.max_profiles = max_profiles
+        self._lock = threading.Lock()
+
+    def save(self, profiler, method, path):
+        """Dump a finished profiler to disk and return the profile name"""
+        os.makedirs(self.directory, exist_ok=True)
+        slug = re.sub(r'[^A-Za-z0-9]+', '_', path).strip('_') or 'root'
+        name = f"{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}-{method}-{slug}.prof"
+        profiler.dump_stats(os.path.join(self.directory, name))
+        self._prune()
+        return name
+
+    def _prune(self):
+        with self._lock:
+            names = sorted(self._names())
+            for name in names[:-self.max_profiles]:
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass
+
+    def _names(self):
+        if not self.directory or not os.path.isdir(self.directory):
+            return []
+        return [name for name in os.listdir(self.directory) if name.endswith('.prof')]
+
+    def list_profiles(self):
+        """Saved profiles, newest first"""
+        profiles = []
+        for name in sorted(self._names(), reverse=True):
+            stat = os.stat(os.path.join(self.directory, name))
+            profiles.append({
+                'name': name,
+                'size': stat.st_size,
+                'created': datetime.fromtimestamp(stat.st_mtime).isoformat()
+            })
+        return profiles
+
+    def path_for(self, name):
+        """Absolute path of a saved profile, None for unknown or unsafe names"""
+        if os.path.basename(name) != name or not name.endswith('.prof'):
+            return None
+        path = os.path.join(self.directory, name)
+        return path if os.path.isfile(path) else None
+
+
+def profiling_token():
+    return os.environ.get(PROFILE_TOKEN_ENV) or None
+
+
+def profiling_authorized():
+    """True when profiling is enabled and the request carries the token"""
+    token = profiling_token()
+    if not token:
+        return False
+    supplied = request.headers.get('X-Profile') or request.args.get('profile') or ''
+    return hmac.compare_digest(supplied, token)
+
+
+def init_app(app, profile_dir):
+    """Register the timing and profiling hooks on the Flask app"""
+    profile_store.directory = profile_dir
+
+    @app.before_request
+    def _start_request_timing():
+        g.timing_start = time.perf_counter()
+        g.timing_spans = {}
+        # Downloading profiles should not produce new ones
+        if profiling_authorized() and not request.path.startswith('/api/profiles'):
+            profiler = cProfile.Profile()
+            g.profiler = profiler
+            profiler.enable()
+
+    @app.after_request
+    def _finish_request_timing(response):
+        start = g.get('timing_start')
+        if start is None:
+            return response
+
+        profiler = g.pop('profiler', None)
+        if profiler is not None:
+            profiler.disable()
+            try:
+                name = profile_store.save(profiler, request.method, request.path)
+                response.headers['X-Profile-Id'] = name
+                logger.info(f"Saved profile {name} for {request.method} {request.path}")
+            except Exception as e:
+                logger.error(f"Error saving profile: {str(e)}")
+
+        total = time.perf_counter() - start
+        spans = g.get('timing_spans') or {}
+        response.headers['Server-Timing'] = server_timing_header(spans, total)
+
+        # Requests that did real work (or were slow) are logged, trivial ones only at DEBUG
+        detail = ' '.join(f"{name}={seconds * 1000:.1f}ms" for name, (seconds, _) in spans.items())
+        level = logging.INFO if spans or total >= SLOW_REQUEST_SECONDS else logging.DEBUG
+        if logger.isEnabledFor(level):
+            logger.log(level, f"{request.method} {request.path} {response.status_code} "
+                              f"total={total * 1000:.1f}ms {detail}".rstrip())
+        return response
+
+    @app.teardown_request
+    def _stop_profiler(exc=None):
+        # after_request is skipped when a request fails with an unhandled error
+        profiler = g.pop('profiler', None) if has_request_context() else None
+        if profiler is not None:
+            profiler.disable()
+
+# Route spans from the existing metrics instrumentation into requests
+add_timing_listener(_on_timed)
+
+# Create a global instance of the profile store
+profile_store = ProfileStore()
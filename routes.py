@@ -1,15 +1,29 @@
-from flask import render_template, redirect, url_for, jsonify, request, session, flash
+from flask import render_template, redirect, url_for, jsonify, request, flash, Response, send_file
 import logging
 import threading
 import os
 import json
-import requests
 from datetime import datetime, timedelta
 from flask import jsonify, request
 
 # Import app but not the other functions to avoid circular imports
-from app import app, logger, connect_to_device, get_config, save_config
+from app import app, logger, device_session, fetch_attendance, fetch_users, fetch_attendance_and_users, get_config, update_config, device_info_response
+from app import device_info_payload, get_punch_type_text, import_requests
+from app import send_attendance, add_users_from_url, get_attendance, filter_attendance_by_date, organize_attendance
 from device_manager import device_manager
+from template_backup import template_backup, BackupNotFoundError
+from health_monitor import health_monitor
+from fleet_scheduler import fleet_scheduler
+from device_leases import device_leases
+from device_retention import device_retention, CLEARED, SKIPPED
+from device_discovery import device_discovery
+from attendance_store import attendance_store
+from stats_engine import stats_engine
+from attendance_export import attendance_exporter, ExportError, FORMATS as EXPORT_FORMATS
+from jobs import job_manager, report_progress
+from conditional import validators
+from metrics import registry as metrics_registry
+from request_timing import span, profile_store, profiling_token, profiling_authorized
 
 @app.route('/api/employees-api-url', methods=['GET'])
 def get_employees_api_url():
@@ -22,9 +36,6 @@ def get_employees_api_url():
         logger.error(f"Error getting employees API URL: {str(e)}")
         return jsonify({"status": "error", "message": str(e)}), 500
 
-# Global variable to track last sync timestamp
-last_sync_timestamp = None
-
 # UI Routes
 @app.route('/')
 def index():
@@ -148,6 +159,11 @@ def spa():
 def send_static(path):
     return app.send_static_file(path)
 
+@app.route('/metrics')
+def metrics():
+    """Expose latency histograms and counters in Prometheus text format"""
+    return Response(metrics_registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
 # API Endpoints
 @app.route('/api/config', methods=['GET'])
 def get_config_api():
@@ -182,47 +198,8 @@ def device_info_api():
                 "message": "No active device selected. Please select a device in the settings."
             }), 400
             
-        # Get device details
-        device = device_manager.get_device(active_device_id)
-        
-        # Return basic info even if we can't connect to the device
-        device_info = {
-            "id": active_device_id,
-            "name": device.get('name', 'Unknown'),
-            "ip": device.get('ip', 'Unknown'),
-            "port": device.get('port', 4370),
-            "last_sync": last_sync_timestamp.isoformat() if last_sync_timestamp else None,
-            "last_connected": device.get('last_connected', None)
-        }
-        
-        # Try to connect to device and get more info
-        try:
-            conn = connect_to_device()
-            try:
-                # Add additional device info
-                device_info.update({
-                    "serial_number": conn.get_serialnumber(),
-                    "firmware_version": conn.get_firmware_version(),
-                    "platform": conn.get_platform(),
-                    "device_name": conn.get_device_name(),
-                    "workcode": conn.get_workcode()
-                })
-            finally:
-                conn.disconnect()
-            
-            # Connection successful
-            return jsonify({
-                "status": "success",
-                "device_info": device_info
-            })
-        except Exception as conn_error:
-            logger.warning(f"Could not connect to device for additional info: {str(conn_error)}")
-            # Return basic info with warning
-            return jsonify({
-                "status": "warning",
-                "device_info": device_info,
-                "message": f"Device configured but connection failed: {str(conn_error)}"
-            })
+        # Answer from the health monitor cache instead of connecting
+        return device_info_response()
     except Exception as e:
         logger.error(f"Error in device info API: {str(e)}")
         return jsonify({
@@ -249,20 +226,16 @@ def users_api():
             }), 400
         
         try:
-            # Connect to device using device manager
-            conn = connect_to_device()
-            try:
-                users = conn.get_users()
-                return jsonify({
-                    "status": "success",
-                    "users": [{
-                        "user_id": user.user_id,
-                        "name": user.name,
-                        "privilege": user.privilege
-                    } for user in users]
-                })
-            finally:
-                conn.disconnect()
+            # Download users through the device manager (shared with concurrent callers)
+            users = fetch_users()
+            return jsonify({
+                "status": "success",
+                "users": [{
+                    "user_id": user.user_id,
+                    "name": user.name,
+                    "privilege": user.privilege
+                } for user in users]
+            })
         except Exception as conn_error:
             logger.error(f"Error connecting to device: {str(conn_error)}")
             return jsonify({"status": "error", "message": f"Error connecting to device: {str(conn_error)}"}), 500
@@ -293,8 +266,7 @@ def delete_user_api(user_id):
             
         try:
             # Connect to device using device manager
-            conn = connect_to_device()
-            try:
+            with device_session() as conn:
                 # Get existing users to verify the user exists
                 users = conn.get_users()
                 user_exists = any(user.user_id == user_id for user in users)
@@ -304,14 +276,13 @@ def delete_user_api(user_id):
                     
                 # Delete the user
                 conn.delete_user(user_id=user_id)
+                validators.invalidate(active_device_id)
                 logger.info(f"User {user_id} deleted successfully")
                 
                 return jsonify({
                     "status": "success",
                     "message": f"User {user_id} deleted successfully"
                 })
-            finally:
-                conn.disconnect()
         except Exception as conn_error:
             logger.error(f"Error connecting to device: {str(conn_error)}")
             return jsonify({"status": "error", "message": f"Error connecting to device: {str(conn_error)}"}), 500
@@ -338,16 +309,12 @@ def attendance_api():
             }), 400
             
         try:
-            # Connect to device using device manager
-            conn = connect_to_device()
+            # Download attendance and users through the device manager
+            attendance, users = fetch_attendance_and_users()
             try:
-                # Get all users to map user_id to names
-                users = conn.get_users()
+                # Map user_id to names
                 user_map = {user.user_id: user.name for user in users}
                 
-                # Get attendance records
-                attendance = conn.get_attendance()
-                
                 # Format records with names
                 formatted_records = []
                 for record in attendance:
@@ -365,8 +332,6 @@ def attendance_api():
             except Exception as conn_error:
                 logger.error(f"Error processing attendance data: {str(conn_error)}")
                 return jsonify({"status": "error", "message": f"Error processing attendance data: {str(conn_error)}"}), 500
-            finally:
-                conn.disconnect()
         except Exception as conn_error:
             logger.error(f"Error connecting to device: {str(conn_error)}")
             return jsonify({"status": "error", "message": f"Error connecting to device: {str(conn_error)}"}), 500
@@ -414,18 +379,22 @@ def connect_api():
         
         # Connect to device using device manager
         try:
-            conn = connect_to_device()
-            try:
+            with device_session() as conn:
                 # Get device info
-                device_info = {
-                    "firmware_version": conn.get_firmware_version(),
-                    "serial_number": conn.get_serialnumber(),
-                    "platform": conn.get_platform(),
-                    "device_name": conn.get_device_name(),
-                    "work_code": conn.get_workcode(),
-                    "users": len(conn.get_users()),
-                    "attendance": len(conn.get_attendance())
-                }
+                with span('device_info'):
+                    device_info = {
+                        "firmware_version": conn.get_firmware_version(),
+                        "serial_number": conn.get_serialnumber(),
+                        "platform": conn.get_platform(),
+                        "device_name": conn.get_device_name(),
+                        # Not every pyzk release implements get_workcode
+                        "work_code": conn.get_workcode() if hasattr(conn, 'get_workcode') else None
+                    }
+                health_monitor.record_metadata(device_id, dict(device_info, workcode=device_info["work_code"]))
+                with span('get_users'):
+                    device_info["users"] = len(conn.get_users())
+                with span('get_attendance'):
+                    device_info["attendance"] = len(conn.get_attendance())
                 
                 logger.info(f"Connected to device at {ip}:{port}")
                 return jsonify({
@@ -434,8 +403,6 @@ def connect_api():
                     "device_info": device_info,
                     "device_id": device_id
                 })
-            finally:
-                conn.disconnect()
         except Exception as conn_error:
             logger.error(f"Error connecting to device: {str(conn_error)}")
             # If connection failed, remove the device if it was just created
@@ -453,6 +420,7 @@ def connect_api():
 
 @app.route('/api/send-attendance', methods=['POST'])
 def send_attendance_api():
+    requests = import_requests()
     try:
         data = request.get_json()
         if not data:
@@ -466,9 +434,7 @@ def send_attendance_api():
         
         # Get attendance records for the date range
         try:
-            conn = connect_to_device()
-            attendance_records = conn.get_attendance()
-            conn.disconnect()
+            attendance_records = fetch_attendance()
             
             if not attendance_records:
                 return jsonify({"status": "success", "message": "No records to send", "sent_count": 0})
@@ -531,46 +497,12 @@ def send_attendance_api():
 
 @app.route('/api/stats', methods=['GET'])
 def stats_api():
+    """Today's attendance statistics from the live counters, without a device download"""
     try:
-        # Check if device is connected
-        if not session.get('device_ip'):
-            return jsonify({
-                "status": "success",
-                "data": {
-                    "today_attendance": 0,
-                    "total_users": 0,
-                    "present_today": 0,
-                    "last_sync": None
-                }
-            })
-        
-        # Connect to device and get data
-        conn = connect_to_device()
-        try:
-            # Get attendance records
-            attendance_records = conn.get_attendance()
-            
-            # Filter for today's records
-            today = datetime.now().strftime('%Y-%m-%d')
-            today_records = [r for r in attendance_records if r.timestamp.strftime('%Y-%m-%d') == today]
-            
-            # Get unique users who checked in today
-            present_users = set(r.user_id for r in today_records)
-            
-            # Get all users
-            users = conn.get_users()
-            
-            return jsonify({
-                "status": "success",
-                "data": {
-                    "today_attendance": len(today_records),
-                    "total_users": len(users),
-                    "present_today": len(present_users),
-                    "last_sync": last_sync_timestamp.isoformat() if last_sync_timestamp else None
-                }
-            })
-        finally:
-            conn.disconnect()
+        return jsonify({
+            "status": "success",
+            "data": stats_engine.get_stats()
+        })
     except Exception as e:
         logger.error(f"Error getting stats: {str(e)}")
         return jsonify({
@@ -579,10 +511,70 @@ def stats_api():
                 "today_attendance": 0,
                 "total_users": 0,
                 "present_today": 0,
-                "last_sync": last_sync_timestamp.isoformat() if last_sync_timestamp else None
+                "last_sync": None
             }
         })
 
+# Seconds stored punches may age before the dashboard reads the device again
+DASHBOARD_MAX_AGE = 60
+
+# Punches listed under recent activity
+RECENT_PUNCHES = 10
+
+@app.route('/api/dashboard', methods=['GET'])
+def dashboard_api():
+    """Device status, today's stats and the latest punches in one response
+
+    Status comes from the health monitor cache, stats from the live counters
+    and punches from the attendance store. The device is read at most once,
+    in a single session shared with concurrent requests, and only when it is
+    reachable and its stored punches are older than DASHBOARD_MAX_AGE
+    seconds (or refresh=1 is given).
+    """
+    try:
+        device_id = device_manager.get_active_device_id()
+        if device_id and not device_manager.get_device(device_id):
+            device_id = None
+        device = device_info_payload() if device_id else None
+        message = None
+
+        if device and device['device_info']['reachable']:
+            state = attendance_store.ingest_status().get(device_id)
+            age = (datetime.now() - datetime.fromisoformat(state['updated_at'])).total_seconds() if state else None
+            if request.args.get('refresh') == '1' or age is None or age > DASHBOARD_MAX_AGE:
+                try:
+                    with span('device'):
+                        fetch_attendance_and_users(device_id)
+                except Exception as e:
+                    logger.warning(f"Dashboard could not refresh device {device_id}: {str(e)}")
+                    message = f"Showing stored data, device read failed: {str(e)}"
+
+        recent = [{
+            "device_id": row['device_id'],
+            "user_id": row['user_id'],
+            "name": row['name'] or "Unknown",
+            "timestamp": row['timestamp'],
+            "punch": get_punch_type_text(row['punch']),
+            "punch_type": row['punch'],
+            "status": row['status']
+        } for row in attendance_store.recent_punches(RECENT_PUNCHES, device_id)]
+        synced = attendance_store.ingest_status().get(device_id) if device_id else None
+
+        payload = {
+            "status": "success",
+            "active_device": device_id,
+            "device": device,
+            "stats": stats_engine.get_stats(),
+            "recent": recent,
+            "synced_at": synced['updated_at'] if synced else None
+        }
+        if message:
+            payload["message"] = message
+        return validators.conditional(jsonify(payload), validators.request_key(device_id))
+    except Exception as e:
+        logger.error(f"Error building dashboard: {str(e)}")
+        return jsonify({"status": "error", "message": str(e)}), 500
+
 @app.route('/api/config-settings', methods=['GET', 'POST'])
 def config_settings_api():
     """API endpoint for managing configuration settings"""
@@ -593,9 +585,6 @@ def config_settings_api():
             if not data:
                 return jsonify({"status": "error", "message": "No data provided"}), 400
 
-            # Get current config
-            config = get_config()
-
             # Extract base_api_url and api_token from the request
             base_api_url = data.get('base_api_url', '').rstrip('/')
             api_token = data.get('api_token', '')
@@ -603,19 +592,18 @@ def config_settings_api():
             if not base_api_url or not api_token:
                 return jsonify({"status": "error", "message": "Both base_api_url and api_token are required."}), 400
 
-            # Store base_api_url and api_token in config
-            config['base_api_url'] = base_api_url
-            config['api_token'] = api_token
-
             # Construct new API URLs
             attendance_api_url = f"{base_api_url}/attendance?token={api_token}"
             employees_api_url = f"{base_api_url}/employees?token={api_token}"
-            config['attendance_api_url'] = attendance_api_url
-            config['employees_api_url'] = employees_api_url
 
-            # Save updated config
-            logger.info(f"Updated config before saving: {config}")
-            save_config(config)
+            # Store base_api_url, api_token and the derived URLs in config
+            config = update_config({
+                'base_api_url': base_api_url,
+                'api_token': api_token,
+                'attendance_api_url': attendance_api_url,
+                'employees_api_url': employees_api_url
+            })
+            logger.info(f"Updated config after saving: {config}")
 
             return jsonify({
                 "status": "success",
@@ -629,7 +617,8 @@ def config_settings_api():
             # Get current config
             config = get_config()
             
-            return jsonify({"status": "success", "config": config})
+            return validators.conditional(jsonify({"status": "success", "config": config}),
+                                          validators.request_key())
         except Exception as e:
             logger.error(f"Error getting configuration: {str(e)}")
             return jsonify({"status": "error", "message": str(e)}), 500
@@ -642,6 +631,7 @@ def export_config_api():
 
 @app.route('/api/test-connection', methods=['POST'])
 def test_connection_api():
+    requests = import_requests()
     try:
         data = request.get_json()
         if not data or not data.get('attendance_api_url'):
@@ -673,11 +663,15 @@ def get_devices_api():
         # Get active device ID
         active_device_id = device_manager.get_active_device_id()
         
-        return jsonify({
+        # Reachability comes from the background health monitor, never a live connect
+        health_monitor.ensure_started()
+        
+        return validators.conditional(jsonify({
             "status": "success",
             "devices": devices,
-            "active_device": active_device_id
-        })
+            "active_device": active_device_id,
+            "health": health_monitor.get_all()
+        }), validators.request_key())
     except Exception as e:
         logger.error(f"Error getting devices: {str(e)}")
         return jsonify({"status": "error", "message": str(e)}), 500
@@ -694,12 +688,14 @@ def add_device_api():
         ip = data.get('ip')
         port = data.get('port', 4370)
         timeout = data.get('timeout', 5)
+        ommit_ping = data.get('ommit_ping', False)
         
         if not device_id or not name or not ip:
             return jsonify({"status": "error", "message": "Device ID, name, and IP address are required"}), 400
         
         # Add device to manager
-        device_manager.add_device(device_id, name, ip, port, timeout)
+        device_manager.add_device(device_id, name, ip, port, timeout, ommit_ping)
+        health_monitor.wake()
         
         # Test connection
         connection_success = device_manager.test_connection(device_id)
@@ -722,6 +718,29 @@ def add_device_api():
         logger.error(f"Error adding device: {str(e)}")
         return jsonify({"status": "error", "message": str(e)}), 500
 
+@app.route('/api/devices/discover', methods=['POST'])
+def discover_devices_api():
+    """Scan a network range for ZK terminals
+    
+    Body: {"cidr": "192.168.1.0/24", "port": 4370}. Unregistered terminals
+    come with a "suggested" body for POST /api/devices. Large ranges can run
+    as a background job of kind "discover_devices" with the same parameters.
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        cidr = data.get('cidr')
+        if not cidr:
+            return jsonify({"status": "error", "message": "A network range (cidr) is required"}), 400
+        
+        try:
+            result = device_discovery.scan(cidr, data.get('port', 4370))
+        except ValueError as e:
+            return jsonify({"status": "error", "message": str(e)}), 400
+        return jsonify({"status": "success", **result})
+    except Exception as e:
+        logger.error(f"Error discovering devices: {str(e)}")
+        return jsonify({"status": "error", "message": str(e)}), 500
+
 @app.route('/api/devices/<device_id>', methods=['GET'])
 def get_device_api(device_id):
     try:
@@ -753,9 +772,11 @@ def update_device_api(device_id):
         ip = data.get('ip', device['ip'])
         port = data.get('port', device['port'])
         timeout = data.get('timeout', device['timeout'])
+        ommit_ping = data.get('ommit_ping', device.get('ommit_ping', False))
         
         # Update device in manager
-        device_manager.add_device(device_id, name, ip, port, timeout)
+        device_manager.add_device(device_id, name, ip, port, timeout, ommit_ping)
+        health_monitor.wake()
         
         return jsonify({
             "status": "success",
@@ -774,6 +795,7 @@ def delete_device_api(device_id):
         
         # Remove device from manager
         device_manager.remove_device(device_id)
+        health_monitor.wake()
         
         return jsonify({
             "status": "success",
@@ -824,3 +846,380 @@ def test_device_connection_api(device_id):
         return jsonify({"status": "error", "message": str(e)}), 500
 
 # Setup API endpoint removed
+
+# Fleet Polling API Endpoints
+
+@app.route('/api/fleet', methods=['GET'])
+def fleet_status_api():
+    """Background polling schedule of every device"""
+    try:
+        return jsonify({"status": "success", "fleet": fleet_scheduler.status()})
+    except Exception as e:
+        logger.error(f"Error getting fleet status: {str(e)}")
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+@app.route('/api/fleet/leases', methods=['GET'])
+def fleet_leases_api():
+    """Instances sharing the devices and the lease each device is held under"""
+    try:
+        return jsonify({"status": "success", "sharding": device_leases.status()})
+    except Exception as e:
+        logger.error(f"Error getting device leases: {str(e)}")
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+@app.route('/api/fleet/<device_id>/poll', methods=['POST'])
+def fleet_poll_api(device_id):
+    """Poll a device as soon as a slot is free instead of waiting for its turn"""
+    try:
+        if not device_manager.get_device(device_id):
+            return jsonify({"status": "error", "message": f"Device {device_id} not found"}), 404
+        if not fleet_scheduler.status()['running']:
+            return jsonify({"status": "error", "message": "Fleet polling is not running in this process"}), 409
+        if not fleet_scheduler.poll_now(device_id):
+            return jsonify({"status": "error", "message": f"Device {device_id} is not scheduled yet"}), 409
+        return jsonify({"status": "success", "message": f"Device {device_id} will be polled next"})
+    except Exception as e:
+        logger.error(f"Error scheduling poll: {str(e)}")
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+# Fingerprint Template Backup API Endpoints
+
+@app.route('/api/templates/backups', methods=['GET'])
+def list_template_backups_api():
+    try:
+        return jsonify({
+            "status": "success",
+            "backups": template_backup.list_backups()
+        })
+    except Exception as e:
+        logger.error(f"Error listing template backups: {str(e)}")
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+@app.route('/api/devices/<device_id>/templates/backup', methods=['POST'])
+def backup_templates_api(device_id):
+    try:
+        if not device_manager.get_device(device_id):
+            return jsonify({"status": "error", "message": f"Device {device_id} not found"}), 404
+        
+        result = template_backup.backup_device(device_id)
+        return jsonify({
+            "status": "success",
+            "message": f"Backed up {result['templates']} templates ({result['changed']} changed)",
+            "backup": result
+        })
+    except Exception as e:
+        logger.error(f"Error backing up templates: {str(e)}")
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+@app.route('/api/devices/<device_id>/templates/restore', methods=['POST'])
+def restore_templates_api(device_id):
+    try:
+        if not device_manager.get_device(device_id):
+            return jsonify({"status": "error", "message": f"Device {device_id} not found"}), 404
+        
+        # Optionally restore another device's backup onto this one (device replacement)
+        data = request.get_json(silent=True) or {}
+        source_device_id = data.get('source_device_id') or device_id
+        
+        result = template_backup.restore_device(device_id, source_device_id)
+        validators.invalidate(device_id)
+        return jsonify({
+            "status": "success",
+            "message": f"Restored {result['users']} users and {result['templates']} templates",
+            "restore": result
+        })
+    except BackupNotFoundError as e:
+        return jsonify({"status": "error", "message": str(e)}), 404
+    except Exception as e:
+        # Includes corrupted blobs in the archive
+        logger.error(f"Error restoring templates: {str(e)}")
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+@app.route('/api/devices/<device_id>/retention/clear', methods=['POST'])
+def clear_device_log_api(device_id):
+    """Clear a device's attendance log now, if every punch on it has been sent
+
+    Ignores the retention window but applies the same watermark check and
+    verification as the automatic runs, and is audited the same way.
+    """
+    try:
+        if not device_manager.get_device(device_id):
+            return jsonify({"status": "error", "message": f"Device {device_id} not found"}), 404
+        
+        audit = device_retention.trim(device_id)
+        if audit['outcome'] == CLEARED:
+            return jsonify({"status": "success", "message": f"Cleared {audit['device_records']} punches", "retention": audit})
+        # Skipped: something on the device has not been sent yet
+        status_code = 409 if audit['outcome'] == SKIPPED else 500
+        return jsonify({"status": "error", "message": audit['detail'], "retention": audit}), status_code
+    except Exception as e:
+        logger.error(f"Error clearing device log: {str(e)}")
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+@app.route('/api/retention', methods=['GET'])
+def retention_log_api():
+    """Retention settings, per-device watermarks and the audit log of clearing runs"""
+    try:
+        device_id = request.args.get('device_id')
+        limit = request.args.get('limit', 50, type=int)
+        devices = [device_id] if device_id else list(device_manager.get_all_devices())
+        watermarks = {
+            device: {
+                "high_water": attendance_store.high_water(device),
+                "sent_through": attendance_store.sent_watermark(device),
+                "cleared_through": attendance_store.trimmed_through(device)
+            }
+            for device in devices
+        }
+        return jsonify({
+            "status": "success",
+            "settings": device_retention.settings(),
+            "devices": watermarks,
+            "log": attendance_store.retention_log(device_id, limit)
+        })
+    except Exception as e:
+        logger.error(f"Error getting retention log: {str(e)}")
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+@app.route('/api/profiles', methods=['GET'])
+def list_profiles_api():
+    """List saved request profiles (requires the ZK_PROFILE_TOKEN token)"""
+    if not profiling_token():
+        return jsonify({"status": "error", "message": "Profiling is disabled, set ZK_PROFILE_TOKEN to enable it"}), 403
+    if not profiling_authorized():
+        return jsonify({"status": "error", "message": "Invalid profiling token"}), 403
+    try:
+        return jsonify({"status": "success", "profiles": profile_store.list_profiles()})
+    except Exception as e:
+        logger.error(f"Error listing profiles: {str(e)}")
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+@app.route('/api/profiles/<name>', methods=['GET'])
+def download_profile_api(name):
+    """Download a saved cProfile dump, readable with pstats or snakeviz"""
+    if not profiling_token():
+        return jsonify({"status": "error", "message": "Profiling is disabled, set ZK_PROFILE_TOKEN to enable it"}), 403
+    if not profiling_authorized():
+        return jsonify({"status": "error", "message": "Invalid profiling token"}), 403
+    path = profile_store.path_for(name)
+    if not path:
+        return jsonify({"status": "error", "message": f"Profile {name} not found"}), 404
+    return send_file(path, as_attachment=True, download_name=name, mimetype='application/octet-stream')
+
+def invalid_date(*values):
+    """The first value that is not a YYYY-MM-DD date, None if all are valid or empty"""
+    for value in values:
+        if value:
+            try:
+                datetime.strptime(value, '%Y-%m-%d')
+            except ValueError:
+                return value
+    return None
+
+def list_arg(name):
+    """Query parameter given repeatedly and/or comma separated, None if absent"""
+    values = [item.strip() for value in request.args.getlist(name) for item in value.split(',') if item.strip()]
+    return values or None
+
+@app.route('/api/attendance/summary', methods=['GET'])
+def attendance_summary_api():
+    """Per-user daily summaries (first in, last out, punches, worked time) for a date range
+    
+    Reads the materialized summary table; pass refresh=1 to pull new punches
+    from the active device first.
+    """
+    try:
+        start_date = request.args.get('start_date')
+        end_date = request.args.get('end_date')
+        user_id = request.args.get('user_id')
+        
+        invalid = invalid_date(start_date, end_date)
+        if invalid:
+            return jsonify({"status": "error", "message": f"Invalid date {invalid}, expected YYYY-MM-DD"}), 400
+        
+        if request.args.get('refresh') in ('1', 'true'):
+            if not device_manager.get_all_devices():
+                return jsonify({"status": "error", "message": "No devices registered. Please add a device in the settings."}), 400
+            fetch_attendance_and_users()
+        
+        summaries = attendance_store.daily_summaries(start_date, end_date, user_id)
+        totals = attendance_store.user_totals(start_date, end_date, user_id)
+        for row in summaries + totals:
+            row['worked_hours'] = round((row['worked_seconds'] or 0) / 3600.0, 2)
+        
+        return jsonify({
+            "status": "success",
+            "start_date": start_date,
+            "end_date": end_date,
+            "summaries": summaries,
+            "totals": totals,
+            "sources": attendance_store.ingest_status()
+        })
+    except Exception as e:
+        logger.error(f"Error getting attendance summary: {str(e)}")
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+@app.route('/api/export', methods=['GET'])
+def export_api():
+    """Download punches from the local attendance store as CSV, XLSX or Parquet
+    
+    Filters: start_date, end_date, user_id and device_id (repeated or comma
+    separated). refresh=1 downloads new punches from the selected devices
+    (the active device by default) first, skipping devices the health
+    monitor reports offline; the fleet poller keeps the others current.
+    Repeated exports are served
+    from a file cache that supports Range requests; a first CSV export is
+    streamed while it is written.
+    """
+    try:
+        fmt = request.args.get('format', 'csv').lower()
+        start_date = request.args.get('start_date')
+        end_date = request.args.get('end_date')
+        user_ids = list_arg('user_id')
+        device_ids = list_arg('device_id')
+        
+        invalid = invalid_date(start_date, end_date)
+        if invalid:
+            return jsonify({"status": "error", "message": f"Invalid date {invalid}, expected YYYY-MM-DD"}), 400
+        attendance_exporter.check_format(fmt)
+        
+        if request.args.get('refresh') in ('1', 'true'):
+            active_device_id = device_manager.get_active_device_id()
+            for device_id in device_ids or ([active_device_id] if active_device_id else []):
+                if not device_manager.get_device(device_id):
+                    continue
+                health = health_monitor.get(device_id)
+                if health and health.get('reachable') is False:
+                    # An offline device would hold the download for its whole timeout
+                    logger.info(f"Not refreshing offline device {device_id} before export")
+                    continue
+                try:
+                    fetch_attendance_and_users(device_id)
+                except Exception as e:
+                    # Export what is already stored rather than failing the whole download
+                    logger.warning(f"Could not refresh device {device_id} before export: {str(e)}")
+        
+        mimetype = EXPORT_FORMATS[fmt][0]
+        download_name = attendance_exporter.filename(fmt, start_date, end_date)
+        key = attendance_exporter.cache_key(fmt, start_date, end_date, user_ids, device_ids)
+        path = attendance_exporter.cached_path(key, fmt)
+        
+        if path is None and fmt == 'csv' and request.range is None:
+            chunks = attendance_exporter.stream_csv(start_date, end_date, user_ids, device_ids)
+            return Response(chunks, mimetype=mimetype, headers={
+                "Content-Disposition": f"attachment; filename={download_name}"
+            })
+        
+        if path is None:
+            path = attendance_exporter.build(fmt, start_date, end_date, user_ids, device_ids)
+        return send_file(path, mimetype=mimetype, as_attachment=True, download_name=download_name,
+                         conditional=True, max_age=0)
+    except ExportError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    except Exception as e:
+        logger.error(f"Error exporting attendance: {str(e)}")
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+# Background jobs
+
+def view_job(view, path, method='GET'):
+    """Job runner that calls a view function with the job parameters as its request
+    
+    POST views receive the parameters as the JSON body, GET views as the
+    query string, so a job returns exactly what the endpoint would. The
+    submitter's device (see submit_job_api) is sent as X-Device-ID.
+    """
+    def run(job, device_id=None, **params):
+        options = {'json': params} if method == 'POST' else {'query_string': params}
+        headers = {'X-Device-ID': device_id} if device_id else {}
+        with app.test_request_context(path, method=method, headers=headers, **options):
+            response = app.make_response(view())
+        return response.status_code, response.get_json(silent=True)
+    return run
+
+def organized_report_job(job, start_date=None, end_date=None, emp_no=None, device_id=None):
+    """Attendance of a date range grouped by user and day"""
+    if not device_manager.get_all_devices():
+        return 400, {"status": "error", "message": "No devices registered. Please add a device in the settings."}
+    
+    report_progress(0.05, "Downloading attendance")
+    records, users = fetch_attendance_and_users(device_id, history=True, start_date=start_date, end_date=end_date)
+    report_progress(0.7, f"Organizing {len(records)} records")
+    
+    records = filter_attendance_by_date(records, start_date, end_date)
+    if emp_no:
+        records = [r for r in records if str(r.user_id) == str(emp_no)]
+    report = organize_attendance(records)
+    
+    names = {user.user_id: user.name for user in users}
+    for user_id, entry in report.items():
+        entry['name'] = names.get(user_id, "Unknown")
+    return 200, {"status": "success", "records": len(records), "report": report}
+
+job_manager.register('send_attendance', view_job(send_attendance, '/api/send-attendance', 'POST'))
+job_manager.register('import_users', view_job(add_users_from_url, '/api/add-users-from-url', 'POST'))
+job_manager.register('attendance', view_job(get_attendance, '/api/attendance'), cacheable=True)
+job_manager.register('attendance_summary', view_job(attendance_summary_api, '/api/attendance/summary'), cacheable=True)
+job_manager.register('organized_report', organized_report_job, cacheable=True)
+job_manager.register('discover_devices', view_job(discover_devices_api, '/api/devices/discover', 'POST'))
+
+@app.route('/api/jobs', methods=['POST'])
+def submit_job_api():
+    """Start a background job and return its id immediately
+    
+    Body: {"kind": "send_attendance", "params": {"start_date": ..., "end_date": ...}}
+    An identical job that is still running, or a cached result of a
+    reportable job, is returned instead of starting a new one. Jobs run
+    against the submitter's active device, which is recorded in the params
+    (and so is part of what makes two jobs identical).
+    """
+    try:
+        data = request.get_json() or {}
+        kind = data.get('kind')
+        if kind not in job_manager.kinds():
+            return jsonify({"status": "error", "message": f"Unknown job kind '{kind}'", "kinds": job_manager.kinds()}), 400
+        
+        params = dict(data.get('params') or {})
+        if not params.get('device_id'):
+            params['device_id'] = device_manager.get_active_device_id()
+        job, reused = job_manager.submit(kind, params)
+        response = jsonify({"status": "success", "reused": reused, "job": job.to_dict()})
+        response.status_code = 200 if job.done else 202
+        response.headers['Location'] = url_for('job_api', job_id=job.id)
+        return response
+    except Exception as e:
+        logger.error(f"Error submitting job: {str(e)}")
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+@app.route('/api/jobs', methods=['GET'])
+def list_jobs_api():
+    try:
+        jobs = [job.to_dict(include_result=False) for job in job_manager.list_jobs()]
+        return jsonify({"status": "success", "jobs": jobs, "kinds": job_manager.kinds()})
+    except Exception as e:
+        logger.error(f"Error listing jobs: {str(e)}")
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def job_api(job_id):
+    """Job status and progress; includes the result once the job has finished"""
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({"status": "error", "message": f"Job {job_id} not found"}), 404
+    return jsonify({"status": "success", "job": job.to_dict()})
+
+@app.route('/api/jobs/<job_id>/events', methods=['GET'])
+def job_events_api(job_id):
+    """Server-Sent Events stream of a job's progress, ending with a done event"""
+    if job_manager.get(job_id) is None:
+        return jsonify({"status": "error", "message": f"Job {job_id} not found"}), 404
+    return Response(job_manager.events(job_id), mimetype='text/event-stream',
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.route('/api/jobs/<job_id>', methods=['DELETE'])
+def cancel_job_api(job_id):
+    """Cancel a queued job, or ask a running one to stop at its next progress report"""
+    job = job_manager.cancel(job_id)
+    if job is None:
+        return jsonify({"status": "error", "message": f"Job {job_id} not found"}), 404
+    return jsonify({"status": "success", "job": job.to_dict(include_result=False)})
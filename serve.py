@@ -0,0 +1,156 @@
+"""
+Production Server for ZK Attendance System
+Serves the app with waitress and runs the background device work either
+in the same process or in a separate worker process
+
+Usage:
+    python serve.py                          # web server and background work in one process
+    python serve.py --threads 32 --port 8080
+    python serve.py --host 0.0.0.0           # reachable from the network, see below
+    python serve.py --role worker            # background device work only
+    python serve.py --role web               # web server only, follows the worker
+                                             # (several need sticky sessions, see below)
+    python serve.py --role worker --shard    # one of several workers splitting the devices
+
+Every option can also be set through the environment (ZK_HOST, ZK_PORT,
+ZK_THREADS, ZK_CONNECTION_LIMIT, ZK_ROLE). The server only listens on
+127.0.0.1 unless a host is given: the app has no authentication, so
+listening on the network lets anyone there clear device logs, restore
+templates, delete users and scan the network. Several --role web processes
+share config.json, the attendance database and the session secret key,
+and read device health published by the --role worker process, but
+background jobs (/api/jobs and their event streams) only exist in the
+process that started them: behind a reverse proxy they need sticky
+sessions (the same client always reaching the same process), otherwise
+job polling answers 404. With --shard, several worker (or all)
+processes split the devices between them through leases in leases.db and
+take over the devices of a process that stops (ZK_SHARDING=1,
+ZK_INSTANCE_ID).
+"""
+import argparse
+import logging
+import os
+import signal
+import sys
+import threading
+
+# Configure logging
+logger = logging.getLogger('serve')
+
+# Local only, as app.run() always was; the app has no login, so serving the
+# LAN (--host 0.0.0.0 or ZK_HOST) exposes every device operation to it
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 5000
+# Device reads block a thread for seconds, so run more threads than cores
+DEFAULT_THREADS = 16
+DEFAULT_CONNECTION_LIMIT = 200
+ROLES = ('all', 'web', 'worker')
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the ZK Attendance System with waitress")
+    parser.add_argument('--host', default=os.environ.get('ZK_HOST', DEFAULT_HOST),
+                        help="Interface to listen on (default 127.0.0.1; 0.0.0.0 serves the whole network)")
+    parser.add_argument('--port', type=int, default=int(os.environ.get('ZK_PORT', DEFAULT_PORT)))
+    parser.add_argument('--threads', type=int, default=int(os.environ.get('ZK_THREADS', DEFAULT_THREADS)),
+                        help="Request worker threads")
+    parser.add_argument('--connection-limit', type=int,
+                        default=int(os.environ.get('ZK_CONNECTION_LIMIT', DEFAULT_CONNECTION_LIMIT)),
+                        help="Open connections accepted before new ones wait")
+    parser.add_argument('--role', choices=ROLES, default=os.environ.get('ZK_ROLE', 'all'),
+                        help="all: web and background work; web: requests only; worker: background work only")
+    parser.add_argument('--shard', action='store_true', default=os.environ.get('ZK_SHARDING') == '1',
+                        help="Share the devices with other --shard processes through leases")
+    parser.add_argument('--instance-id', default=os.environ.get('ZK_INSTANCE_ID'),
+                        help="Name of this process in the lease table (default host-pid)")
+    return parser.parse_args(argv)
+
+
+def start_polling(args):
+    """Start fleet polling, first joining the lease table when sharded"""
+    from device_leases import device_leases
+    from fleet_scheduler import fleet_scheduler
+
+    if args.shard:
+        device_leases.start(args.instance_id)
+    fleet_scheduler.start()
+
+
+def stop_polling():
+    from device_leases import device_leases
+    from fleet_scheduler import fleet_scheduler
+
+    fleet_scheduler.stop()
+    # Hands this process's devices to the other shards straight away
+    device_leases.stop(timeout=5)
+
+
+def run_worker(args):
+    """Probe and poll devices and publish their health until interrupted"""
+    from health_monitor import health_monitor
+
+    stop = threading.Event()
+    for name in ('SIGINT', 'SIGTERM'):
+        if hasattr(signal, name):
+            signal.signal(getattr(signal, name), lambda *_: stop.set())
+
+    health_monitor.share_snapshot()
+    # Leases first, so the first probe round only covers this shard's devices
+    start_polling(args)
+    health_monitor.start()
+    logger.info("Background worker running")
+    print("ZK Attendance worker running, press Ctrl+C to stop")
+    while not stop.wait(1):
+        pass
+    stop_polling()
+    health_monitor.stop()
+
+
+def run_web(args):
+    try:
+        from waitress import serve
+    except ImportError:
+        sys.exit("waitress is not installed: pip install waitress")
+
+    from app import app
+
+    logger.info(f"Serving on {args.host}:{args.port} with {args.threads} threads (role {args.role})")
+    print(f"ZK Attendance System serving on http://{args.host}:{args.port} ({args.threads} threads)")
+    serve(app, host=args.host, port=args.port, threads=args.threads,
+          connection_limit=args.connection_limit, ident='zk-attendance')
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    # Importing app configures logging, the config directory and the routes
+    from app import app
+    from device_manager import device_manager
+    from health_monitor import health_monitor
+
+    if args.role == 'worker':
+        run_worker(args)
+        return
+
+    if args.role == 'web':
+        health_monitor.follow_snapshot()
+        # Other web processes may add or change devices
+        @app.before_request
+        def reload_devices():
+            device_manager.reload_if_changed()
+        run_web(args)
+        return
+
+    if args.shard:
+        # Health of the devices leased by other shards comes from their snapshot
+        health_monitor.share_snapshot()
+    start_polling(args)
+    health_monitor.start()
+    try:
+        run_web(args)
+    finally:
+        stop_polling()
+
+
+if __name__ == '__main__':
+    main()
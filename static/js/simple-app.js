@@ -18,8 +18,10 @@ const app = {
         // Load the initial page (from hash or default to dashboard)
         this.loadPageFromHash();
         
-        // Check device connection status
-        this.checkConnectionStatus();
+        // The dashboard reports the connection status with its own data
+        if (this.currentPage !== 'dashboard') {
+            this.checkConnectionStatus();
+        }
     },
     
     // Set up navigation
@@ -118,6 +120,35 @@ const app = {
         }, 5000);
     },
     
+    // Validators and bodies of conditional GET responses, by URL
+    validators: {},
+    
+    // GET JSON, revalidating a previously fetched body with its ETag/Last-Modified;
+    // a 304 reuses the body kept from the last full response
+    fetchJSON: function(url) {
+        const cached = this.validators[url];
+        const headers = {};
+        if (cached) {
+            if (cached.etag) headers['If-None-Match'] = cached.etag;
+            if (cached.lastModified) headers['If-Modified-Since'] = cached.lastModified;
+        }
+        
+        return fetch(url, { headers: headers, cache: 'no-store' })
+            .then(response => {
+                if (response.status === 304 && cached) {
+                    return cached.data;
+                }
+                return response.json().then(data => {
+                    const etag = response.headers.get('ETag');
+                    const lastModified = response.headers.get('Last-Modified');
+                    if (response.ok && (etag || lastModified)) {
+                        this.validators[url] = { etag: etag, lastModified: lastModified, data: data };
+                    }
+                    return data;
+                });
+            });
+    },
+    
     // Check connection status
     checkConnectionStatus: function() {
         console.log('Checking device connection status...');
@@ -212,179 +243,147 @@ const app = {
     
     // Initialize dashboard page
     initDashboard: function() {
-        // Check if device is connected
-        this.checkConnectionStatus();
-        
-        // Load dashboard data
-        this.loadDashboardStats();
-        this.loadDeviceInfo();
-        this.loadRecentActivity();
+        // Device status, stats and recent activity all come from one request
+        this.loadDashboard();
         
         // Set up refresh buttons
         const refreshDeviceBtn = document.getElementById('refresh-device');
         if (refreshDeviceBtn) {
             refreshDeviceBtn.addEventListener('click', () => {
-                this.loadDeviceInfo();
+                this.loadDashboard();
             });
         }
         
         const refreshActivityBtn = document.getElementById('refresh-activity');
         if (refreshActivityBtn) {
             refreshActivityBtn.addEventListener('click', () => {
-                this.loadRecentActivity();
+                this.loadDashboard(true);
             });
         }
     },
     
-    // Load dashboard stats
-    loadDashboardStats: function() {
-        fetch('/api/stats')
-            .then(response => response.json())
+    // Load the dashboard; refresh asks the server to read the device now
+    loadDashboard: function(refresh = false) {
+        const loadingIndicator = document.getElementById('activity-loading');
+        const noActivity = document.getElementById('no-activity');
+        if (loadingIndicator) loadingIndicator.classList.remove('d-none');
+        if (noActivity) noActivity.classList.add('d-none');
+        
+        this.fetchJSON(refresh ? '/api/dashboard?refresh=1' : '/api/dashboard')
             .then(data => {
-                if (data.status === 'success') {
-                    // Update today's attendance count
-                    const todayAttendance = document.getElementById('today-attendance');
-                    if (todayAttendance) {
-                        todayAttendance.textContent = data.data.today_attendance;
-                    }
-                    
-                    // Update last sync time if available
-                    if (data.data.last_sync) {
-                        const lastSyncTime = document.getElementById('last-sync-time');
-                        if (lastSyncTime) {
-                            lastSyncTime.textContent = new Date(data.data.last_sync).toLocaleString();
-                        }
-                    }
+                if (data.status !== 'success') {
+                    throw new Error(data.message || 'Dashboard request failed');
                 }
+                
+                this.isConnected = !!(data.device && data.device.status === 'success');
+                this.updateConnectionStatus();
+                
+                this.renderDashboardStats(data.stats || {});
+                this.renderDeviceInfo(data.device ? data.device.device_info : null);
+                this.renderRecentActivity(data.recent || []);
             })
             .catch(error => {
-                console.error('Error loading stats:', error);
+                console.error('Error loading dashboard:', error);
+                this.isConnected = false;
+                this.updateConnectionStatus();
+                
+                if (loadingIndicator) loadingIndicator.classList.add('d-none');
+                if (noActivity) {
+                    noActivity.classList.remove('d-none');
+                    noActivity.innerHTML = `
+                        <i class="bi bi-exclamation-triangle text-danger fs-1"></i>
+                        <p class="mt-2">Error loading activity: ${error.message}</p>
+                        <button class="btn btn-sm btn-primary mt-2" onclick="app.loadDashboard(true)">
+                            <i class="bi bi-arrow-clockwise"></i> Retry
+                        </button>
+                    `;
+                }
             });
     },
     
-    // Load device info
-    loadDeviceInfo: function() {
+    // Show dashboard stats
+    renderDashboardStats: function(stats) {
+        // Update today's attendance count
+        const todayAttendance = document.getElementById('today-attendance');
+        if (todayAttendance) {
+            todayAttendance.textContent = stats.today_attendance || 0;
+        }
+        
+        // Update last sync time if available
+        if (stats.last_sync) {
+            const lastSyncTime = document.getElementById('last-sync-time');
+            if (lastSyncTime) {
+                lastSyncTime.textContent = new Date(stats.last_sync).toLocaleString();
+            }
+        }
+    },
+    
+    // Show device info
+    renderDeviceInfo: function(deviceInfo) {
         const deviceIpDisplay = document.getElementById('device-ip-display');
         const devicePortDisplay = document.getElementById('device-port-display');
         const deviceSerial = document.getElementById('device-serial');
         
-        if (!deviceIpDisplay && !deviceSerial) return;
-        
-        fetch('/api/device-info')
-            .then(response => response.json())
-            .then(data => {
-                if (data.status === 'success') {
-                    const deviceInfo = data.device_info || {};
-                    
-                    if (deviceIpDisplay) deviceIpDisplay.textContent = deviceInfo.ip || '-';
-                    if (devicePortDisplay) devicePortDisplay.textContent = deviceInfo.port || '-';
-                    if (deviceSerial) deviceSerial.textContent = deviceInfo.serial_number || '-';
-                    
-                    // Update last sync time
-                    const lastSyncTime = document.getElementById('last-sync-time');
-                    if (lastSyncTime && deviceInfo.last_sync) {
-                        lastSyncTime.textContent = new Date(deviceInfo.last_sync).toLocaleString();
-                    }
-                }
-            })
-            .catch(error => {
-                console.error('Error loading device info:', error);
-            });
+        deviceInfo = deviceInfo || {};
+        if (deviceIpDisplay) deviceIpDisplay.textContent = deviceInfo.ip || '-';
+        if (devicePortDisplay) devicePortDisplay.textContent = deviceInfo.port || '-';
+        if (deviceSerial) deviceSerial.textContent = deviceInfo.serial_number || '-';
     },
     
-    // Load recent activity
-    loadRecentActivity: function() {
+    // Show recent activity (records arrive newest first)
+    renderRecentActivity: function(records) {
         const activityTable = document.getElementById('activity-table');
         const loadingIndicator = document.getElementById('activity-loading');
         const noActivity = document.getElementById('no-activity');
         
         if (!activityTable || !loadingIndicator || !noActivity) return;
         
-        // Clear previous data
         activityTable.innerHTML = '';
+        loadingIndicator.classList.add('d-none');
         
-        // Show loading indicator
-        loadingIndicator.classList.remove('d-none');
-        noActivity.classList.add('d-none');
+        if (records.length === 0) {
+            noActivity.classList.remove('d-none');
+            return;
+        }
         
-        fetch('/api/attendance')
-            .then(response => response.json())
-            .then(data => {
-                loadingIndicator.classList.add('d-none');
-                
-                if (data.status === 'success') {
-                    const records = data.attendance || [];
-                    
-                    if (records.length === 0) {
-                        noActivity.classList.remove('d-none');
-                        return;
-                    }
-                    
-                    // Sort records by timestamp (newest first)
-                    const sortedRecords = [...records].sort((a, b) => {
-                        return new Date(b.timestamp) - new Date(a.timestamp);
-                    });
-                    
-                    // Display only the most recent 10 records
-                    const recentRecords = sortedRecords.slice(0, 10);
-                    
-                    recentRecords.forEach(record => {
-                        const row = document.createElement('tr');
-                        
-                        // User ID
-                        const userIdCell = document.createElement('td');
-                        userIdCell.textContent = record.user_id;
-                        row.appendChild(userIdCell);
-                        
-                        // Name
-                        const nameCell = document.createElement('td');
-                        nameCell.textContent = record.name || 'Unknown';
-                        row.appendChild(nameCell);
-                        
-                        // Date & Time
-                        const timeCell = document.createElement('td');
-                        const time = new Date(record.timestamp);
-                        timeCell.textContent = time.toLocaleString();
-                        row.appendChild(timeCell);
-                        
-                        // Punch Type
-                        const typeCell = document.createElement('td');
-                        const punchValue = record.punch || record.punch_type;
-                        let badgeClass = 'bg-secondary';
-                        let punchText = 'Unknown';
-                        
-                        if (punchValue === 0 || punchValue === '0') {
-                            badgeClass = 'bg-success';
-                            punchText = 'Check In';
-                        } else if (punchValue === 1 || punchValue === '1') {
-                            badgeClass = 'bg-danger';
-                            punchText = 'Check Out';
-                        }
-                        
-                        typeCell.innerHTML = `<span class="badge ${badgeClass}">${punchText}</span>`;
-                        row.appendChild(typeCell);
-                        
-                        activityTable.appendChild(row);
-                    });
-                } else {
-                    noActivity.classList.remove('d-none');
-                }
-            })
-            .catch(error => {
-                console.error('Error loading recent activity:', error);
-                loadingIndicator.classList.add('d-none');
-                noActivity.classList.remove('d-none');
-                
-                if (noActivity) {
-                    noActivity.innerHTML = `
-                        <i class="bi bi-exclamation-triangle text-danger fs-1"></i>
-                        <p class="mt-2">Error loading activity: ${error.message}</p>
-                        <button class="btn btn-sm btn-primary mt-2" onclick="app.loadRecentActivity()">
-                            <i class="bi bi-arrow-clockwise"></i> Retry
-                        </button>
-                    `;
-                }
-            });
+        records.forEach(record => {
+            const row = document.createElement('tr');
+            
+            // User ID
+            const userIdCell = document.createElement('td');
+            userIdCell.textContent = record.user_id;
+            row.appendChild(userIdCell);
+            
+            // Name
+            const nameCell = document.createElement('td');
+            nameCell.textContent = record.name || 'Unknown';
+            row.appendChild(nameCell);
+            
+            // Date & Time
+            const timeCell = document.createElement('td');
+            const time = new Date(record.timestamp);
+            timeCell.textContent = time.toLocaleString();
+            row.appendChild(timeCell);
+            
+            // Punch Type
+            const typeCell = document.createElement('td');
+            const punchValue = record.punch || record.punch_type;
+            let badgeClass = 'bg-secondary';
+            let punchText = 'Unknown';
+            
+            if (punchValue === 0 || punchValue === '0') {
+                badgeClass = 'bg-success';
+                punchText = 'Check In';
+            } else if (punchValue === 1 || punchValue === '1') {
+                badgeClass = 'bg-danger';
+                punchText = 'Check Out';
+            }
+            
+            typeCell.innerHTML = `<span class="badge ${badgeClass}">${punchText}</span>`;
+            row.appendChild(typeCell);
+            
+            activityTable.appendChild(row);
+        });
     },
     
     // Initialize connect page
@@ -518,8 +517,7 @@ const app = {
         noData.classList.add('d-none');
         
         // Fetch data
-        fetch(`/api/attendance?start_date=${startDate}&end_date=${endDate}`)
-            .then(response => response.json())
+        this.fetchJSON(`/api/attendance?start_date=${startDate}&end_date=${endDate}`)
             .then(data => {
                 previewLoading.classList.add('d-none');
                 
@@ -693,8 +691,7 @@ const app = {
         
         if (!apiUrlInput) return;
         
-        fetch('/api/export-config')
-            .then(response => response.json())
+        this.fetchJSON('/api/export-config')
             .then(data => {
                 if (data.status === 'success') {
                     const config = data.config || {};
@@ -309,3 +309,32 @@ function showNotification(message, type = 'info') {
         setTimeout(() => notification.remove(), 300);
     }, 5000);
 }
+
+// Run a background job and resolve with the endpoint's JSON result
+// onProgress(fraction, message) is called while the job runs
+async function runJob(kind, params, onProgress) {
+    const submit = await fetch('/api/jobs', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ kind: kind, params: params })
+    });
+    const submitted = await submit.json();
+    if (submitted.status !== 'success') {
+        return { status: 'error', message: submitted.message };
+    }
+    
+    let job = submitted.job;
+    while (!['succeeded', 'failed', 'cancelled'].includes(job.status)) {
+        if (onProgress) onProgress(job.progress, job.message);
+        await new Promise(resolve => setTimeout(resolve, 1000));
+        const response = await fetch(`/api/jobs/${job.id}`);
+        const data = await response.json();
+        if (data.status !== 'success') {
+            return { status: 'error', message: data.message };
+        }
+        job = data.job;
+    }
+    
+    if (job.result) return job.result;
+    return { status: 'error', message: job.error || `Job ${job.status}` };
+}
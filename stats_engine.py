@@ -0,0 +1,127 @@
+"""
+Stats Engine for ZK Attendance System
+Keeps today's attendance counters up to date from newly ingested punches
+so dashboard statistics never need a device download
+"""
+import logging
+import threading
+from datetime import datetime
+from attendance_store import attendance_store
+
+# Configure logging
+logger = logging.getLogger('stats_engine')
+
+
+class StatsEngine:
+    """Live counters for today's punches, present users and known users
+
+    The engine listens to the attendance store: every download reports the
+    punches at or after the device's high-water mark, and the ones dated
+    today are added to a set keyed by (device, user, timestamp), so punches
+    reported twice are only counted once. Reading the stats is O(1). When the
+    date changes the counters are rebuilt from the store's punches for the
+    new day, which also picks up punches stored before midnight that were
+    already dated the next day.
+
+    Punches stored by another process (the fleet polling worker, see
+    serve.py) do not reach the listener; get_stats compares the store's
+    version with the one last seen here and re-seeds the counters from the
+    store when it moved.
+    """
+
+    def __init__(self, store=attendance_store):
+        self.store = store
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._day = None
+        self._punches = set()
+        self._present = set()
+        # device_id -> user ids of its latest user download; None holds the
+        # users remembered by the store until a device reports its own
+        self._users = {}
+        self._total_users = 0
+        self._last_sync = None
+        self._version = None
+        store.add_listener(self._on_ingest)
+
+    def _load_day(self, day):
+        """Rebuild today's counters from the store (caller holds the lock)"""
+        self._day = day
+        self._punches = set(self.store.punches_on(day))
+        self._present = {user_id for _, user_id, _ in self._punches}
+
+    def _load_last_sync(self):
+        """Latest ingest time of any device (caller holds the lock)"""
+        synced = [state['updated_at'] for state in self.store.ingest_status().values()]
+        if synced:
+            last_sync = datetime.fromisoformat(max(synced))
+            if self._last_sync is None or last_sync > self._last_sync:
+                self._last_sync = last_sync
+
+    def _ensure_loaded(self):
+        """Seed from the store on first use and roll over at midnight (caller holds the lock)"""
+        today = datetime.now().strftime('%Y-%m-%d')
+        if not self._loaded:
+            self._version = self.store.version()
+            self._load_day(today)
+            if not self._users:
+                self._users[None] = set(self.store.user_ids())
+                self._count_users()
+            self._load_last_sync()
+            self._loaded = True
+        elif self._day != today:
+            logger.info(f"Rolling attendance stats over to {today}")
+            self._load_day(today)
+
+    def _follow_store(self):
+        """Re-seed from the store after another process stored data (caller holds the lock)"""
+        version = self.store.version()
+        if version == self._version:
+            return
+        users_changed = self._version is None or version[2] != self._version[2]
+        self._version = version
+        self._load_day(self._day)
+        self._load_last_sync()
+        if users_changed:
+            # Users downloaded elsewhere are only known through the store
+            self._users = {None: set(self.store.user_ids())}
+            self._count_users()
+
+    def _on_ingest(self, device_id, punches=None, users=None):
+        """attendance_store listener"""
+        with self._lock:
+            self._ensure_loaded()
+            if punches is not None:
+                for row in punches:
+                    if row[3] == self._day:
+                        self._punches.add(row[:3])
+                        self._present.add(row[1])
+                self._last_sync = datetime.now()
+            if users is not None:
+                self._users.pop(None, None)
+                self._users[device_id] = {user_id for user_id, _ in users}
+                self._count_users()
+            # Our own ingest needs no re-seed
+            self._version = self.store.version()
+
+    def _count_users(self):
+        """Distinct users across the latest download of every device (caller holds the lock)"""
+        if len(self._users) == 1:
+            self._total_users = len(next(iter(self._users.values())))
+        else:
+            self._total_users = len(set().union(*self._users.values()))
+
+    def get_stats(self):
+        """Today's attendance count, total users, users present today and last sync time"""
+        with self._lock:
+            self._ensure_loaded()
+            self._follow_store()
+            return {
+                "today_attendance": len(self._punches),
+                "total_users": self._total_users,
+                "present_today": len(self._present),
+                "last_sync": self._last_sync.isoformat() if self._last_sync else None
+            }
+
+# Create a global instance of the stats engine
+stats_engine = StatsEngine()
@@ -0,0 +1,249 @@
+"""
+Fingerprint Template Backup for ZK Attendance System
+Bulk-reads templates from a device into a compressed, content-addressed
+local archive and restores them to a new or reset device
+"""
+import logging
+import json
+import os
+import hashlib
+import zlib
+from datetime import datetime
+from zk.user import User
+from zk.finger import Finger
+
+from device_manager import device_manager, APP_CONFIG_DIR
+
+# Configure logging
+logger = logging.getLogger('template_backup')
+
+# Archive layout:
+#   template_archive/objects/<hh>/<sha256>.z   zlib-compressed raw template
+#   template_archive/devices/<device_id>.json  manifest of users and templates
+ARCHIVE_DIR = os.path.join(APP_CONFIG_DIR, 'template_archive')
+
+# Compression level for template blobs (templates are small, favour ratio)
+COMPRESSION_LEVEL = 9
+
+
+def _template_key(uid, fid):
+    """Manifest key for a single finger of a user"""
+    return f"{uid}:{fid}"
+
+
+class BackupNotFoundError(LookupError):
+    """Raised when the device or the template backup to restore does not exist"""
+    pass
+
+
+class TemplateArchive:
+    """Content-addressed store of compressed fingerprint templates"""
+
+    def __init__(self, archive_dir=ARCHIVE_DIR):
+        self.archive_dir = archive_dir
+        self.objects_dir = os.path.join(archive_dir, 'objects')
+        self.devices_dir = os.path.join(archive_dir, 'devices')
+
+    def _object_path(self, digest):
+        return os.path.join(self.objects_dir, digest[:2], f"{digest}.z")
+
+    def _manifest_path(self, device_id):
+        # Device IDs come from user input, keep them filesystem safe
+        safe_id = ''.join(c if c.isalnum() or c in '-_' else '_' for c in str(device_id))
+        return os.path.join(self.devices_dir, f"{safe_id}.json")
+
+    def put_blob(self, data):
+        """Store a template blob, returns (digest, written)
+
+        Blobs are addressed by the SHA-256 of the raw template, so an
+        unchanged template is never written twice.
+        """
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._object_path(digest)
+        if os.path.exists(path):
+            return digest, False
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(zlib.compress(data, COMPRESSION_LEVEL))
+        os.replace(tmp_path, path)
+        return digest, True
+
+    def get_blob(self, digest):
+        """Load and decompress a template blob, verifying its digest"""
+        with open(self._object_path(digest), 'rb') as f:
+            data = zlib.decompress(f.read())
+        if hashlib.sha256(data).hexdigest() != digest:
+            raise ValueError(f"Template blob {digest} is corrupted")
+        return data
+
+    def load_manifest(self, device_id):
+        """Load the manifest for a device, or None if never backed up"""
+        path = self._manifest_path(device_id)
+        if not os.path.exists(path):
+            return None
+        with open(path, 'r') as f:
+            return json.load(f)
+
+    def save_manifest(self, device_id, manifest):
+        """Atomically replace the manifest for a device"""
+        os.makedirs(self.devices_dir, exist_ok=True)
+        path = self._manifest_path(device_id)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f, indent=4)
+        os.replace(tmp_path, path)
+
+    def list_manifests(self):
+        """Summaries of all device manifests in the archive"""
+        summaries = []
+        if not os.path.isdir(self.devices_dir):
+            return summaries
+        for name in sorted(os.listdir(self.devices_dir)):
+            if not name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self.devices_dir, name), 'r') as f:
+                    manifest = json.load(f)
+                summaries.append({
+                    'device_id': manifest.get('device_id'),
+                    'updated_at': manifest.get('updated_at'),
+                    'users': len(manifest.get('users', {})),
+                    'templates': len(manifest.get('templates', {}))
+                })
+            except Exception as e:
+                logger.warning(f"Skipping unreadable manifest {name}: {str(e)}")
+        return summaries
+
+
+class TemplateBackupService:
+    """Backs up and restores fingerprint templates for registered devices"""
+
+    def __init__(self, archive=None):
+        self.archive = archive or TemplateArchive()
+
+    def backup_device(self, device_id):
+        """Incrementally back up users and templates from a device
+
+        Reads all templates in a single bulk transfer and only writes blobs
+        for templates whose content is not already in the archive.
+        """
+        if not device_manager.get_device(device_id):
+            raise BackupNotFoundError(f"Device {device_id} not found")
+
+        with device_manager.device_session(device_id, set_active=False) as conn:
+            conn.disable_device()
+            try:
+                users = conn.get_users()
+                fingers = conn.get_templates()
+            finally:
+                conn.enable_device()
+
+        previous = self.archive.load_manifest(device_id) or {}
+        previous_templates = previous.get('templates', {})
+
+        templates = {}
+        written = 0
+        changed = 0
+        for finger in fingers:
+            digest, is_new = self.archive.put_blob(finger.template)
+            if is_new:
+                written += 1
+            key = _template_key(finger.uid, finger.fid)
+            if previous_templates.get(key, {}).get('hash') != digest:
+                changed += 1
+            templates[key] = {
+                'uid': finger.uid,
+                'fid': finger.fid,
+                'valid': finger.valid,
+                'size': finger.size,
+                'hash': digest
+            }
+
+        removed = len(set(previous_templates) - set(templates))
+        manifest = {
+            'device_id': device_id,
+            'updated_at': datetime.now().isoformat(),
+            'users': {
+                str(user.uid): {
+                    'uid': user.uid,
+                    'name': user.name,
+                    'privilege': user.privilege,
+                    'password': user.password,
+                    'group_id': user.group_id,
+                    'user_id': user.user_id,
+                    'card': user.card
+                } for user in users
+            },
+            'templates': templates
+        }
+        self.archive.save_manifest(device_id, manifest)
+
+        logger.info(f"Template backup for device {device_id}: {len(templates)} templates, "
+                    f"{changed} changed, {removed} removed, {written} new blobs")
+        return {
+            'device_id': device_id,
+            'users': len(users),
+            'templates': len(templates),
+            'changed': changed,
+            'removed': removed,
+            'blobs_written': written
+        }
+
+    def restore_device(self, target_device_id, source_device_id=None):
+        """Write archived users and templates to a device in one session
+
+        The source defaults to the target itself, which covers restoring a
+        device after a reset. Pass another device ID to clone onto a
+        replacement terminal.
+        """
+        source_device_id = source_device_id or target_device_id
+        if not device_manager.get_device(target_device_id):
+            raise BackupNotFoundError(f"Device {target_device_id} not found")
+
+        manifest = self.archive.load_manifest(source_device_id)
+        if not manifest:
+            raise BackupNotFoundError(f"No template backup found for device {source_device_id}")
+
+        fingers_by_uid = {}
+        for entry in manifest.get('templates', {}).values():
+            template = self.archive.get_blob(entry['hash'])
+            fingers_by_uid.setdefault(entry['uid'], []).append(
+                Finger(entry['uid'], entry['fid'], entry['valid'], template))
+
+        user_templates = []
+        for user_data in manifest.get('users', {}).values():
+            user = User.json_unpack(user_data)
+            user_templates.append((user, fingers_by_uid.get(user.uid, [])))
+
+        with device_manager.device_session(target_device_id, set_active=False) as conn:
+            conn.disable_device()
+            try:
+                bulk_save = getattr(conn, 'HR_save_usertemplates', None)
+                if bulk_save:
+                    # Newer pyzk releases write every user in a single buffer
+                    bulk_save([[user, fingers] for user, fingers in user_templates])
+                else:
+                    for user, fingers in user_templates:
+                        conn.save_user_template(user, fingers)
+                conn.refresh_data()
+            finally:
+                conn.enable_device()
+
+        restored_templates = sum(len(fingers) for _, fingers in user_templates)
+        logger.info(f"Restored {len(user_templates)} users and {restored_templates} templates "
+                    f"from backup of {source_device_id} to device {target_device_id}")
+        return {
+            'source_device_id': source_device_id,
+            'target_device_id': target_device_id,
+            'users': len(user_templates),
+            'templates': restored_templates
+        }
+
+    def list_backups(self):
+        """List archived device backups"""
+        return self.archive.list_manifests()
+
+# Create a global instance of the template backup service
+template_backup = TemplateBackupService()